@@ -0,0 +1,95 @@
+import json
+
+
+class BallotBox:
+    """an in-memory collection of ballots keyed by ballot id (see ballot_id) that
+    keeps a per-candidate vote count up to date as ballots are added or removed,
+    so results can be read without counting ballots.
+    It behaves like a dict of ballot_id -> ballot. Reads do not take a lock, so they
+    copy the counts in single steps in case a writer changes them meanwhile.
+
+    Args:
+        ballots (iterable): ballots (dict) to add to the ballot box
+    """
+
+    def __init__(self, ballots=()):
+        self._ballots = dict()          # ballot_id -> ballot
+        self._tallies = dict()          # election_code -> position_id -> candidate_id -> count
+        self._elections = dict()        # election_code -> dict of ballot ids (used as an ordered set)
+
+        for ballot in ballots:
+            self[ballot["ballot_id"]] = ballot
+
+    @staticmethod
+    def ballot_id(election_code, position_id, student_id):
+        # a student can only cast one ballot per position of an election, the parts are
+        # encoded as a JSON list since election codes and position ids are free strings
+        return json.dumps([election_code, position_id, student_id])
+
+    def _count(self, ballot, change):
+        positions = self._tallies.setdefault(ballot["election_code"], dict())
+        candidates = positions.setdefault(ballot["position_id"], dict())
+        candidates[ballot["candidate_id"]] = candidates.get(ballot["candidate_id"], 0) + change
+
+    def __setitem__(self, ballot_id, ballot):
+        if ballot_id in self._ballots:
+            del self[ballot_id]
+
+        self._ballots[ballot_id] = ballot
+        self._elections.setdefault(ballot["election_code"], dict())[ballot_id] = None
+        self._count(ballot, 1)
+
+    def __delitem__(self, ballot_id):
+        ballot = self._ballots.pop(ballot_id)
+        self._count(ballot, -1)
+
+        election = self._elections[ballot["election_code"]]
+        del election[ballot_id]
+        if not election:
+            del self._elections[ballot["election_code"]]
+            del self._tallies[ballot["election_code"]]
+
+    def __getitem__(self, ballot_id):
+        return self._ballots[ballot_id]
+
+    def __contains__(self, ballot_id):
+        return ballot_id in self._ballots
+
+    def __iter__(self):
+        return iter(self._ballots)
+
+    def __len__(self):
+        return len(self._ballots)
+
+    def get(self, ballot_id, default=None):
+        return self._ballots.get(ballot_id, default)
+
+    def values(self):
+        return self._ballots.values()
+
+    def ballot_ids(self, election_code):
+        """returns the ids of all ballots cast in an election
+
+        Args:
+            election_code (str): the election's code
+
+        Returns:
+            list: a list of ballot ids
+        """
+
+        return list(self._elections.get(election_code, dict()))
+
+    def tallies(self, election_code):
+        """returns the vote counts of an election
+
+        Args:
+            election_code (str): the election's code
+
+        Returns:
+            dict: maps a position id to a dict of candidate id -> number of votes
+        """
+
+        # copied in single steps (list and dict copy a dict at once), since the counts
+        # may be changed by writers while they are read
+        positions = self._tallies.get(election_code, dict())
+        return {position_id: dict(candidates) for position_id, candidates in list(positions.items())}
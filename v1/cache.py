@@ -0,0 +1,97 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class ReadThroughCache:
+    """a bounded, thread-safe cache that loads missing values on read.
+    Values expire ttl seconds after being loaded and the least recently used
+    value is evicted when more than max_size values are cached. Values are
+    copied in and out so that callers cannot change the cached values
+
+    Args:
+        load (function): called with a key to read its value, returning None if it does not exist
+        max_size (int): the maximum number of cached values
+        ttl (float): the number of seconds a value is served before it is read again
+    """
+
+    def __init__(self, load, max_size=128, ttl=5):
+        self.load = load
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expiry time, value), least recently used first
+        self._loads = dict()            # key being loaded -> [number of loads, invalidations since the loads started]
+
+    def get(self, key):
+        """returns the value of a key from the cache, or loads and caches it
+
+        Args:
+            key (str): the key
+
+        Returns:
+            dict: a copy of the value or None if it does not exist (which is not cached)
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+
+            self.misses += 1
+            loads = self._loads.setdefault(key, [0, 0])
+            loads[0] += 1
+            generation = loads[1]
+
+        try:
+            value = self.load(key)
+        finally:
+            with self._lock:
+                # a value loaded while its key was invalidated may already be stale
+                loads[0] -= 1
+                is_stale = loads[1] != generation
+                if not loads[0]:
+                    del self._loads[key]
+
+        if value is None:
+            return None
+
+        with self._lock:
+            if not is_stale:
+                self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+                self._entries.move_to_end(key)
+                if len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        return value
+
+    def invalidate(self, key):
+        """removes a key's value from the cache, so that the next read loads it again
+
+        Args:
+            key (str): the key
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+            # only the loads of this key in progress are discarded
+            if key in self._loads:
+                self._loads[key][1] += 1
+
+    def stats(self):
+        """returns the cache's size, limits and hit/miss counters
+
+        Returns:
+            dict: size, max_size, ttl, hits and misses
+        """
+
+        with self._lock:
+            return {
+                "size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses
+            }
@@ -1,84 +1,209 @@
+import io
+import os
+import csv
 import json
-from flask import jsonify
+import hashlib
+from datetime import datetime
+from flask import Response, current_app, jsonify, g, has_request_context, stream_with_context
+
+from ballots import BallotBox
+from cache import ReadThroughCache
+from live import TallyFeed
+from registry import VoterRegistry
+from schema import Field, Schema
+from storage import open_storage, FILE_FORMATS
+
+# request bodies are decoded with orjson if it is installed
+try:
+    from orjson import loads as decode_json
+except ImportError:
+    from json import loads as decode_json
 
 # the first year group for Ashesi University
 FIRST_YEAR_GROUP = 2002
 
+# keys expected in a voter's information
+VOTERS_KEYS = [
+        "student_id", "firstname", "lastname", "email"
+    ]
+
+# the attributes of a voter that can be selected with the fields argument of retrieve_voters
+VOTER_FIELDS = VOTERS_KEYS + ["is_registered"]
+
+# the largest number of voters returned in one page of retrieve_voters
+MAX_PAGE_SIZE = 1000
+
 VOTERS_FILE = "./data/voters.txt"
 ELECTIONS_FILE = "./data/elections.txt"
+BALLOTS_FILE = "./data/ballots.txt"
 
+# storage backend used by the API: "log" (append-only log, served from memory)
+# or "file" (re-reads and rewrites the whole file on every request)
+STORAGE_BACKEND = os.environ.get("VOTING_STORAGE_BACKEND", "log")
+COMPACT_INTERVAL = int(os.environ.get("VOTING_COMPACT_INTERVAL", "60"))
 
-def valid_request_body(request):
-    """ensures that the request body is valid (not empty)
+# seconds a write waits for other writes to share its (synced) write to disk
+COMMIT_WINDOW = float(os.environ.get("VOTING_COMMIT_WINDOW", "0.002"))
+
+# format the data files are written in (see FILE_FORMATS), files in any format are read
+FILE_FORMAT = os.environ.get("VOTING_FILE_FORMAT", "compact")
+if FILE_FORMAT not in FILE_FORMATS:
+    raise ValueError(f"VOTING_FILE_FORMAT must be one of {', '.join(FILE_FORMATS)}")
+
+# live results: at most LIVE_MAX_RATE updates per second are published per election,
+# stream viewers receive a keep-alive comment every LIVE_KEEPALIVE_INTERVAL seconds
+# without updates and long-poll requests wait at most LIVE_POLL_TIMEOUT seconds
+LIVE_MAX_RATE = float(os.environ.get("VOTING_LIVE_MAX_RATE", "2"))
+LIVE_KEEPALIVE_INTERVAL = 15
+LIVE_POLL_TIMEOUT = 25
+
+# elections read by retrieve_election are cached for VOTING_ELECTION_CACHE_TTL seconds
+# (at most VOTING_ELECTION_CACHE_SIZE elections), and dropped when they are changed
+ELECTION_CACHE_SIZE = int(os.environ.get("VOTING_ELECTION_CACHE_SIZE", "128"))
+ELECTION_CACHE_TTL = float(os.environ.get("VOTING_ELECTION_CACHE_TTL", "5"))
+
+def count_writes(num_writes=1):
+    """records writes made to the data files while handling the current request,
+    which are reported in the X-Write-Count response header (see add_write_count)
 
     Args:
-        request (tuple): the request being sent to the API
+        num_writes (int): the number of writes (a log append or a file rewrite counts as one)
+    """
+    
+    if has_request_context():
+        g.write_count = g.get("write_count", 0) + num_writes
+
+
+def write_count():
+    """returns the number of writes made to the data files so far while handling the
+    current request, e.g. for the last line of a streamed response (see add_write_count)
 
     Returns:
-        JSON: a boolean of whether or not the request is valid
+        int: the number of writes
     """
     
-    if not request.data:
-        return False    
-    return True
+    return g.get("write_count", 0)
 
 
-def read_from_file(filepath):
-    """reads data from a file and return it
+def add_write_count(response):
+    """sets the X-Write-Count header of a response to the number of writes
+    made to the data files while handling the request. Streamed responses (e.g. of
+    bulk_register) write while they are sent, after their headers, so they report
+    their writes in their body instead (see write_count)
 
     Args:
-        filepath (str): the file path
+        response (Response): the response being returned
 
     Returns:
-        str: a string representation of the data in the file
+        Response: the response
     """
     
-    read_file = open(filepath, "r")
-    data = read_file.read()
-        
-    return data
+    if response.is_streamed:
+        return response
+    
+    response.headers["X-Write-Count"] = str(write_count())
+    return response
 
 
-def write_to_file(filepath, data):
-    """writes provided json data to specified file path
+def make_etag(*parts):
+    """derives an ETag from the given parts (e.g. version counters and request arguments)
 
-    Args:
-        filepath (str): the file path
-        data (json): a list of dict
+    Returns:
+        str: the ETag (unquoted)
     """
     
-    write_file = open(filepath, "w")
-    write_file.write(json.dumps(data, indent=4))
-    write_file.close()
-    
-    
-def valid_keys(voter_info, expected_keys):
-    """validates a voter's information and returns result
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def not_modified(request, etag):
+    """returns a 304 response if the client already has the representation with the
+    given ETag (sent in the If-None-Match header), so the response body is not built
 
     Args:
-        voter_info (dict): JSON representation of a voter's information
+        request (Request): the request being handled
+        etag (str): the ETag of the current representation
 
     Returns:
-        dict: a dictionary of boolean and or list of messages from validation
+        Response: a 304 response or None if the client's representation is outdated
     """
     
-    result = {"is_valid": False}            # result from validation
-    result_message = []                     # message from validation
-    num_correct_keys = 0                    # variable to keep track of the number of matching keys
-    data_keys = voter_info.keys()
+    if not request.if_none_match.contains(etag):
+        return None
     
-    for key in expected_keys:
-        if key in data_keys:
-            num_correct_keys += 1
-        else:
-            result_message.append(f"{key.capitalize()} is required")
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def with_etag(response, etag):
+    """sets the ETag header of a response
+
+    Args:
+        response (Response): the response being returned
+        etag (str): the ETag of the response's representation
+
+    Returns:
+        Response: the response
+    """
     
-    if num_correct_keys == len(expected_keys):
-        result["is_valid"] = True
-    else:
-        result["message"] = result_message
+    response.set_etag(etag)
+    return response
+
+
+storage = open_storage(
+    STORAGE_BACKEND,
+    {
+        "voters": (VOTERS_FILE, "student_id"),
+        "elections": (ELECTIONS_FILE, "election_code"),
+        "ballots": (BALLOTS_FILE, "ballot_id")
+    },
+    containers={"voters": VoterRegistry, "ballots": BallotBox},
+    on_write=count_writes,
+    file_format=FILE_FORMAT,
+    commit_window=COMMIT_WINDOW,
+    compact_interval=COMPACT_INTERVAL
+)
+
+# vote counts of the elections with live results viewers, updated by cast_ballot and read
+# again whenever the ballots' version changes (e.g. by votes cast in other processes)
+tally_feed = TallyFeed(
+    lambda election_code: storage.index("ballots").tallies(election_code),
+    max_rate=LIVE_MAX_RATE, version=lambda: storage.version("ballots")
+)
+
+
+def valid_request_body(request):
+    """ensures that the request body is valid (not empty)
+
+    Args:
+        request (tuple): the request being sent to the API
+
+    Returns:
+        JSON: a boolean of whether or not the request is valid
+    """
     
-    return result
+    if not request.data:
+        return False    
+    return True
+
+
+def request_json(request):
+    """returns the request's JSON body, decoded once per request (with orjson if it is
+    installed) and reused by every handler and helper that reads it
+
+    Args:
+        request (Request): the request being sent to the API
+
+    Returns:
+        the decoded JSON body (e.g. dict)
+    """
+
+    if not has_request_context():
+        return decode_json(request.data)
+
+    if "request_json" not in g:
+        g.request_json = decode_json(request.data)
+    return g.request_json
 
 
 def key_is_unique(key_list, dictionary_list, voter_info):
@@ -104,9 +229,33 @@ def key_is_unique(key_list, dictionary_list, voter_info):
     return result
 
 
+def voter_key_is_unique(key_list, registry, voter_info):
+    """ensures that all values corresponding to unique keys in the provided 
+    voter information are not used by any other voter in the registry.
+    When student_id is not one of the unique keys (i.e. an update), the voter's
+    own record is not treated as a conflict
+
+    Args:
+        key_list (list): list of unique keys (student_id and or email)
+        registry (VoterRegistry): the registry of existing voters
+        voter_info (dict): a dictionary containing voter information
+
+    Returns:
+        result: a dictionary containing the result from unique test
+    """
+    
+    result = dict()
+    student_id = None if "student_id" in key_list else voter_info["student_id"]
+    for key in key_list:
+        if not registry.is_unique(key, voter_info[key], student_id):
+            result[key] = key + " already exists!"
+    
+    return result
+
+
 def valid_student_id(student_id):
     """ensures that a given student_id is valid
-    - a student ID is valid if it's eight characters long and numeric
+    - a student ID is valid if it's eight characters long and made of the digits 0-9
 
     Args:
         student_id (str): a student's ID
@@ -120,8 +269,9 @@ def valid_student_id(student_id):
     if(len(student_id)) != 8:
         return False
     
-    # ensure that the student id is numeric
-    if not student_id.isnumeric():
+    # ensure that the student id is made of decimal digits (isnumeric also accepts
+    # characters like ½ that int cannot parse)
+    if not (student_id.isascii() and student_id.isdigit()):
         return False
     
     user_id = student_id[:4]
@@ -130,6 +280,116 @@ def valid_student_id(student_id):
     return {"user_id": user_id, "year_group": year_group} 
 
 
+def is_iso_date(value):
+    # election start dates are ISO dates, with or without a time (e.g. 2023-03-27 13:57:30)
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+# schemas of the request data, compiled once when the API starts (see schema.py)
+VOTER_SCHEMA = Schema({
+        "student_id": Field(str, checks=[
+            (valid_student_id, "Student ID is not valid."),
+            # only reached for valid student ids, whose year group int can parse
+            (lambda student_id: int(student_id[4:]) >= FIRST_YEAR_GROUP, "Student year group is invalid.")
+        ]),
+        "firstname": Field(str, checks=[(str.isalpha, "{label} must only contain letters.")]),
+        "lastname": Field(str, checks=[(str.isalpha, "{label} must only contain letters.")]),
+        "email": Field(str, checks=[
+            (lambda email: email.endswith("@ashesi.edu.gh"), "Email must be a valid Ashesi email address.")
+        ])
+    })
+
+POSITION_SCHEMA = Schema({
+        "position_id": Field(str, checks=[(bool, "{label} must not be empty.")]),
+        "position_name": Field(str, checks=[(bool, "{label} must not be empty.")]),
+        "candidates": Field(
+            list, items=Field(str, checks=[(valid_student_id, "{label} is not a valid student ID.")]),
+            item_label="Candidate", min_items=1, unique=True
+        )
+    })
+
+ELECTION_SCHEMA = Schema({
+        "election_code": Field(str, checks=[(bool, "{label} must not be empty.")]),
+        "election_name": Field(str, checks=[(bool, "{label} must not be empty.")]),
+        "election_startdate": Field(str, checks=[(is_iso_date, "{label} must be a date (e.g. 2023-03-27).")]),
+        "election_period": Field((int, float), checks=[(lambda hours: hours > 0, "{label} must be a positive number of hours.")]),
+        "positions": Field(list, items=POSITION_SCHEMA, item_label="Position", min_items=1, unique="position_id")
+    })
+
+VOTE_SCHEMA = Schema({
+        "student_id": Field(str, checks=[(valid_student_id, "Student ID is not valid.")]),
+        "candidate_id": Field(str, checks=[(valid_student_id, "Candidate ID is not valid.")])
+    })
+
+
+def schema_error(errors):
+    """returns the response describing the validation errors of request data
+
+    Args:
+        errors (list): the messages returned by a schema (see Schema.errors)
+
+    Returns:
+        dict: the first message (message) and all the messages (errors), or None if there are none
+    """
+    
+    if not errors:
+        return None
+    return {"message": errors[0], "errors": errors}
+
+
+def voter_info_error(voter_info):
+    """ensures that a voter's information contains all necessary keys and that
+    student_id, firstname, lastname and email are syntactically valid (see VOTER_SCHEMA)
+
+    Args:
+        voter_info (dict): a dictionary containing voter information
+
+    Returns:
+        dict: the messages describing why the information is not valid (see schema_error),
+        or None if it is valid
+    """
+    
+    return schema_error(VOTER_SCHEMA.errors(voter_info))
+
+
+
+def read_voter_rows(request):
+    """parses a streamed request body of voters one row at a time, without
+    reading the whole body into memory. The body is read as CSV (with a header row)
+    if its content type is text/csv and as NDJSON (one JSON object per line) otherwise
+
+    Args:
+        request (tuple): request from client
+
+    Returns:
+        generator: tuples of the row number and the voter's information (dict),
+        which is None if the row could not be parsed
+    """
+    
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8")
+    
+    if request.mimetype == "text/csv":
+        for row_number, row in enumerate(csv.DictReader(lines), start=1):
+            # drop missing values (short rows) and values without a header (long rows)
+            yield row_number, {key: value for key, value in row.items() if key is not None and value is not None}
+        return
+    
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        
+        try:
+            voter_info = decode_json(line)
+        except ValueError:
+            voter_info = None
+        
+        yield row_number, voter_info if isinstance(voter_info, dict) else None
+
+
 def valid_voter_info(request, unique_keys):
     """ensures that a voter request data is valid
     i.e. contains all necessary keys, contains unique values for
@@ -150,46 +410,24 @@ def valid_voter_info(request, unique_keys):
         return jsonify({"message": "Voter information missing!"}), 400
     
     # get request data
-    voter_info = json.loads(request.data)
+    voter_info = request_json(request)
     
-    # ensure that the data contains all expected fields
+    # ensure that the voter's information is syntactically valid
     # if validation fails, return appropriate message
-    # expected keys
-    VOTERS_KEYS = [
-            "student_id", "firstname", "lastname", "email"
-        ]
-    
-    validate_data = valid_keys(voter_info, VOTERS_KEYS)
-    if validate_data["is_valid"] == False:
-        return jsonify(validate_data["message"]), 400
-    
-    # ensure that the student_id is synctactically correct since
-    # the system assumes a certain format for later computation
-    student_id_is_valid = valid_student_id(voter_info["student_id"])
-    if not student_id_is_valid:
-        return jsonify({"message": "Student ID is not valid."}), 400
-    elif int(student_id_is_valid["year_group"]) < FIRST_YEAR_GROUP:
-        return jsonify({"message": "Student year group is invalid."})
-    
-    # ensure that the email is a valid ashesi email
-    if not voter_info["email"].endswith("@ashesi.edu.gh"):
-        return jsonify({"message": "Email must be a valid Ashesi email address."}), 400
+    error = voter_info_error(voter_info)
+    if error is not None:
+        return jsonify(error), 400
     
-    # ensure that firstname and lastname is valid (is a string)
-    if not str(voter_info["firstname"]).isalpha() or not str(voter_info["lastname"]).isalpha():
-        return jsonify({"message": "Firstname or Lastname must be a string."}), 400
-    
-    # reading existing data into a list
-    data = read_from_file(VOTERS_FILE)
+    # get the indexed registry of existing voters
+    registry = storage.index("voters")
     
     # if no voter has been registered, skip unique test
-    if not data:
+    if not registry:
         return {"data": voter_info}
     
     # ensure keys are unique
     # if unique contraints fails, return appropriate response
-    data_list = json.loads(data)
-    ununique_result = key_is_unique(unique_keys, data_list, voter_info)
+    ununique_result = voter_key_is_unique(unique_keys, registry, voter_info)
     if len(ununique_result) > 0:
         return jsonify(ununique_result), 400
     
@@ -197,20 +435,255 @@ def valid_voter_info(request, unique_keys):
 
 
 def get_voters(id_list):
+    """ensures that all voters with the given student ids are registered
+
+    Args:
+        id_list (list): a list of student ids
+
+    Returns:
+        dict: the matching voters keyed by student id, or False if any of them
+        is missing or has been de-registered
+    """
     
-    result_list = list()
     return_data = dict()
-    # read voters database
-    data = read_from_file(VOTERS_FILE)
+    registry = storage.index("voters")
+    for student_id in id_list:
+        voter = registry.get(student_id)
+        if voter is None or bool(voter["is_registered"]) == False:
+            return False
+        return_data[student_id] = voter
+
+    return return_data
+
+
+def page_arguments(request):
+    """reads the pagination and projection arguments of a request retrieving voters:
+    limit (the maximum number of voters to return), cursor (the student id of the last
+    voter of the previous page) and fields (comma separated attributes to return)
+
+    Args:
+        request (Request): the request being sent to the API
+
+    Returns:
+        dict: limit, cursor and fields (None if not provided) or a JSON response
+        of the invalid argument
+    """
+    
+    limit = request.args.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= MAX_PAGE_SIZE:
+            return jsonify({"message": f"limit must be a number from 1 to {MAX_PAGE_SIZE}."}), 400
+        limit = int(limit)
+    
+    cursor = request.args.get("cursor")
+    if cursor is not None and not valid_student_id(cursor):
+        return jsonify({"message": "cursor must be a valid student id."}), 400
+    
+    fields = request.args.get("fields")
+    if fields is not None:
+        fields = fields.split(",")
+        invalid_fields = [field for field in fields if field not in VOTER_FIELDS]
+        if invalid_fields:
+            return jsonify({"message": f"Invalid fields: {', '.join(invalid_fields)}."}), 400
     
-    if not data:
-        return {"message": "No voter has been registered!"}
+    return {"limit": limit, "cursor": cursor, "fields": fields}
+
+
+def split_page(voters, limit):
+    """splits a page of voters from voters read past the page (at least limit + 1 of them
+    if there is a next page)
+
+    Args:
+        voters (iterable): voters (dict) ordered by student id
+        limit (int): the page size, or None for a single page of all voters
+
+    Returns:
+        tuple: the page (an iterable of all voters if limit is None, otherwise a list)
+        and the cursor of the next page (None if it is the last page)
+    """
+    
+    if limit is None:
+        return voters, None
+    
+    voters = list(voters)
+    if len(voters) <= limit:
+        return voters, None
+    return voters[:limit], voters[limit - 1]["student_id"]
+
+
+def paginate(voters, cursor=None, limit=None):
+    """returns a page of voters ordered by student id
+
+    Args:
+        voters (list): a list of voters (dict)
+        cursor (str): the student id of the last voter of the previous page
+        limit (int): the page size
+
+    Returns:
+        tuple: the page (list) and the cursor of the next page (None if it is the last page)
+    """
+    
+    voters = sorted(voters, key=lambda voter: voter["student_id"])
+    if cursor is not None:
+        voters = [voter for voter in voters if voter["student_id"] > cursor]
+    return split_page(voters, limit)
+
+
+def voters_response(voters, next_cursor=None, fields=None):
+    """returns the JSON response of a page of voters, with only the requested
+    fields and the cursor of the next page in the X-Next-Cursor header
+
+    Args:
+        voters (iterable): voters (dict)
+        next_cursor (str): the cursor of the next page (None if it is the last page)
+        fields (list): the voter attributes to return (None for all of them)
+
+    Returns:
+        Response: the streamed JSON response
+    """
+    
+    if fields is not None:
+        voters = ({field: voter[field] for field in fields if field in voter} for voter in voters)
     
-    voters_data = json.loads(data)
-    for voter in voters_data:
-        if voter["student_id"] in id_list and bool(voter["is_registered"]) == True:
-            result_list.append(voter)
-            if len(result_list) == len(id_list):
-                return return_data
+    response = stream_json_array(voters)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
-    return False
+
+def stream_json_array(items):
+    """returns a response that streams the given items as a JSON array, serializing
+    (and reading, if items is a generator) one item at a time, so that neither the
+    list nor its serialized form is held in memory
+
+    Args:
+        items (iterable): JSON serializable items
+
+    Returns:
+        Response: the streamed JSON response
+    """
+    
+    def serialize():
+        yield "["
+        for index, item in enumerate(items):
+            yield ("," if index else "") + current_app.json.dumps(item, separators=(",", ":"))
+        yield "]\n"
+    
+    return Response(stream_with_context(serialize()), mimetype="application/json")
+
+
+def attach_tallies(election, tallies):
+    """replaces the list of voters kept on each candidate of elections created before
+    ballots were stored separately with the candidate's number of votes
+
+    Args:
+        election (dict): an election (modified in place)
+        tallies (dict): maps a position id to a dict of candidate id -> number of votes
+
+    Returns:
+        dict: the election
+    """
+    
+    for position in election["positions"]:
+        counts = tallies.get(position["position_id"], dict())
+        for candidate in position["candidates"]:
+            legacy_votes = len(candidate.pop("candidate_voters", []))
+            candidate["num_votes"] = counts.get(candidate["candidate_id"], 0) + legacy_votes
+    
+    return election
+
+
+def election_results(election, tallies):
+    """summarises an election's vote counts: each position's candidates with their
+    number of votes, the position's turnout (number of ballots cast) and its leader(s)
+
+    Args:
+        election (dict): an election
+        tallies (dict): maps a position id to a dict of candidate id -> number of votes
+
+    Returns:
+        dict: the election's results
+    """
+    
+    positions = list()
+    for position in attach_tallies(election, tallies)["positions"]:
+        candidates = [
+            {"candidate_id": candidate["candidate_id"], "num_votes": candidate["num_votes"]}
+            for candidate in position["candidates"]
+        ]
+        turnout = sum(candidate["num_votes"] for candidate in candidates)
+        
+        # all candidates with the most votes lead (ties have several leaders)
+        leader = list()
+        if turnout > 0:
+            most_votes = max(candidate["num_votes"] for candidate in candidates)
+            leader = [candidate["candidate_id"] for candidate in candidates if candidate["num_votes"] == most_votes]
+        
+        positions.append({
+            "position_id": position["position_id"], "position_name": position["position_name"],
+            "candidates": candidates, "turnout": turnout, "leader": leader
+        })
+    
+    return {
+        "election_code": election["election_code"], "election_name": election["election_name"],
+        "positions": positions
+    }
+
+
+def election_etag(election_code):
+    """returns the ETag of an election with its vote counts, derived from the current
+    versions of the elections and ballots (which include writes made by other processes)
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        str: the ETag
+    """
+    
+    return make_etag(election_code, storage.version("elections"), storage.version("ballots"))
+
+
+def read_election(election_code):
+    """reads an election with the number of votes of each of its candidates, and its
+    ETag, derived from the versions of the elections and ballots read with it
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        dict: the election (election) and its ETag (etag) or None if the election does not exist
+    """
+    
+    # the versions are read first, so that a write made while the election is read
+    # changes the ETag of the next read rather than being hidden behind this one
+    etag = election_etag(election_code)
+    election = storage.get("elections", election_code)
+    if election is None:
+        return None
+    return {"election": attach_tallies(election, storage.index("ballots").tallies(election_code)), "etag": etag}
+
+
+# elections with their vote counts and ETags, read through the cache by retrieve_election
+election_cache = ReadThroughCache(read_election, max_size=ELECTION_CACHE_SIZE, ttl=ELECTION_CACHE_TTL)
+
+
+def cast_ballot(ballot):
+    """stores a ballot unless the student has already voted for the ballot's position.
+    The check and the write are a single storage step (see insert), so concurrent
+    votes (from the server's threads) cannot both be cast. The position's new vote
+    counts are pushed to the live results feed
+
+    Args:
+        ballot (dict): the ballot (ballot_id, election_code, position_id, student_id and candidate_id)
+
+    Returns:
+        bool: whether or not the ballot was cast (False if the student already voted)
+    """
+    
+    if not storage.insert("ballots", ballot):
+        return False
+    
+    tallies = storage.index("ballots").tallies(ballot["election_code"])
+    tally_feed.update(ballot["election_code"], ballot["position_id"], tallies.get(ballot["position_id"], dict()))
+    return True
@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import deque
+
+
+class TallyFeed:
+    """an in-memory feed of the vote counts of the elections being watched, so that
+    any number of live results viewers can be served without reading storage.
+    Vote counts are pushed with update as votes are cast, and bursts of updates are
+    coalesced into at most max_rate versions per second, each recording only the
+    counts that changed (a delta) since the previous version.
+
+    Args:
+        load_tallies (function): called with an election code to read its vote counts
+        (a dict of position id -> dict of candidate id -> number of votes) when it is first watched
+        watch (function): called with an election code when it is first watched, to start
+        pushing its updates, and returns a function that stops them (or None)
+        max_rate (float): the maximum number of versions published per second per election
+        history (int): the number of deltas kept per election for viewers catching up
+        version (function): returns a value that changes whenever vote counts are stored. If
+        given, it is polled while elections are watched and their counts are read again when
+        it changes, to pick up votes that were not pushed with update (e.g. cast by other processes)
+    """
+
+    def __init__(self, load_tallies, watch=None, max_rate=2, history=100, version=None):
+        self.load_tallies = load_tallies
+        self.watch = watch or (lambda election_code: None)
+        self.version = version
+        self.interval = 1 / max_rate
+        self.history = history
+        self._condition = threading.Condition()
+        self._elections = dict()        # election_code -> state of the election's feed
+        self._dirty = set()             # election codes with unpublished updates
+        self._polled_version = None     # the version of the counts last read by _poll
+
+        publisher = threading.Thread(target=self._publish_periodically, daemon=True)
+        publisher.start()
+
+    def _track(self, election_code):
+        with self._condition:
+            if election_code in self._elections:
+                return self._elections[election_code]
+
+        tallies = self.load_tallies(election_code)
+        with self._condition:
+            # another viewer may have started watching the election while it was loading
+            if election_code not in self._elections:
+                self._elections[election_code] = {
+                    "version": 0, "tallies": tallies,
+                    "pending": {position_id: dict(candidates) for position_id, candidates in tallies.items()},
+                    "deltas": deque(maxlen=self.history), "is_dropped": False, "unwatch": None
+                }
+                is_new = True
+                # starts polling the version, if any
+                self._condition.notify_all()
+            else:
+                is_new = False
+            state = self._elections[election_code]
+
+        if is_new:
+            state["unwatch"] = self.watch(election_code)
+        return state
+
+    def update(self, election_code, position_id, candidates):
+        """records the current vote counts of a position, to be published with the next version.
+        Updates of elections that are not being watched are ignored
+
+        Args:
+            election_code (str): the election's code
+            position_id (str): the position's id
+            candidates (dict): maps a candidate id to the candidate's number of votes
+        """
+
+        with self._condition:
+            state = self._elections.get(election_code)
+            if state is None:
+                return
+
+            state["pending"][position_id] = dict(candidates)
+            self._dirty.add(election_code)
+            self._condition.notify_all()
+
+    def drop(self, election_code):
+        """stops watching an election (e.g. when it is deleted) and ends its viewers' feeds
+
+        Args:
+            election_code (str): the election's code
+        """
+
+        with self._condition:
+            state = self._elections.pop(election_code, None)
+            if state is None:
+                return
+
+            state["is_dropped"] = True
+            self._dirty.discard(election_code)
+            self._condition.notify_all()
+
+        if state["unwatch"] is not None:
+            state["unwatch"]()
+
+    def _publish(self, state):
+        delta = dict()
+        for position_id, candidates in state["pending"].items():
+            published = state["tallies"].get(position_id, dict())
+            changed = {
+                candidate_id: num_votes for candidate_id, num_votes in candidates.items()
+                if published.get(candidate_id) != num_votes
+            }
+            if changed:
+                delta[position_id] = changed
+
+        if delta:
+            state["version"] += 1
+            for position_id, changed in delta.items():
+                state["tallies"].setdefault(position_id, dict()).update(changed)
+            state["deltas"].append((state["version"], delta))
+
+    def _poll(self):
+        # the version is read before the counts, so that votes stored while they are
+        # read change the version again and are picked up by the next poll
+        version = self.version()
+        if version == self._polled_version:
+            return
+        self._polled_version = version
+
+        with self._condition:
+            election_codes = list(self._elections)
+        for election_code in election_codes:
+            for position_id, candidates in self.load_tallies(election_code).items():
+                self.update(election_code, position_id, candidates)
+
+    def _publish_periodically(self):
+        while True:
+            with self._condition:
+                # without a version to poll, nothing changes until an update is made
+                while not self._dirty and (self.version is None or not self._elections):
+                    self._condition.wait()
+
+            if self.version is not None:
+                self._poll()
+
+            with self._condition:
+                for election_code in self._dirty:
+                    self._publish(self._elections[election_code])
+                self._dirty.clear()
+                self._condition.notify_all()
+
+            # updates made while waiting are coalesced into the next version
+            time.sleep(self.interval)
+
+    def changes_since(self, election_code, version=None, timeout=None):
+        """waits until a version newer than the given version is published and returns
+        the counts that changed since then. If no version is given, or the version is
+        too old to be caught up with deltas, all the election's counts are returned
+
+        Args:
+            election_code (str): the election's code
+            version (int): the last version received by the viewer
+            timeout (float): the maximum number of seconds to wait
+
+        Returns:
+            dict: the new version, the changed counts (tallies) and whether or not they are
+            all the election's counts (reset), or None if the election is no longer watched.
+            If the timeout expires first the tallies are empty and the version is unchanged
+        """
+
+        state = self._track(election_code)
+        with self._condition:
+            if version is not None:
+                self._condition.wait_for(lambda: state["is_dropped"] or state["version"] > version, timeout)
+            if state["is_dropped"]:
+                return None
+
+            deltas = [(number, delta) for number, delta in state["deltas"] if version is not None and number > version]
+            is_reset = version is None or version > state["version"] or (
+                version < state["version"] and (not deltas or deltas[0][0] != version + 1)
+            )
+
+            if is_reset:
+                tallies = {position_id: dict(candidates) for position_id, candidates in state["tallies"].items()}
+            else:
+                tallies = dict()
+                for _, delta in deltas:
+                    for position_id, changed in delta.items():
+                        tallies.setdefault(position_id, dict()).update(changed)
+
+            return {"version": state["version"], "tallies": tallies, "reset": is_reset}
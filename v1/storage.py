@@ -0,0 +1,832 @@
+# import necessary libraries
+import os
+import copy
+import json
+import mmap
+import time
+import struct
+import tempfile
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# formats of the data files: "pretty" (indented JSON, the original format), "compact"
+# (minified JSON) or "records" (length-prefixed records, see write_records)
+FILE_FORMATS = ["pretty", "compact", "records"]
+
+# the first bytes of a file in the records format
+RECORDS_MAGIC = b"VOTREC1\n"
+
+# the header of each record: the length of the record's key and of its JSON
+RECORD_HEADER = struct.Struct(">HI")
+
+
+@contextlib.contextmanager
+def atomic_write(filepath, mode="w"):
+    """opens a temporary file next to filepath that replaces filepath once it has been
+    written and synced to disk, so that filepath always holds a complete file (the old
+    one or the new one) even if the program crashes while writing
+
+    Args:
+        filepath (str): the file path
+        mode (str): "w" for text or "wb" for bytes
+
+    Returns:
+        file: the temporary file to write to
+    """
+
+    directory = os.path.dirname(os.path.abspath(filepath))
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, mode) as temporary_file:
+            yield temporary_file
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, filepath)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    # sync the directory so that the rename itself survives a crash
+    if hasattr(os, "O_DIRECTORY"):
+        directory_descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory_descriptor)
+        finally:
+            os.close(directory_descriptor)
+
+
+def write_to_file(filepath, data, file_format="pretty", key=None):
+    """writes provided json data to specified file path
+
+    Args:
+        filepath (str): the file path
+        data (json): a list of dict
+        file_format (str): one of FILE_FORMATS
+        key (str): the attribute that identifies a record, stored before each record
+        in the records format
+    """
+
+    if file_format == "records":
+        write_records(filepath, data, key)
+        return
+
+    with atomic_write(filepath) as write_file:
+        if file_format == "compact":
+            write_file.write(json.dumps(data, separators=(",", ":")))
+        else:
+            write_file.write(json.dumps(data, indent=4))
+
+
+def write_records(filepath, data, key=None):
+    """writes records in the records format: RECORDS_MAGIC followed by, for each record,
+    a RECORD_HEADER, the record's key and the record as compact JSON (both UTF-8), so that
+    records can be skipped or looked up by key without parsing them
+
+    Args:
+        filepath (str): the file path
+        data (list): a list of dict
+        key (str): the attribute that identifies a record (its value is stored before the record)
+    """
+
+    with atomic_write(filepath, "wb") as write_file:
+        write_file.write(RECORDS_MAGIC)
+        for record in data:
+            record_key = str(record[key]).encode() if key is not None else b""
+            record_json = json.dumps(record, separators=(",", ":")).encode()
+            write_file.write(RECORD_HEADER.pack(len(record_key), len(record_json)))
+            write_file.write(record_key)
+            write_file.write(record_json)
+
+
+def iter_records(data):
+    """reads the records of a file in the records format
+
+    Args:
+        data (bytes): the file's content, starting with RECORDS_MAGIC
+
+    Returns:
+        generator: (key, offset, length) of each record, where offset and length
+        locate the record's JSON in data
+    """
+
+    offset = len(RECORDS_MAGIC)
+    while offset + RECORD_HEADER.size <= len(data):
+        key_length, record_length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        record_key = bytes(data[offset:offset + key_length]).decode()
+        offset += key_length
+        yield record_key, offset, record_length
+        offset += record_length
+
+
+def read_records(filepath):
+    """reads the records of a data file in any of FILE_FORMATS
+
+    Args:
+        filepath (str): the file path
+
+    Returns:
+        list: a list of dict (empty if the file is missing or empty)
+    """
+
+    if not os.path.exists(filepath):
+        return list()
+
+    with open(filepath, "rb") as read_file:
+        data = read_file.read()
+
+    if data.startswith(RECORDS_MAGIC):
+        return [json.loads(data[offset:offset + length]) for _, offset, length in iter_records(data)]
+
+    # pretty and compact files are both JSON
+    if not data.strip():
+        return list()
+    return json.loads(data)
+
+
+class GroupCommit:
+    """coalesces writes into shared commits: the first write of a round waits window
+    seconds for other writes to join it and then calls commit once for all of them.
+    Each write returns once a commit that started after it was made has finished
+
+    Args:
+        commit (function): writes the changes made so far to disk
+        window (float): the number of seconds a round stays open for writes to join it
+    """
+
+    def __init__(self, commit, window=0.002):
+        self.commit = commit
+        self.window = window
+        self._condition = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._round = None              # the round new writes join, committed by its first write
+
+    def wait(self):
+        """waits until the changes made before calling it have been committed
+
+        Raises:
+            Exception: the error raised by the commit
+        """
+
+        with self._condition:
+            is_leader = self._round is None
+            if is_leader:
+                self._round = {"is_done": False, "error": None}
+            current = self._round
+
+        if is_leader:
+            time.sleep(self.window)
+            with self._commit_lock:
+                with self._condition:
+                    # later writes join the next round
+                    self._round = None
+
+                try:
+                    self.commit()
+                except Exception as error:
+                    current["error"] = error
+
+                with self._condition:
+                    current["is_done"] = True
+                    self._condition.notify_all()
+        else:
+            with self._condition:
+                self._condition.wait_for(lambda: current["is_done"])
+
+        if current["error"] is not None:
+            raise current["error"]
+
+
+class RecordFile:
+    """a read-only, memory-mapped view of a data file in the records format with an
+    index of the offsets of its records by key, so that a record is read without
+    parsing the others. The index is rebuilt (from the record headers only) when the
+    file's modification time or size changes
+
+    Args:
+        filepath (str): the file path
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._signature = None          # (modification time, size) of the mapped file
+        self._map = None
+        self._offsets = dict()          # key -> (offset, length) of the record's JSON
+
+    def refresh(self):
+        """maps the file again if it has changed since it was last mapped
+
+        Returns:
+            bool: whether or not the file is in the records format
+        """
+
+        if not os.path.exists(self.filepath):
+            self.close()
+            return False
+
+        status = os.stat(self.filepath)
+        signature = (status.st_ino, status.st_mtime_ns, status.st_size)
+        if signature != self._signature:
+            self.close()
+            self._signature = signature
+
+            if status.st_size >= len(RECORDS_MAGIC):
+                with open(self.filepath, "rb") as read_file:
+                    mapped = mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+                if mapped[:len(RECORDS_MAGIC)] == RECORDS_MAGIC:
+                    self._map = mapped
+                    self._offsets = {key: (offset, length) for key, offset, length in iter_records(mapped)}
+                else:
+                    mapped.close()
+
+        return self._map is not None
+
+    def get(self, key):
+        """parses the record with the given key
+
+        Args:
+            key (str): the value of the record's key
+
+        Returns:
+            dict: the record or None if it does not exist
+        """
+
+        if key not in self._offsets:
+            return None
+
+        offset, length = self._offsets[key]
+        return json.loads(self._map[offset:offset + length])
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._signature = None
+        self._map = None
+        self._offsets = dict()
+
+
+class FileLock:
+    """an advisory lock (fcntl.flock) on a file, shared by every process using the same
+    data file. Where fcntl is not available (e.g. on Windows) the lock does nothing, so
+    only a single process can use the data files safely
+
+    Args:
+        path (str): the path of the lock file, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    @contextlib.contextmanager
+    def hold(self, exclusive=True):
+        """holds the lock (must not be nested in the same process, since flock
+        converts the lock held by the process instead of taking a second one)
+
+        Args:
+            exclusive (bool): whether to take the lock for writing (or for reading, shared with other readers)
+        """
+
+        if fcntl is None:
+            yield
+            return
+
+        if self._file is None:
+            self._file = open(self.path, "a")
+
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class FileStorage:
+    """stores every collection as a list of records in its own file (the original v1 layout).
+    Each write re-serializes the whole file into a temporary file that atomically replaces
+    it, and writes made within commit_window seconds of each other share one write (see
+    GroupCommit). Writes are queued until their commit, which holds the collection's file
+    lock and applies them to the latest data on disk, so several processes (e.g. gunicorn
+    workers) can share the data files without losing each other's writes. Reads only see
+    written data. The records of a collection are parsed again only when its file changes,
+    and a single record of a file in the records format is read through a RecordFile
+    without parsing the others.
+
+    Args:
+        collections (dict): maps a collection name to a tuple of (filepath, key) where
+        key is the attribute that uniquely identifies a record in that collection
+        containers (dict): maps a collection name to the dict-like class that holds
+        its records (e.g. VoterRegistry), collections not listed use a dict
+        on_write (function): called with the number of writes each time data is written to disk
+        file_format (str): the format files are written in (one of FILE_FORMATS), files
+        in any format are read
+        commit_window (float): the number of seconds writes wait for other writes to share a commit
+    """
+
+    def __init__(self, collections, containers=None, on_write=None, file_format="pretty", commit_window=0.002):
+        self.collections = collections
+        self.containers = containers or dict()
+        self.on_write = on_write or (lambda num_writes: None)
+        self.file_format = file_format
+        self.lock = threading.RLock()
+        self._indexes = dict()          # name -> (file signature, container) of the parsed files
+        self._files = dict()            # name -> RecordFile
+        self._pending = dict()          # name -> list of writes waiting to be committed
+        self._file_locks = {name: FileLock(self.lock_path(name)) for name in collections}
+        self._commits = {
+            name: GroupCommit(lambda name=name: self._commit(name), commit_window) for name in collections
+        }
+
+    def lock_path(self, name):
+        filepath, _ = self.collections[name]
+        return os.path.splitext(filepath)[0] + ".lock"
+
+    def _signature(self, name):
+        filepath, _ = self.collections[name]
+        if not os.path.exists(filepath):
+            return None
+
+        # files are replaced (not rewritten) on every change, so a change always gives a new inode
+        status = os.stat(filepath)
+        return (status.st_ino, status.st_mtime_ns, status.st_size)
+
+    def _load(self, name):
+        filepath, key = self.collections[name]
+
+        stored = self.containers.get(name, dict)()
+        for record in read_records(filepath):
+            stored[record[key]] = record
+        return stored
+
+    def _save(self, name, records):
+        filepath, key = self.collections[name]
+        write_to_file(filepath, list(records.values()), self.file_format, key)
+        with self.lock:
+            self._indexes[name] = (self._signature(name), records)
+        self.on_write(1)
+
+    def _write(self, name, operation, *args):
+        # queues a write for the next commit and returns its result once it is committed
+        result = dict()
+        with self.lock:
+            self._pending.setdefault(name, list()).append((operation, args, result))
+        self._commits[name].wait()
+        return result.get("value")
+
+    def _commit(self, name):
+        _, key = self.collections[name]
+        with self.lock:
+            writes = self._pending.pop(name, None)
+        if not writes:
+            return
+
+        with self._file_locks[name].hold():
+            # apply the writes to a copy of the latest data (which another process may have
+            # written), so readers of the current container never see it change
+            latest = self.index(name)
+            stored = self.containers.get(name, dict)()
+            for record_key in latest:
+                stored[record_key] = latest[record_key]
+
+            for operation, args, result in writes:
+                if operation == "put":
+                    for record in args[0]:
+                        stored[record[key]] = record
+                elif operation == "insert":
+                    result["value"] = args[0][key] not in stored
+                    if result["value"]:
+                        stored[args[0][key]] = args[0]
+                elif operation == "update":
+                    records, result["value"] = args[0](stored)
+                    for record in copy.deepcopy(records):
+                        stored[record[key]] = record
+                else:
+                    deleted_keys = [record_key for record_key in args[0] if record_key in stored]
+                    for record_key in deleted_keys:
+                        del stored[record_key]
+                    result["value"] = len(deleted_keys)
+
+            self._save(name, stored)
+
+    def migrate(self, file_format):
+        """rewrites every collection's file in the given format, which is used for later writes
+
+        Args:
+            file_format (str): one of FILE_FORMATS
+        """
+
+        self.file_format = file_format
+        for name in self.collections:
+            with self._file_locks[name].hold():
+                self._save(name, self._load(name))
+
+    def index(self, name):
+        """returns the container holding a collection's records, for indexed lookups
+        (e.g. the VoterRegistry of the voters collection)
+
+        Args:
+            name (str): the collection name
+
+        Returns:
+            dict: the dict-like container of records, which must be treated as read-only
+        """
+
+        with self.lock:
+            signature = self._signature(name)
+            if name not in self._indexes or self._indexes[name][0] != signature:
+                self._indexes[name] = (signature, self._load(name))
+            return self._indexes[name][1]
+
+    def version(self, name):
+        """returns a value that changes whenever a collection is written, e.g. to derive ETags
+
+        Args:
+            name (str): the collection name
+
+        Returns:
+            str: the collection's version
+        """
+
+        signature = self._signature(name)
+        if signature is None:
+            return "0"
+        return "-".join(str(part) for part in signature)
+
+    def records(self, name):
+        """returns all the records in a collection
+
+        Args:
+            name (str): the collection name
+
+        Returns:
+            list: a list of records (dict), which must be treated as read-only
+        """
+
+        return list(self.index(name).values())
+
+    def get(self, name, key):
+        """returns a copy of the record with the given key
+
+        Args:
+            name (str): the collection name
+            key (str): the value of the record's key
+
+        Returns:
+            dict: the record or None if it does not exist
+        """
+
+        with self.lock:
+            if name not in self._files:
+                self._files[name] = RecordFile(self.collections[name][0])
+            if self._files[name].refresh():
+                return self._files[name].get(key)
+
+        record = self.index(name).get(key)
+        if record is None:
+            return None
+        return json.loads(json.dumps(record))
+
+    def put(self, name, record):
+        """inserts a record or replaces the existing record with the same key
+
+        Args:
+            name (str): the collection name
+            record (dict): the record to store
+        """
+
+        self.put_many(name, [record])
+
+    def put_many(self, name, records):
+        """inserts or replaces several records in a single write
+
+        Args:
+            name (str): the collection name
+            records (list): a list of records (dict)
+        """
+
+        # the saved container is kept to serve reads, so it holds private copies of the records
+        self._write(name, "put", copy.deepcopy(records))
+
+    def insert(self, name, record):
+        """inserts a record unless a record with the same key exists, checking and
+        writing in one step so that concurrent inserts of the same key (from any
+        thread or process) cannot both succeed
+
+        Args:
+            name (str): the collection name
+            record (dict): the record to store
+
+        Returns:
+            bool: whether or not the record was inserted
+        """
+
+        return self._write(name, "insert", copy.deepcopy(record))
+
+    def update(self, name, change):
+        """applies a change to the latest records of a collection and stores the records
+        it returns, checking and writing in one step so that concurrent changes (from any
+        thread or process) cannot overwrite each other or both pass the same check
+
+        Args:
+            name (str): the collection name
+            change (function): called with the collection's container (which it must not
+            change) once its file lock is held, returns a tuple of (records, result) where
+            records is a list of the records (dict) to insert or replace
+
+        Returns:
+            object: the result returned by change
+        """
+
+        return self._write(name, "update", change)
+
+    def delete(self, name, key):
+        """deletes the record with the given key
+
+        Args:
+            name (str): the collection name
+            key (str): the value of the record's key
+
+        Returns:
+            bool: whether or not a record was deleted
+        """
+
+        return self.delete_many(name, [key]) > 0
+
+    def delete_many(self, name, keys):
+        """deletes the records with the given keys in a single write
+
+        Args:
+            name (str): the collection name
+            keys (list): the values of the records' keys
+
+        Returns:
+            int: the number of deleted records
+        """
+
+        return self._write(name, "delete", list(keys))
+
+    def close(self):
+        with self.lock:
+            for record_file in self._files.values():
+                record_file.close()
+            for file_lock in self._file_locks.values():
+                file_lock.close()
+
+
+class LogStorage(FileStorage):
+    """keeps every collection in memory and records each mutation as one compact
+    line in an append-only log next to the collection's file (e.g. voters.log).
+    Each write returns once its log lines are synced to disk, and writes made within
+    commit_window seconds of each other share one sync (see GroupCommit).
+    On startup the log is replayed over the collection's file and compacted into it, and
+    a background thread periodically compacts the log back into the file so the files
+    keep the format FileStorage (and, for the JSON formats, older versions of the app) expect.
+    Several processes (e.g. gunicorn workers) can share the files: writes and compactions
+    hold the collection's file lock, and before each read or write a process replays the
+    lines other processes appended to the log (or reloads the file after a compaction).
+
+    Args:
+        collections (dict): maps a collection name to a tuple of (filepath, key)
+        containers (dict): maps a collection name to the dict-like class that holds its records
+        on_write (function): called with the number of writes each time data is written to disk
+        file_format (str): the format the collections' files are written in (one of FILE_FORMATS)
+        commit_window (float): the number of seconds writes wait for other writes to share a log sync
+        compact_interval (int): seconds between background compactions
+    """
+
+    def __init__(self, collections, containers=None, on_write=None, file_format="pretty", commit_window=0.002,
+                 compact_interval=60):
+        super().__init__(collections, containers, on_write, file_format, commit_window)
+        self.compact_interval = compact_interval
+        self._data = dict()
+        self._logs = dict()
+        self._log_sizes = dict()        # name -> number of entries appended since the last compaction
+        self._log_offsets = dict()      # name -> number of bytes of the log applied to the data
+        self._snapshots = dict()        # name -> signature of the file the data was loaded from
+
+        for name in collections:
+            with self._file_locks[name].hold():
+                self._reload(name)
+                self._compact(name)
+            self._logs[name] = open(self.log_path(name), "ab")
+
+        self._closed = threading.Event()
+        if compact_interval:
+            compactor = threading.Thread(target=self._compact_periodically, daemon=True)
+            compactor.start()
+
+    def log_path(self, name):
+        filepath, _ = self.collections[name]
+        return os.path.splitext(filepath)[0] + ".log"
+
+    def _log_size(self, name):
+        if not os.path.exists(self.log_path(name)):
+            return 0
+        return os.path.getsize(self.log_path(name))
+
+    def _reload(self, name):
+        # loads the collection's file and replays its whole log (with the file lock held)
+        self._data[name] = self._load(name)
+        self._snapshots[name] = self._signature(name)
+        self._log_offsets[name] = 0
+        self._log_sizes[name] = 0
+        self._replay(name)
+
+    def _replay(self, name):
+        # applies the log lines appended since the last replay (with the file lock held)
+        _, key = self.collections[name]
+        if not os.path.exists(self.log_path(name)):
+            return
+
+        stored = self._data[name]
+        with open(self.log_path(name), "rb") as log_file:
+            log_file.seek(self._log_offsets[name])
+            for line in log_file:
+                # a torn final line (crash mid-append) is ignored
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+
+                if entry["op"] == "put":
+                    stored[entry["record"][key]] = entry["record"]
+                elif entry["key"] in stored:
+                    del stored[entry["key"]]
+                self._log_offsets[name] += len(line)
+                self._log_sizes[name] += 1
+
+    def _catch_up(self, name, is_locked=False):
+        # applies the changes made by other processes since the last catch up
+        if self._signature(name) == self._snapshots[name] and self._log_size(name) == self._log_offsets[name]:
+            return
+
+        with self.lock:
+            if is_locked:
+                self._refresh(name)
+            else:
+                with self._file_locks[name].hold(exclusive=False):
+                    self._refresh(name)
+
+    def _refresh(self, name):
+        if self._signature(name) != self._snapshots[name]:
+            self._reload(name)
+        else:
+            self._replay(name)
+
+    def _append(self, name, entries):
+        log_file = self._logs[name]
+        data = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries).encode()
+        log_file.write(data)
+        log_file.flush()
+        self._log_offsets[name] += len(data)
+        self._log_sizes[name] += len(entries)
+        self.on_write(1)
+
+    def index(self, name):
+        self._catch_up(name)
+        return self._data[name]
+
+    def version(self, name):
+        # every process that has caught up with the files has the same version
+        self._catch_up(name)
+        with self.lock:
+            signature = self._snapshots[name] or ("0",)
+            return "-".join(str(part) for part in signature) + f"-{self._log_offsets[name]}"
+
+    def records(self, name):
+        return list(self.index(name).values())
+
+    def get(self, name, key):
+        record = self.index(name).get(key)
+        if record is None:
+            return None
+        return json.loads(json.dumps(record))
+
+    def _commit(self, name):
+        # appends are flushed as they are made, commits sync them to disk
+        with self.lock:
+            log_file = self._logs[name]
+        os.fsync(log_file.fileno())
+
+    def put_many(self, name, records):
+        _, key = self.collections[name]
+        # keep private copies so that callers changing their records later
+        # cannot change the stored records without a log entry
+        records = copy.deepcopy(records)
+        with self.lock, self._file_locks[name].hold():
+            self._catch_up(name, is_locked=True)
+            self._append(name, [{"op": "put", "record": record} for record in records])
+            for record in records:
+                self._data[name][record[key]] = record
+        self._commits[name].wait()
+
+    def insert(self, name, record):
+        _, key = self.collections[name]
+        record = copy.deepcopy(record)
+        with self.lock, self._file_locks[name].hold():
+            self._catch_up(name, is_locked=True)
+            if record[key] in self._data[name]:
+                return False
+            self._append(name, [{"op": "put", "record": record}])
+            self._data[name][record[key]] = record
+        self._commits[name].wait()
+        return True
+
+    def update(self, name, change):
+        _, key = self.collections[name]
+        with self.lock, self._file_locks[name].hold():
+            self._catch_up(name, is_locked=True)
+            records, result = change(self._data[name])
+            records = copy.deepcopy(records)
+            if records:
+                self._append(name, [{"op": "put", "record": record} for record in records])
+            for record in records:
+                self._data[name][record[key]] = record
+        if records:
+            self._commits[name].wait()
+        return result
+
+    def delete_many(self, name, keys):
+        with self.lock, self._file_locks[name].hold():
+            self._catch_up(name, is_locked=True)
+            keys = [key for key in keys if key in self._data[name]]
+            if keys:
+                self._append(name, [{"op": "del", "key": key} for key in keys])
+            for key in keys:
+                del self._data[name][key]
+        if keys:
+            self._commits[name].wait()
+        return len(keys)
+
+    def migrate(self, file_format):
+        self.file_format = file_format
+        for name in self.collections:
+            self.compact(name)
+
+    def compact(self, name):
+        """writes the in-memory collection back to its file and truncates its log
+
+        Args:
+            name (str): the collection name
+        """
+
+        with self.lock, self._file_locks[name].hold():
+            self._catch_up(name, is_locked=True)
+            self._compact(name)
+
+    def _compact(self, name):
+        # (with the lock and the file lock held)
+        self._save(name, self._data[name])
+        open(self.log_path(name), "w").close()
+        self._snapshots[name] = self._signature(name)
+        self._log_offsets[name] = 0
+        self._log_sizes[name] = 0
+
+    def _compact_periodically(self):
+        while not self._closed.wait(self.compact_interval):
+            for name in self.collections:
+                if self._log_sizes[name]:
+                    self.compact(name)
+
+    def close(self):
+        self._closed.set()
+        for name in self.collections:
+            self.compact(name)
+            self._logs[name].close()
+        super().close()
+
+
+def open_storage(backend, collections, containers=None, **options):
+    """creates the storage backend with the given name
+
+    Args:
+        backend (str): "log" for LogStorage or "file" for FileStorage
+        collections (dict): maps a collection name to a tuple of (filepath, key)
+        containers (dict): maps a collection name to the dict-like class that holds its records
+
+    Returns:
+        FileStorage: the storage backend
+    """
+
+    if backend == "file":
+        return FileStorage(
+            collections, containers, options.get("on_write"), options.get("file_format", "pretty"),
+            options.get("commit_window", 0.002)
+        )
+    return LogStorage(collections, containers, **options)
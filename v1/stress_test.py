@@ -0,0 +1,269 @@
+"""a load test of v1's voter registration and vote casting: voters are registered and
+their votes are cast from many threads at once (each vote several times), optionally in
+several processes sharing the data files (like gunicorn workers), then the stored
+voters, ballots and vote counts are checked for lost or duplicated writes and the
+throughput is reported. Alongside the voters, every process also registers a few student
+ids several times with different emails and a few emails several times with different
+student ids, and exactly one registration of each must succeed. The API runs against a temporary data folder, so the data
+folder is not changed. Run from the v1 folder, e.g.
+
+    python stress_test.py --voters 2000 --threads 32 --backend file
+    python stress_test.py --voters 2000 --threads 8 --processes 4
+
+The exit status is 1 if any check failed.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+V1_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+ELECTION_CODE = "STRESS"
+POSITION_ID = "001"
+CANDIDATE_IDS = ["99992002", "99982002"]
+COPIES = 4                      # number of registrations of each duplicated student id or email
+
+
+def student_id(number):
+    # eight digit student ids, 10000 per year group from 2024 on
+    return f"{number % 10000:04d}{2024 + number // 10000}"
+
+
+def voter(student_id):
+    return {
+        "student_id": student_id, "firstname": "Stress", "lastname": "Test",
+        "email": f"stress.{student_id}@ashesi.edu.gh"
+    }
+
+
+def duplicates(voters, groups):
+    """returns the registrations of the duplicated student ids and emails, which use
+    student ids after those of the voters
+
+    Args:
+        voters (int): the number of voters
+        groups (int): the number of duplicated student ids (and of duplicated emails)
+
+    Returns:
+        list: (method, path, body) of each registration
+    """
+
+    requests = list()
+    for group in range(groups):
+        # the same student id with different emails
+        duplicate_id = student_id(voters + group)
+        for copy in range(COPIES):
+            requests.append(("post", "/voters/register_voter/", dict(
+                voter(duplicate_id), email=f"stress.{duplicate_id}.{copy}@ashesi.edu.gh"
+            )))
+
+        # the same email with different student ids
+        for copy in range(COPIES):
+            requests.append(("post", "/voters/register_voter/", dict(
+                voter(student_id(voters + groups + group * COPIES + copy)), email=f"stress.shared.{group}@ashesi.edu.gh"
+            )))
+    return requests
+
+
+def open_app(directory, backend):
+    """imports the API, storing its data in the data folder of the given directory
+
+    Args:
+        directory (str): the directory the API runs in
+        backend (str): the storage backend (see VOTING_STORAGE_BACKEND)
+
+    Returns:
+        module: the voting_system module
+    """
+
+    os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+    os.chdir(directory)
+    os.environ["VOTING_STORAGE_BACKEND"] = backend
+    sys.path.insert(0, V1_FOLDER)
+
+    import voting_system
+    return voting_system
+
+
+def send_requests(app, requests, threads):
+    """sends requests to the API from a pool of threads, each with its own client
+
+    Args:
+        app (module): the voting_system module
+        requests (list): (method, path, body) of each request
+        threads (int): the number of threads
+
+    Returns:
+        list: the status code of each request
+    """
+
+    clients = threading.local()
+
+    def send(request):
+        if not hasattr(clients, "client"):
+            clients.client = app.voting_app.test_client()
+        method, path, body = request
+        return getattr(clients.client, method)(path, data=json.dumps(body)).status_code
+
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(send, requests))
+
+
+def run_workload(app, voter_ids, registered_ids, duplicated, attempts, threads, barrier=None):
+    """registers voters (and the duplicated student ids and emails), then sends the votes of all the voters
+
+    Args:
+        app (module): the voting_system module
+        voter_ids (list): the student ids of all the voters
+        registered_ids (list): the student ids of the voters registered by this process
+        duplicated (int): the number of duplicated student ids (and of duplicated emails)
+        attempts (int): the number of times each vote is sent
+        threads (int): the number of threads
+        barrier (Barrier): waited for between the registrations and the votes of the processes
+
+    Returns:
+        tuple: the number of registrations per status code, the seconds they took, the
+        number of votes per status code and the seconds they took
+    """
+
+    # the duplicates are mixed in with the voters, so that they race each other
+    registrations = [("post", "/voters/register_voter/", voter(voter_id)) for voter_id in registered_ids]
+    registrations += duplicates(len(voter_ids), duplicated)
+    random.shuffle(registrations)
+    start = time.perf_counter()
+    registrations = count(send_requests(app, registrations, threads))
+    registration_time = time.perf_counter() - start
+
+    # votes are only sent once every process has registered its voters
+    if barrier is not None:
+        barrier.wait()
+
+    # every vote is sent several times, in random order, so that duplicates race each other
+    votes = [
+        ("post", f"/elections/vote/{ELECTION_CODE}/?position_id={POSITION_ID}",
+         {"student_id": voter_id, "candidate_id": random.choice(CANDIDATE_IDS)})
+        for voter_id in voter_ids for _ in range(attempts)
+    ]
+    random.shuffle(votes)
+    start = time.perf_counter()
+    casts = count(send_requests(app, votes, threads))
+    vote_time = time.perf_counter() - start
+
+    return registrations, registration_time, casts, vote_time
+
+
+def run_worker(directory, backend, number, processes, voters, duplicated, attempts, threads, barrier, results):
+    # runs in its own process, with its own copy of the API and its storage
+    app = open_app(directory, backend)
+    voter_ids = [student_id(index) for index in range(voters)]
+    results.put(run_workload(app, voter_ids, voter_ids[number::processes], duplicated, attempts, threads, barrier))
+    app.storage.close()
+
+
+def merge(counts):
+    merged = dict()
+    for statuses in counts:
+        for status, number in statuses.items():
+            merged[status] = merged.get(status, 0) + number
+    return merged
+
+
+def count(statuses):
+    counts = dict()
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def check(failures, condition, message):
+    print(("ok      " if condition else "FAILED  ") + message)
+    if not condition:
+        failures.append(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load test of v1's voter registration and vote casting")
+    parser.add_argument("--voters", type=int, default=1000, help="number of voters registered (and votes cast)")
+    parser.add_argument("--duplicates", type=int, default=20, help="number of student ids (and of emails) registered several times")
+    parser.add_argument("--threads", type=int, default=16, help="number of threads sending requests")
+    parser.add_argument("--attempts", type=int, default=2, help="number of times each vote is sent (per process)")
+    parser.add_argument("--processes", type=int, default=1, help="number of processes sharing the data files")
+    parser.add_argument("--backend", choices=["log", "file"], default="log", help="storage backend")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    app = open_app(directory, args.backend)
+    voter_ids = [student_id(number) for number in range(args.voters)]
+
+    send_requests(app, [("post", "/voters/register_voter/", voter(candidate_id)) for candidate_id in CANDIDATE_IDS], 1)
+    send_requests(app, [("post", "/elections/create_election/", {
+        "election_code": ELECTION_CODE, "election_name": "Stress test", "election_startdate": "2023-03-27",
+        "election_period": 72, "positions": [{"position_id": POSITION_ID, "position_name": "President", "candidates": CANDIDATE_IDS}]
+    })], 1)
+
+    if args.processes == 1:
+        registrations, registration_time, casts, vote_time = run_workload(
+            app, voter_ids, voter_ids, args.duplicates, args.attempts, args.threads
+        )
+    else:
+        # the workers are started fresh (not forked), so that each opens the data files itself
+        context = multiprocessing.get_context("spawn")
+        barrier, results = context.Barrier(args.processes), context.Queue()
+        workers = [
+            context.Process(target=run_worker, args=(
+                directory, args.backend, number, args.processes, args.voters, args.duplicates, args.attempts, args.threads,
+                barrier, results
+            ))
+            for number in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        worker_results = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        # the processes ran side by side, so the slowest one sets the time
+        registrations = merge(result[0] for result in worker_results)
+        registration_time = max(result[1] for result in worker_results)
+        casts = merge(result[2] for result in worker_results)
+        vote_time = max(result[3] for result in worker_results)
+
+    # this process reads the voters and ballots written by the workers from the data files
+    num_votes = args.voters * args.attempts * args.processes
+    num_duplicates = 2 * args.duplicates * COPIES * args.processes
+    num_registered = args.voters + 2 * args.duplicates
+    storage = app.storage
+    voters = storage.records("voters")
+    ballots = storage.records("ballots")
+    tallies = storage.index("ballots").tallies(ELECTION_CODE).get(POSITION_ID, dict())
+
+    num_registrations = args.voters + num_duplicates
+    print(f"sent {num_registrations} registrations in {registration_time:.2f}s ({num_registrations / registration_time:.0f}/s): {registrations}")
+    print(f"sent {num_votes} votes in {vote_time:.2f}s ({num_votes / vote_time:.0f}/s): {casts}")
+
+    failures = list()
+    check(failures, registrations.get(201) == num_registered, "every voter, duplicated student id and duplicated email is registered once")
+    check(failures, registrations.get(400, 0) == num_duplicates - 2 * args.duplicates, "every other duplicate is rejected")
+    check(failures, len(voters) == num_registered + len(CANDIDATE_IDS), "no registration is lost")
+    check(failures, len({voter["email"] for voter in voters}) == len(voters), "no email is used by two voters")
+    check(failures, casts.get(200) == args.voters, "one vote per voter is cast")
+    check(failures, casts.get(403, 0) == num_votes - args.voters, "every other vote is rejected as a duplicate")
+    check(failures, sorted(ballot["student_id"] for ballot in ballots) == sorted(voter_ids), "one ballot per voter is stored")
+    check(failures, sum(tallies.values()) == args.voters, "the vote counts add up to the ballots")
+
+    storage.close()
+    shutil.rmtree(directory)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,40 @@
 # import necessary libraries
 import json
+import click
 from datetime import timedelta
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 
 # import helper methods
 from helper import (
-    valid_request_body, read_from_file, write_to_file, 
-    valid_voter_info, valid_student_id, valid_keys,
-    key_is_unique, get_voters,
-    
-    FIRST_YEAR_GROUP, VOTERS_FILE, ELECTIONS_FILE
+    valid_request_body, request_json, valid_voter_info, 
+    valid_student_id, schema_error, ELECTION_SCHEMA, VOTE_SCHEMA,
+    voter_info_error, read_voter_rows,
+    key_is_unique, voter_key_is_unique, get_voters, attach_tallies, cast_ballot,
+    election_results, election_cache, election_etag,
+    make_etag, not_modified, with_etag,
+    page_arguments, split_page, paginate, voters_response,
+    add_write_count, write_count,
+    
+    FIRST_YEAR_GROUP, FILE_FORMATS, LIVE_KEEPALIVE_INTERVAL, LIVE_POLL_TIMEOUT, storage, tally_feed
 )
+from ballots import BallotBox
 
 
 voting_app = Flask(__name__)
+
+# report the number of data file writes made by each request
+voting_app.after_request(add_write_count)
+
+
+# rewrite the data files in another format, e.g. flask --app voting_system migrate-data compact
+# (stop the API first, and then start it with VOTING_FILE_FORMAT set to the new format)
+@voting_app.cli.command("migrate-data")
+@click.argument("file_format", type=click.Choice(FILE_FORMATS))
+def migrate_data(file_format):
+    """Rewrite the voters, elections and ballots files in FILE_FORMAT."""
+    
+    storage.migrate(file_format)
+    click.echo(f"Data files have been rewritten in the {file_format} format.")
     
 
 # _____________________________________________________________________________________________________________________
@@ -40,26 +61,91 @@ def register_voter():
     
     voter_info = response["data"]
     
-    # reading existing data into a list
-    data = read_from_file(VOTERS_FILE)
-    
     # set can vote attribute
     voter_info["is_registered"] = True
     
-    # if there's no data, create a new list for voter_info
-    # else, append voter's info to existing list
-    if not data:
-        voters_data = list()
-    else:
-        voters_data = json.loads(data)
-    voters_data.append(voter_info)
+    # check the unique keys again against the latest voters as the new voter is written,
+    # so that concurrent registrations of the same student id or email cannot both succeed
+    def register(registry):
+        error = voter_key_is_unique(unique_keys, registry, voter_info)
+        return ([] if error else [voter_info]), error
     
-    # write the new data into the file
-    write_to_file(VOTERS_FILE, voters_data)
+    error = storage.update("voters", register)
+    if error:
+        return jsonify(error), 400
     
     return jsonify(voter_info), 201
 
 
+# _____________________________________________________________________________________________________________________
+# REGISTER MANY ASHESI STUDENTS AS VOTERS
+@voting_app.route("/voters/bulk_register/", methods=["POST"])
+def bulk_register_voters():
+    """handles a POST request to register many voters at once. The request body is
+    streamed as CSV (content type text/csv, with a header row) or NDJSON (one voter per line),
+    and every row is validated with the same rules as register_voter and checked for
+    unique student ids and emails against existing voters and earlier rows.
+    The response is streamed as NDJSON: one line per rejected row with the row number
+    and the validation or constraint failure, followed by a line with the number
+    of registered voters and of writes made (the X-Write-Count header is not sent,
+    as the writes are made after the headers)
+
+    Returns:
+        Response: a streamed NDJSON response of rejected rows and the number of registered voters
+    """
+    
+    def register_rows():
+        registry = storage.index("voters")
+        student_ids = set()             # student ids of valid rows
+        emails = set()                  # emails of valid rows
+        voters_data = list()            # valid rows
+        
+        for row_number, voter_info in read_voter_rows(request):
+            if voter_info is None:
+                error = {"message": "Row is not a valid voter record."}
+            else:
+                error = voter_info_error(voter_info)
+            
+            # ensure keys are unique among existing voters and earlier rows
+            if error is None:
+                error = dict()
+                if voter_info["student_id"] in student_ids or not registry.is_unique("student_id", voter_info["student_id"]):
+                    error["student_id"] = "student_id already exists!"
+                if voter_info["email"] in emails or not registry.is_unique("email", voter_info["email"]):
+                    error["email"] = "email already exists!"
+                error = error or None
+            
+            if error is not None:
+                yield json.dumps({"row": row_number, "error": error}) + "\n"
+                continue
+            
+            # set can vote attribute
+            voter_info["is_registered"] = True
+            student_ids.add(voter_info["student_id"])
+            emails.add(voter_info["email"])
+            voters_data.append((row_number, voter_info))
+        
+        # write all the new voters into storage at once, checking the unique keys again
+        # against the latest voters, which other requests may have registered since
+        def register(latest):
+            registered, errors = list(), list()
+            for row_number, voter_info in voters_data:
+                error = voter_key_is_unique(["student_id", "email"], latest, voter_info)
+                if error:
+                    errors.append({"row": row_number, "error": error})
+                else:
+                    registered.append(voter_info)
+            return registered, (len(registered), errors)
+        
+        num_registered, errors = storage.update("voters", register) if voters_data else (0, [])
+        for error in errors:
+            yield json.dumps(error) + "\n"
+        
+        yield json.dumps({"message": f"{num_registered} voters have been registered!", "registered": num_registered, "writes": write_count()}) + "\n"
+    
+    return Response(stream_with_context(register_rows()), mimetype="application/x-ndjson")
+
+
 # __________________________________________________________________________________________________________________________
 # DEREGISTER A STUDENT AS A VOTER
 @voting_app.route("/voters/de_register/<value>/", methods=["PATCH"])
@@ -86,40 +172,37 @@ def deregister_voter(value):
         if not valid_student_id(value):
             return jsonify({"message": "Invalid student id!"}), 400
     
-    data = read_from_file(VOTERS_FILE)              # get all voters
-    
-    if not data:
-        return jsonify({"message": "No voter has been registered!"}), 404
+    # deregister the voters found in the latest voters as they are written, so that
+    # changes other requests made to them in the meantime are not overwritten
+    def deregister(registry):
+        if not registry:
+            return [], None
+        
+        updated_voters = []                         # list of only updated voters
+        
+        # update specified user's is_registered attribute to deregister them
+        if key == "student_id":
+            voter = registry.get(value)
+            if voter is not None:
+                updated_voters.append(dict(voter, is_registered=False))
+        
+        # updated all students in specified year group's is_registered attribute
+        else:
+            for voter in registry.in_year_group(value):
+                updated_voters.append(dict(voter, is_registered=False))
+        
+        return updated_voters, updated_voters
     
-    voters_data = json.loads(data)                  # convert data to JSON list
-    updated_voters_data = list()                    # list of all voters
-    updated_voters = []                             # list of only updated voters
-
-    # update specified user's is_registered attribute to deregister them
-    if key == "student_id":
-        for voter in voters_data:
-            if voter[key] == value:
-                voter["is_registered"] = False
-                updated_voters.append(voter)
-            updated_voters_data.append(voter)
+    updated_voters = storage.update("voters", deregister)
     
-    # updated all students in specified year group's is_registered attribute
-    else:
-        for voter in voters_data:
-            id_details = valid_student_id(voter["student_id"])
-            if id_details[key] == value:
-                voter["is_registered"] = False
-                updated_voters.append(voter)
-            updated_voters_data.append(voter)
+    if updated_voters is None:
+        return jsonify({"message": "No voter has been registered!"}), 404
         
     # if user with id not found, return appropriate message
     if not updated_voters and key == "student_id":
         return jsonify({"message": f"student with id {value} has not been registered as a voter!"}), 404
     elif not updated_voters and key == "year_group":
         return jsonify({"message": f"No registered voter in the {value} year group!"}), 404    
-        
-    # write updated data into file
-    write_to_file(VOTERS_FILE, updated_voters_data)
     
     # attach appropriate message title
     if key == "student_id":
@@ -158,29 +241,28 @@ iva
     # get validated voter info 
     voter_info = response["data"]
         
-    # reading existing data into a list
-    data = read_from_file(VOTERS_FILE)
-    if not data:
-        updated_voters_data = [voter_info]
-    else:
-        voters_data = json.loads(data)
-        updated_voters_data = list()
-        
-        # get the voter with specified id
-        for voter in voters_data:
-            if voter["student_id"] == voter_info["student_id"]:
+    voter_info["is_registered"] = True
     
-                # ensure that the voter specified is registered
-                if not voter["is_registered"]:
-                    return jsonify({"message": f"Voter with id {student_id} is not registered."}), 404
-                
-                # replace data in file
-                voter = voter_info
-                voter["is_registered"] = True
-            updated_voters_data.append(voter)
+    # check the voter and the email against the latest voters as the voter is written,
+    # so that a concurrent deregistration or use of the email is not overwritten
+    def update(registry):
+        # ensure that the voter specified is registered
+        voter = registry.get(voter_info["student_id"])
+        if voter is not None and not voter["is_registered"]:
+            return [], ({"message": f"Voter with id {student_id} is not registered."}, 404)
         
-    # write the updated data into the file
-    write_to_file(VOTERS_FILE, updated_voters_data)
+        error = voter_key_is_unique(unique_keys, registry, voter_info)
+        if error:
+            return [], (error, 400)
+        
+        # replace the voter's data in storage
+        return [voter_info], None
+    
+    # (the change may run in the thread of another request sharing the commit, so it
+    # returns the error and its status code rather than a response)
+    error = storage.update("voters", update)
+    if error is not None:
+        return jsonify(error[0]), error[1]
     
     return jsonify(voter_info)
 
@@ -195,6 +277,9 @@ def retrieve_voters():
     * Attributes being used for filtering are: 
     - student_id           - firstname
     - lastname              - email         - year_group
+    With a limit or cursor argument, voters are returned in pages ordered by student id,
+    and the cursor of the next page is returned in the X-Next-Cursor header. The fields
+    argument selects the attributes returned for each voter (e.g. fields=student_id,firstname)
 
     Returns:
         dict: JSON representation of the list of voters (dict) that match filter attributes
@@ -203,10 +288,6 @@ def retrieve_voters():
     # dict to store all keys and values for filter
     filter_dict = dict()
     
-    # stores resulting list from filtering
-    result_list = list()
-    final_result_list = list()
-    
     # get all attributes specified in the request args
     if request.args.get("student_id"):
         filter_dict["student_id"] = request.args.get("student_id")
@@ -226,15 +307,33 @@ def retrieve_voters():
     if request.args.get("is_registered"):
         filter_dict["is_registered"] = request.args.get("is_registered")
 
-    # read the voters file
-    data = read_from_file(VOTERS_FILE)
-    if not data:
+    # read the pagination and projection arguments
+    page = page_arguments(request)
+    if type(page) == tuple:
+        return page
+    is_paged = page["limit"] is not None or page["cursor"] is not None
+
+    # the voters matching the arguments only change when voters are written, so a client
+    # that already has the latest list is answered without reading or serializing it
+    etag = make_etag(storage.version("voters"), sorted(request.args.items(multi=True)))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    # get the indexed registry of all voters
+    registry = storage.index("voters")
+    if not registry:
         return jsonify({"message": "No voter has been registered!"}), 404
-    voters_data = json.loads(data)
     
     # if no argument is parsed, retrieve all users
+    # (a page is read from the registry's sorted index of student ids)
     if not filter_dict:
-        return jsonify(voters_data)
+        if is_paged:
+            limit = None if page["limit"] is None else page["limit"] + 1
+            voters_data, next_cursor = split_page(registry.page(page["cursor"], limit), page["limit"])
+        else:
+            voters_data, next_cursor = list(registry.values()), None
+        return with_etag(voters_response(voters_data, next_cursor, page["fields"]), etag)
         
     for key in filter_dict.keys():
 
@@ -267,39 +366,19 @@ def retrieve_voters():
         else:
             if int(filter_dict["year_group"]) < FIRST_YEAR_GROUP:
                 return jsonify({"message": "Student year group is invalid."})
-            
-        # empty the result list before new filter is applied
-        result_list.clear()
-            
-        # get all user with specified key
-        for voter in voters_data:
-            
-            # since year group isn't being stored, handle it differently
-            if key == "year_group":
-                # get year group of voter from voter's student_id
-                student_id_details = valid_student_id(voter["student_id"])
-                year_group = student_id_details["year_group"]
-                if year_group == filter_dict[key]:
-                    result_list.append(voter)
-            else:
-                if type(filter_dict[key]) == str:
-                    if voter[key].lower() == filter_dict[key].lower() or voter[key].lower().startswith(filter_dict[key].lower()):
-                        result_list.append(voter)
-                else:
-                    if voter[key] == filter_dict[key]:
-                        result_list.append(voter)
-        
-        # update the data being returned
-        final_result_list = result_list[:]
-        
-        # update the data being used for filtering
-        voters_data = final_result_list
+    
+    # apply all filters through the registry's indexes
+    final_result_list = registry.filter(filter_dict)
                 
     # ensure that the result list is not empty
     if not final_result_list:
         return jsonify({"message": "No voter found with the provided details"}), 404
             
-    return jsonify(final_result_list)
+    next_cursor = None
+    if is_paged:
+        final_result_list, next_cursor = paginate(final_result_list, page["cursor"], page["limit"])
+    
+    return with_etag(voters_response(final_result_list, next_cursor, page["fields"]), etag)
 
 
 # ______________________________________________________________________________________________________________________________________________________________
@@ -313,36 +392,28 @@ def create_election():
         return jsonify({"message": "Election information not provided!"}), 404
     
     # get election information from request 
-    election_info = json.loads(request.data)
-    
-    # ensure that the data contains all expected fields
-    # if validation fails, return appropriate message
-    # expected keys
-    ELECTION_KEYS = [
-            "election_code", "election_name", "election_startdate",
-            "election_period", "positions"
-        ]
+    election_info = request_json(request)
     
-    validate_data = valid_keys(election_info, ELECTION_KEYS)
-    if validate_data["is_valid"] == False:
-        return jsonify(validate_data["message"]), 400
+    # ensure that the election, its positions and their candidates are valid
+    # if validation fails, return all the validation errors
+    error = schema_error(ELECTION_SCHEMA.errors(election_info))
+    if error is not None:
+        return jsonify(error), 400
     
     # read existing elections data
-    data = read_from_file(ELECTIONS_FILE)
+    elections_data = storage.records("elections")
     
     # validate election unique constraints if there are existing election information
     unique_keys = ["election_code", "election_name"]
-    if data:    
-        elections_data = json.loads(data)
+    if elections_data:    
         ununique_result = key_is_unique(unique_keys, elections_data, election_info)
         if len(ununique_result) > 0:
             return jsonify(ununique_result), 400
         
-    # NOTE: PROGRAM ASSUMES DATA FOR VARIOUS FIELDS HAVE BEEN VALIDATED AND DATA FORMATS (STRUCTURES, etc) ARE VALID
-        
     # EXTRA FIELDS NEEDED IN PROGRAM:
-    # 1. add num_votes to all candidates provided for a position 
-    # 2. add voters (a list of voters who have voted for a candidate) to all positions
+    # 1. wrap all candidates provided for a position in a dictionary
+    # NOTE: ballots and vote counts are stored separately from the election (see vote), 
+    # num_votes is added to each candidate when the election is read
     
     election_positions = election_info["positions"]
     updated_positions = list()
@@ -353,7 +424,6 @@ def create_election():
         for candidate in candidates:
             candidates_dictionary = dict()
             candidates_dictionary["candidate_id"] = candidate
-            candidates_dictionary["candidate_voters"] = list()
             
             updated_candidates.append(candidates_dictionary)
 
@@ -361,67 +431,159 @@ def create_election():
         updated_positions.append(position)
     
     election_info["positions"] = updated_positions     
-        
-    if not data:
-        elections_data = list()
             
-    # add new election to elections data
-    elections_data.append(election_info)
-    # write the data to a file
-    write_to_file(ELECTIONS_FILE, elections_data)
+    # write the new election into storage
+    storage.put("elections", election_info)
+    election_cache.invalidate(election_info["election_code"])
     
-    return jsonify(election_info)
+    return jsonify(attach_tallies(election_info, dict()))
 
 
 # ____________________________________________________________________________________________________________________________________________________
 # RETRIEVE AN ELECTION
 @voting_app.route("/elections/get/<election_code>/", methods=["GET"])
 def retrieve_election(election_code):
-    # read election file
-    data = read_from_file(ELECTIONS_FILE)
-    
     # ensure that there are existing data
-    if not data:
+    if not storage.index("elections"):
         return jsonify({"message": "No elections have been created!"}), 404
     
-    # convert data from file into JSON
-    elections_data = json.loads(data)
-    
-    # loop through data and check if requested key exists
-    for election in elections_data:
-        if election["election_code"] == election_code:
-            return jsonify(election)
+    # read the election (with its vote counts and ETag) through the election cache,
+    # a client that already has the latest election is answered without serializing it
+    election = election_cache.get(election_code)
+    # the cached election is read again if elections or ballots were written since it was
+    # read, e.g. by another process (which cannot invalidate this process's cache)
+    if election is not None and election["etag"] != election_etag(election_code):
+        election_cache.invalidate(election_code)
+        election = election_cache.get(election_code)
+    if election is not None:
+        response = not_modified(request, election["etag"])
+        if response is not None:
+            return response
+        return with_etag(jsonify(election["election"]), election["etag"])
         
     return jsonify({"message": "Election with requested code does not exist!"}), 404
 
 
+# ____________________________________________________________________________________________________________________________________________________
+# RETRIEVE THE ELECTION CACHE'S STATISTICS
+@voting_app.route("/elections/cache_stats/", methods=["GET"])
+def retrieve_cache_stats():
+    """returns the number of elections in the election cache, its limits and the
+    number of retrieve_election reads served from it (hits) or from the data files (misses)
+
+    Returns:
+        JSON: JSON representation of the cache statistics
+    """
+    
+    return jsonify(election_cache.stats())
+
+
+# ____________________________________________________________________________________________________________________________________________________
+# RETRIEVE AN ELECTION'S RESULTS
+@voting_app.route("/elections/<election_code>/results/", methods=["GET"])
+def retrieve_results(election_code):
+    """returns the number of votes of every candidate, the turnout and the leader(s)
+    of every position of an election, computed from the vote counts kept up to date
+    by vote, so the cost does not depend on the number of ballots cast
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        JSON: JSON representation of the election's results or appropriate message
+        if the election does not exist
+    """
+    
+    election = storage.get("elections", election_code)
+    if election is None:
+        return jsonify({"message": "Election with requested code does not exist!"}), 404
+    
+    return jsonify(election_results(election, storage.index("ballots").tallies(election_code)))
+
+
+# ____________________________________________________________________________________________________________________________________________________
+# STREAM AN ELECTION'S LIVE RESULTS
+@voting_app.route("/elections/<election_code>/results/stream/", methods=["GET"])
+def stream_results(election_code):
+    """streams an election's vote counts as Server-Sent Events: the first event holds
+    all the counts and each following event only the counts that changed. Events are
+    published at most LIVE_MAX_RATE times per second however many votes are cast, and
+    every viewer is served from the same in-memory feed.
+    A reconnecting client resumes from the version in its Last-Event-ID header
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        Response: a text/event-stream of results updates (version, tallies and reset)
+        or appropriate message if the election does not exist
+    """
+    
+    if election_code not in storage.index("elections"):
+        return jsonify({"message": "Election with requested code does not exist!"}), 404
+    
+    version = request.headers.get("Last-Event-ID", type=int)
+    
+    def events(version):
+        while True:
+            update = tally_feed.changes_since(election_code, version, timeout=LIVE_KEEPALIVE_INTERVAL)
+            
+            # the election has been deleted
+            if update is None:
+                return
+            
+            if update["version"] == version and not update["reset"]:
+                yield ": keep-alive\n\n"
+                continue
+            
+            version = update["version"]
+            yield f"id: {version}\ndata: {json.dumps(update)}\n\n"
+    
+    return Response(
+        stream_with_context(events(version)), mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ____________________________________________________________________________________________________________________________________________________
+# LONG-POLL AN ELECTION'S LIVE RESULTS
+@voting_app.route("/elections/<election_code>/results/poll/", methods=["GET"])
+def poll_results(election_code):
+    """returns the vote counts that changed since the version in the version argument,
+    waiting up to LIVE_POLL_TIMEOUT seconds for a new version. Without a version (or
+    with one too old to catch up from) all the counts are returned at once
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        JSON: the latest version, the changed counts (tallies) and whether or not they are
+        all the counts (reset), or appropriate message if the election does not exist
+    """
+    
+    if election_code not in storage.index("elections"):
+        return jsonify({"message": "Election with requested code does not exist!"}), 404
+    
+    update = tally_feed.changes_since(election_code, request.args.get("version", type=int), timeout=LIVE_POLL_TIMEOUT)
+    if update is None:
+        return jsonify({"message": "Election with requested code does not exist!"}), 404
+    
+    return jsonify(update)
+
+
 # _______________________________________________________________________________________________________________________________________________________
 # DELETE AN ELECTION
 @voting_app.route("/elections/delete_election/<election_code>/", methods=["DELETE"])
 def delete_election(election_code):
-    # read election file
-    data = read_from_file(ELECTIONS_FILE)
-    
     # ensure that there are existing data
-    if not data:
+    if not storage.index("elections"):
         return jsonify({"message": "No elections have been created!"}), 404
     
-    # convert data from file into JSON
-    elections_data = json.loads(data)
-    updated_elections_data = list()         # new list for updated list
-    key_exists = False
-    
-    # loop through data and check if requested key exists
-    for election in elections_data:
-        if election["election_code"] == election_code:
-            key_exists = True
-            continue
-        updated_elections_data.append(election)
-        
-    # write new data to the file
-    write_to_file(ELECTIONS_FILE, updated_elections_data)
-        
-    if key_exists:
+    # delete the election and its ballots from storage
+    if storage.delete("elections", election_code):
+        storage.delete_many("ballots", storage.index("ballots").ballot_ids(election_code))
+        tally_feed.drop(election_code)
+        election_cache.invalidate(election_code)
         return jsonify({"message": f"Election with code {election_code} had been deleted successfully!"}) #, 204
     
     return jsonify({"message": "Election with requested code does not exist!"}), 404
@@ -443,26 +605,12 @@ def vote(election_id):
         return jsonify({"message": "Election information not provided!"}), 404
     
     # get request data
-    vote_info = json.loads(request.data)
-    
-    # ensure that the data contains student_id and candidate_id
-    VOTING_KEYS = [
-            "student_id", "candidate_id"
-        ]
-    
-    validate_data = valid_keys(vote_info, VOTING_KEYS)
-    if validate_data["is_valid"] == False:
-        return jsonify(validate_data["message"]), 400
-    
-    # ensure that the student id is valid
-    student_id_is_valid = valid_student_id(vote_info["student_id"])
-    if not student_id_is_valid:
-        return jsonify({"message": "Student ID is not valid."}), 400
+    vote_info = request_json(request)
     
-    # ensure that the candidata id is valid
-    student_id_is_valid = valid_student_id(vote_info["candidate_id"])
-    if not student_id_is_valid:
-        return jsonify({"message": "Candidate ID is not valid."}), 400
+    # ensure that the data contains a valid student_id and candidate_id
+    error = schema_error(VOTE_SCHEMA.errors(vote_info))
+    if error is not None:
+        return jsonify(error), 400
     
     # ensure that the student and the candidate are both registered
     student_list = [vote_info["student_id"], vote_info["candidate_id"]]
@@ -471,69 +619,54 @@ def vote(election_id):
     if students_registered == False:
         return jsonify({"message": "Voter or candidate not registered!"}), 404
     
-    # read data
-    voter_file = read_from_file(VOTERS_FILE)
-    election_file = read_from_file(ELECTIONS_FILE)
-    
-    elections_data = json.loads(election_file)
-    election_info = None
-    updated_elections_data = list()
-    
-    if not voter_file:
-        return jsonify({"message": "No voter has been registered!"}), 404
-    
-    if not election_file:
+    if not storage.index("elections"):
         return jsonify({"message": "No election has been created!"}), 404
     
-    election_exists = False
-    for election in elections_data:
-        if election["election_code"] == election_id:
-            election_exists = True
-            
-            # ensure that the position exist
-            positions = election["positions"]
-            updated_position = list()
-            for position in positions:
-                if position["position_id"] == position_id:
-                    
-                    all_voters = list()
-                    # ensure that the candidate is valid
-                    candidate_exists = False
-                    candidates = position["candidates"]
-                    updated_candidate = list()
-                    for candidate in candidates:
-                        # get all those who have voted in that election position
-                        all_voters.extend(candidate["candidate_voters"])
-                        
-                        if candidate["candidate_id"] == vote_info["candidate_id"]:
-                            candidate_exists = True
-                            
-                    if not candidate_exists:
-                        return jsonify({"message": f"Candidate with id {vote_info['candidate_id']} has not been registered for the {position['position_name']} position!"})
-                    
-                    # ensure that the candidate hasn't voted before
-                    if vote_info["student_id"] in all_voters:
-                        return jsonify({"message": "You cannot vote twice for one position!"}), 403
-                    
-                    # cast vote by adding student id to candidate_voters
-                    for candidate in candidates:
-                        if candidate["candidate_id"] == vote_info["candidate_id"]:
-                            candidate["candidate_voters"].append(vote_info["student_id"])
-                            
-                        updated_candidate.append(candidate)
-                        
-                    position["candidates"] = updated_candidate
-                    
-                    break
-                updated_position.append(position)
-            election_info = election
+    # read the election being voted in
+    election = storage.get("elections", election_id)
+    if election is None:
+        return jsonify({"message": f"Election with code {election_id} does not exist!"}), 404
+    
+    # ensure that the position exist
+    position = None
+    for election_position in election["positions"]:
+        if election_position["position_id"] == position_id:
+            position = election_position
             break
-        updated_elections_data.append(election)
     
-    if not election_exists:
-        return jsonify({"message": f"Election with code {election_id} does not exist!"}), 404
+    if position is None:
+        return jsonify({"message": f"Position with id {position_id} does not exist in election {election_id}!"}), 404
     
-    return jsonify(election_info)
+    # ensure that the candidate is valid
+    # (elections created before ballots were stored separately keep their voters on each candidate)
+    candidate_exists = False
+    legacy_voters = list()
+    for candidate in position["candidates"]:
+        legacy_voters.extend(candidate.get("candidate_voters", []))
+        
+        if candidate["candidate_id"] == vote_info["candidate_id"]:
+            candidate_exists = True
+            
+    if not candidate_exists:
+        return jsonify({"message": f"Candidate with id {vote_info['candidate_id']} has not been registered for the {position['position_name']} position!"})
+    
+    # ensure that the student hasn't voted before
+    ballot_id = BallotBox.ballot_id(election_id, position_id, vote_info["student_id"])
+    if vote_info["student_id"] in legacy_voters:
+        return jsonify({"message": "You cannot vote twice for one position!"}), 403
+    
+    # cast vote by storing the student's ballot, which updates the candidate's vote count
+    # and fails if the student has already voted for the position
+    ballot = {
+            "ballot_id": ballot_id, "election_code": election_id, "position_id": position_id,
+            "student_id": vote_info["student_id"], "candidate_id": vote_info["candidate_id"]
+        }
+    if not cast_ballot(ballot):
+        return jsonify({"message": "You cannot vote twice for one position!"}), 403
+    election_cache.invalidate(election_id)
+    
+    # (the ballots are read again since the file backend replaces its container on every write)
+    return jsonify(attach_tallies(election, storage.index("ballots").tallies(election_id)))
 
 if __name__=='__main__':
     voting_app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,264 @@
+from bisect import bisect_left, bisect_right, insort
+
+
+class PrefixIndex:
+    """a sorted array of (lowercased value, student_id) pairs that answers
+    case-insensitive prefix queries with binary search
+    """
+
+    def __init__(self):
+        self._entries = list()
+
+    def add(self, value, student_id):
+        insort(self._entries, (value.lower(), student_id))
+
+    def remove(self, value, student_id):
+        entry = (value.lower(), student_id)
+        position = bisect_left(self._entries, entry)
+        if position < len(self._entries) and self._entries[position] == entry:
+            del self._entries[position]
+
+    def _bounds(self, prefix):
+        prefix = prefix.lower()
+        start = bisect_left(self._entries, (prefix,))
+        # every value starting with the prefix sorts before prefix + the largest code point
+        end = bisect_left(self._entries, (prefix + "\U0010ffff",))
+        return start, end
+
+    def count(self, prefix):
+        """returns the number of values starting with the given prefix"""
+
+        start, end = self._bounds(prefix)
+        return end - start
+
+    def search(self, prefix):
+        """returns the set of student ids whose value starts with the given prefix"""
+
+        start, end = self._bounds(prefix)
+        return {student_id for _, student_id in self._entries[start:end]}
+
+
+class VoterRegistry:
+    """an in-memory collection of voters keyed by student id, with a hash index on
+    email, a secondary index on year group, prefix indexes on firstname, lastname
+    and email and a sorted index of student ids so that uniqueness checks, lookups,
+    filters and pages do not need to scan every voter.
+    It behaves like a dict of student_id -> voter. Reads do not take a lock, so they
+    iterate over snapshots of the indexes in case a writer changes them meanwhile.
+
+    Args:
+        voters (iterable): voters (dict) to add to the registry
+    """
+
+    # fields that can be filtered by a case-insensitive prefix
+    PREFIX_FIELDS = ["firstname", "lastname", "email"]
+
+    def __init__(self, voters=()):
+        self._voters = dict()           # student_id -> voter
+        self._ranks = dict()            # student_id -> insertion rank, to keep results in registry order
+        self._next_rank = 0
+        self._student_ids = list()      # sorted student ids, for pages ordered by student id
+        self._emails = dict()           # email -> student_id
+        self._year_groups = dict()      # year_group -> dict of student_id -> voter
+        self._prefixes = {field: PrefixIndex() for field in self.PREFIX_FIELDS}
+
+        for voter in voters:
+            self[voter["student_id"]] = voter
+
+    @staticmethod
+    def year_group(student_id):
+        # the last four digits of a student id is the student's year group
+        return student_id[4:]
+
+    def _index(self, student_id, voter):
+        self._emails[voter["email"]] = student_id
+        self._year_groups.setdefault(self.year_group(student_id), dict())[student_id] = voter
+        for field, index in self._prefixes.items():
+            index.add(str(voter[field]), student_id)
+
+    def _unindex(self, student_id, voter):
+        if self._emails.get(voter["email"]) == student_id:
+            del self._emails[voter["email"]]
+
+        year_group = self._year_groups[self.year_group(student_id)]
+        del year_group[student_id]
+        if not year_group:
+            del self._year_groups[self.year_group(student_id)]
+
+        for field, index in self._prefixes.items():
+            index.remove(str(voter[field]), student_id)
+
+    def __setitem__(self, student_id, voter):
+        # replacing a voter keeps its position in the registry
+        if student_id in self._voters:
+            self._unindex(student_id, self._voters[student_id])
+        else:
+            self._ranks[student_id] = self._next_rank
+            self._next_rank += 1
+            insort(self._student_ids, student_id)
+
+        self._voters[student_id] = voter
+        self._index(student_id, voter)
+
+    def __delitem__(self, student_id):
+        voter = self._voters.pop(student_id)
+        del self._ranks[student_id]
+        del self._student_ids[bisect_left(self._student_ids, student_id)]
+        self._unindex(student_id, voter)
+
+    def __getitem__(self, student_id):
+        return self._voters[student_id]
+
+    def __contains__(self, student_id):
+        return student_id in self._voters
+
+    def __iter__(self):
+        return iter(self._voters)
+
+    def __len__(self):
+        return len(self._voters)
+
+    def get(self, student_id, default=None):
+        return self._voters.get(student_id, default)
+
+    def values(self):
+        return self._voters.values()
+
+    def page(self, cursor=None, limit=None):
+        """returns the voters ordered by student id that come after the given cursor
+
+        Args:
+            cursor (str): the student id after which the page starts (None for the first page)
+            limit (int): the maximum number of voters to return (None for all of them)
+
+        Returns:
+            list: a list of voters (dict)
+        """
+
+        start = 0 if cursor is None else bisect_right(self._student_ids, cursor)
+        end = len(self._student_ids) if limit is None else start + limit
+        return [self._voters[student_id] for student_id in self._student_ids[start:end]]
+
+    def get_by_email(self, email):
+        """returns the voter registered with the given email
+
+        Args:
+            email (str): the voter's email
+
+        Returns:
+            dict: the voter or None if no voter has the email
+        """
+
+        student_id = self._emails.get(email)
+        if student_id is None:
+            return None
+        return self._voters[student_id]
+
+    def in_year_group(self, year_group):
+        """returns all voters in the given year group
+
+        Args:
+            year_group (str): a four digit year group
+
+        Returns:
+            list: a list of voters (dict)
+        """
+
+        return list(self._year_groups.get(year_group, dict()).values())
+
+    def is_unique(self, key, value, student_id=None):
+        """ensures that no voter, other than the voter with the given student id,
+        already uses the given value for a unique key (student_id or email)
+
+        Args:
+            key (str): the unique key
+            value (str): the value to check
+            student_id (str): the student id of the voter being checked, if it
+            should be excluded from the check
+
+        Returns:
+            bool: whether or not the value is unique
+        """
+
+        if key == "student_id":
+            owner = value if value in self._voters else None
+        elif key == "email":
+            owner = self._emails.get(value)
+        else:
+            raise KeyError(f"{key} is not indexed")
+
+        return owner is None or owner == student_id
+
+    def _candidates(self, key, value):
+        # returns the ids matching a single filter and an estimate of how many there are
+        if key == "student_id":
+            ids = {value} if value in self._voters else set()
+            return len(ids), lambda: ids
+        if key == "year_group":
+            ids = self._year_groups.get(value, dict())
+            return len(ids), lambda: set(ids)
+        if key in self._prefixes:
+            index = self._prefixes[key]
+            return index.count(value), lambda: index.search(value)
+        return None
+
+    @staticmethod
+    def matches(voter, key, value):
+        """checks a voter against a single filter (see filter)
+
+        Args:
+            voter (dict): the voter
+            key (str): the voter attribute filtered by
+            value: the value to filter by
+
+        Returns:
+            bool: whether or not the voter matches the filter
+        """
+
+        if key == "year_group":
+            return VoterRegistry.year_group(voter["student_id"]) == value
+        if isinstance(value, str):
+            return str(voter[key]).lower().startswith(value.lower())
+        return voter[key] == value
+
+    def filter(self, filters):
+        """returns the voters that match all the given filters.
+        String filters match case-insensitive prefixes of the voter's value (and
+        year_group is derived from the student id); other filters match exactly.
+        Candidates are taken from the most selective indexed filter and checked
+        against the remaining filters, so the cost depends on the size of the
+        smallest candidate set rather than the size of the registry
+
+        Args:
+            filters (dict): maps a voter attribute to the value to filter by
+
+        Returns:
+            list: a list of matching voters (dict) in registry order
+        """
+
+        indexed = list()
+        for key, value in filters.items():
+            candidates = self._candidates(key, value)
+            if candidates is not None:
+                indexed.append((candidates[0], key, candidates[1]))
+
+        if indexed:
+            _, most_selective, search = min(indexed, key=lambda candidates: candidates[0])
+            student_ids = search()
+        else:
+            most_selective = None
+            # a snapshot of the ids, since the registry may be changed by writers while it is read
+            student_ids = list(self._voters)
+
+        result = list()
+        for student_id in student_ids:
+            voter = self._voters.get(student_id)
+            # voters removed since the candidates were found are skipped
+            if voter is None:
+                continue
+            if all(self.matches(voter, key, value) for key, value in filters.items() if key != most_selective):
+                result.append(voter)
+
+        ranks = self._ranks
+        result.sort(key=lambda voter: ranks.get(voter["student_id"], len(ranks)))
+        return result
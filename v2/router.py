@@ -0,0 +1,167 @@
+from flask import jsonify
+
+
+class Router:
+    """a table of routes mapping a method and a path pattern to a handler, compiled into
+    a tree of path segments so that a request is matched with one dict lookup per segment
+    of its path, whatever the number of routes. A segment written <name> in a pattern
+    matches any segment, which is passed to the handler as its name argument. Fixed
+    segments take precedence over parameters, and a parameter is tried in place of a fixed
+    segment when the routes after the fixed segment do not handle the request (e.g.
+    GET /elections/vote/results/ with the routes POST /elections/vote/<election_code>/ and
+    GET /elections/<election_code>/results/). Empty segments are ignored, so paths match
+    with or without a trailing slash.
+    The same table is used by v2 (through a Flask route matching every path) and v3
+    (through the functions framework's single http function)
+    """
+
+    # the methods of the requests dispatched through a router (Flask also routes HEAD
+    # requests to rules handling GET)
+    METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE"]
+
+    def __init__(self):
+        self._root = self._node()
+
+    @staticmethod
+    def _node():
+        return {"segments": dict(), "parameter": None, "handlers": dict()}
+
+    @staticmethod
+    def _segments(path):
+        return list(filter(None, path.split("/")))
+
+    def add(self, pattern, methods, handler):
+        """adds a route
+
+        Args:
+            pattern (str): the path pattern, e.g. /elections/<election_code>/results/
+            methods (list): the HTTP methods handled by the handler
+            handler (function): called with the pattern's parameters as keyword arguments
+        """
+
+        node = self._root
+        names = list()
+        for segment in self._segments(pattern):
+            if segment.startswith("<") and segment.endswith(">"):
+                if node["parameter"] is None:
+                    node["parameter"] = self._node()
+                node = node["parameter"]
+                names.append(segment[1:-1])
+            else:
+                node = node["segments"].setdefault(segment, self._node())
+
+        for method in methods:
+            node["handlers"][method] = (handler, names)
+
+    def route(self, pattern, methods=("GET",)):
+        """a decorator adding a route to the decorated handler (like Flask's route)
+
+        Args:
+            pattern (str): the path pattern
+            methods (list): the HTTP methods handled by the handler
+        """
+
+        def decorator(handler):
+            self.add(pattern, methods, handler)
+            return handler
+        return decorator
+
+    def match(self, method, path):
+        """finds the handler of a request
+
+        Args:
+            method (str): the request's method
+            path (str): the request's path
+
+        Returns:
+            tuple: the handler and the values of its pattern's parameters (dict), or None
+            and the status code of the failure (404 if no route matches the path, 405 if
+            no route of the path handles the method)
+        """
+
+        segments = self._segments(path)
+
+        # most paths are matched by following fixed segments where they exist
+        node = self._root
+        values = list()
+        for segment in segments:
+            child = node["segments"].get(segment)
+            if child is None:
+                child = node["parameter"]
+                if child is None:
+                    break
+                values.append(segment)
+            node = child
+        else:
+            if method in node["handlers"]:
+                handler, names = node["handlers"][method]
+                return handler, dict(zip(names, values))
+
+        # else a depth-first search of the nodes matching the path, trying fixed segments
+        # first (they are pushed last)
+        status = 404
+        stack = [(self._root, 0, ())]
+        while stack:
+            node, index, values = stack.pop()
+            if index < len(segments):
+                segment = segments[index]
+                if node["parameter"] is not None:
+                    stack.append((node["parameter"], index + 1, values + (segment,)))
+                child = node["segments"].get(segment)
+                if child is not None:
+                    stack.append((child, index + 1, values))
+                continue
+
+            handlers = node["handlers"]
+            if not handlers:
+                continue
+            # HEAD requests are answered by the GET handler (the server drops the body), as Flask does
+            if method in handlers:
+                handler, names = handlers[method]
+            elif method == "HEAD" and "GET" in handlers:
+                handler, names = handlers["GET"]
+            else:
+                status = 405
+                continue
+            return handler, dict(zip(names, values))
+
+        return None, status
+
+    def segments(self, prefix):
+        """returns the fixed segments that can follow a path prefix in the routes, which a
+        parameter after the prefix should not take as its value (e.g. "vote" is not a
+        valid election code when /elections/vote/<election_code>/ is a route)
+
+        Args:
+            prefix (str): the path prefix, made of fixed segments (e.g. /elections/)
+
+        Returns:
+            set: the fixed segments
+        """
+
+        node = self._root
+        for segment in self._segments(prefix):
+            node = node["segments"].get(segment)
+            if node is None:
+                return set()
+        return set(node["segments"])
+
+    def dispatch(self, method, path, *args):
+        """calls the handler of a request
+
+        Args:
+            method (str): the request's method
+            path (str): the request's path
+            args: positional arguments passed to the handler before its pattern's parameters
+
+        Returns:
+            Response: the handler's response or a JSON message if no route matches the request
+        """
+
+        handler, arguments = self.match(method, path)
+        if handler is None:
+            if arguments == 404:
+                return jsonify({"message": "Invalid endpoint!"}), 404
+            return jsonify({"message": "Invalid request!"}), 405
+
+        return handler(*args, **arguments)
@@ -0,0 +1,162 @@
+class Field:
+    """describes a field of a JSON object (see Schema)
+
+    Args:
+        kind (type or tuple): the type(s) the field's value must have (booleans are not numbers)
+        checks (list): (predicate, message) pairs, the message is reported for the first
+        predicate that is false for the value, with {label} replaced by the field's label.
+        Predicates must not raise for a value of the field's kind (a later predicate only
+        sees values the earlier ones accepted)
+        items (Field or Schema): describes every item of a list value
+        item_label (str): the name of an item of a list value in messages (e.g. Position)
+        min_items (int): the minimum number of items of a list value
+        unique (bool or str): whether the items of a list value must be unique, or the
+        field of the (object) items whose values must be unique
+        required (bool): whether or not the field must be present
+        label (str): the name of the field in messages (the field name capitalized by default)
+    """
+
+    def __init__(self, kind, checks=(), items=None, item_label=None, min_items=0, unique=False, required=True,
+                 label=None):
+        self.kind = kind if isinstance(kind, tuple) else (kind,)
+        self.checks = tuple(checks)
+        self.items = items
+        self.item_label = item_label
+        self.min_items = min_items
+        self.unique = unique
+        self.required = required
+        self.label = label
+
+
+# the names of the JSON types in messages
+TYPE_NAMES = {str: "a string", int: "a number", float: "a number", bool: "true or false", list: "a list", dict: "an object"}
+
+
+def _type_name(kind):
+    names = list(dict.fromkeys(TYPE_NAMES.get(item, item.__name__) for item in kind))
+    return " or ".join(names)
+
+
+def _compile_value(field):
+    # returns a function validating a value of the field, adding messages (formatted
+    # only when a value is invalid) to a list of errors
+    kind = field.kind
+    allows_bool = bool in kind
+    wrong_type = "{label} must be " + _type_name(kind) + "."
+    checks = field.checks
+    validate_items = _compile_items(field) if field.items is not None or field.min_items or field.unique else None
+
+    def validate(value, errors, prefix, label):
+        # booleans are ints in Python but not numbers in JSON
+        if not isinstance(value, kind) or (value is True or value is False) and not allows_bool:
+            errors.append(prefix + wrong_type.format(label=label))
+            return
+
+        for predicate, message in checks:
+            if not predicate(value):
+                errors.append(prefix + message.format(label=label))
+                return
+
+        if validate_items is not None:
+            validate_items(value, errors, prefix, label)
+
+    return validate
+
+
+def _compile_items(field):
+    min_items = field.min_items
+    unique = field.unique
+    item_label = field.item_label
+    items = field.items
+    is_object = isinstance(items, Schema)
+
+    if is_object:
+        validate_item = items.validate
+    elif items is not None:
+        validate_item = _compile_value(items)
+    else:
+        validate_item = None
+
+    def validate(values, errors, prefix, label):
+        if len(values) < min_items:
+            errors.append(f"{prefix}{label} must have at least {min_items} item(s).")
+
+        if validate_item is not None:
+            for index, item in enumerate(values, start=1):
+                name = f"{item_label or label} {index}"
+                # messages about an object's fields name the object, e.g. "Position 1: ..."
+                validate_item(item, errors, f"{prefix}{name}: " if is_object else prefix, name)
+
+        if unique:
+            keys = values if unique is True else [item.get(unique) for item in values if isinstance(item, dict)]
+            try:
+                is_unique = len(set(keys)) == len(keys)
+            except TypeError:
+                # unhashable items are reported by their own checks
+                is_unique = True
+            if not is_unique:
+                errors.append(f"{prefix}{label} must be unique." if unique is True
+                              else f"{prefix}{label} must have unique {unique} values.")
+
+    return validate
+
+
+class Schema:
+    """a declarative description of the fields of a JSON object (e.g. a voter), compiled
+    once into validator functions that report every invalid field (and every invalid
+    item of nested lists) in one pass. Fields that are not described are not checked
+
+    Args:
+        fields (dict): maps a field name to its Field
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self._validators = tuple(self._compile_field(name, field) for name, field in fields.items())
+
+    @staticmethod
+    def _compile_field(name, field):
+        label = field.label or name.capitalize()
+        missing = f"{label} is required"
+        required = field.required
+        validate_value = _compile_value(field)
+
+        def validate(data, errors, prefix):
+            if name not in data:
+                if required:
+                    errors.append(prefix + missing)
+                return
+            validate_value(data[name], errors, prefix, label)
+
+        return validate
+
+    def validate(self, data, errors, prefix="", label="Data"):
+        """adds the messages describing why data does not match the schema to a list of errors
+
+        Args:
+            data (dict): the JSON object
+            errors (list): the list the messages are added to
+            prefix (str): prepended to every message (e.g. the position of a nested object)
+            label (str): the name of the object in messages
+        """
+
+        if not isinstance(data, dict):
+            errors.append(f"{prefix}{label} must be an object.")
+            return
+
+        for validate in self._validators:
+            validate(data, errors, prefix)
+
+    def errors(self, data):
+        """returns the messages describing why data does not match the schema
+
+        Args:
+            data (dict): the JSON object
+
+        Returns:
+            list: the messages, empty if the data is valid
+        """
+
+        errors = list()
+        self.validate(data, errors)
+        return errors
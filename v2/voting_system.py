@@ -2,26 +2,47 @@
 import os
 import json
 from datetime import timedelta
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 
 # import helper methods
 from helper import (
-    valid_request_body, valid_voter_info, 
-    valid_student_id, valid_keys,
+    valid_request_body, request_json, valid_voter_info, 
+    valid_student_id, schema_error, ELECTION_SCHEMA, VOTE_SCHEMA,
+    voter_info_error, read_voter_rows,
     key_is_unique, get_voters,
-    
-    FIRST_YEAR_GROUP, VOTERS_COLLECTION, 
-    ELECTIONS_COLLECTION
+    get_document, voter_document, voter_from_document, voters_query,
+    get_tallies, attach_tallies, cast_ballot, delete_election_data,
+    election_results, election_cache,
+    make_etag, not_modified, with_etag, write_voters, voters_version,
+    page_arguments, split_page, paginate, voters_response, peek,
+    set_document, delete_document, deregister_voters, add_write_count, write_count,
+    voters_collection, elections_collection, tally_feed,
+    
+    FIRST_YEAR_GROUP, MAX_BATCH_SIZE, LIVE_KEEPALIVE_INTERVAL, LIVE_POLL_TIMEOUT
 )
+from registry import VoterRegistry
+from router import Router
 
 
 # Initialising the flask app
 voting_app = Flask(__name__)
+
+# report the number of database writes made by each request
+voting_app.after_request(add_write_count)
+
+# every request is dispatched through the route table (see router.py), which v3 shares
+routes = Router()
+
+
+@voting_app.route("/", defaults={"path": ""}, methods=Router.METHODS)
+@voting_app.route("/<path:path>", methods=Router.METHODS)
+def dispatch(path):
+    return routes.dispatch(request.method, request.path)
     
 
 # _____________________________________________________________________________________________________________________
 # REGISTER AN ASHESI STUDENT AS A VOTER
-@voting_app.route("/voters/register_voter/", methods=["POST"])
+@routes.route("/voters/register_voter/", methods=["POST"])
 def register_voter():
     """handles a POST request to created a voter and returns a JSON
     object of the voter's information if all validation and constraints
@@ -45,15 +66,82 @@ def register_voter():
     # set can vote attribute
     voter_info["is_registered"] = True
     
-    # write the data into the voters collection
-    VOTERS_COLLECTION.document(voter_info["student_id"]).set(voter_info)
+    # write the data into the voters collection (with the voters version)
+    write_voters([("set", voters_collection().document(voter_info["student_id"]), voter_document(voter_info))])
         
     return jsonify(voter_info), 201
 
 
+# _____________________________________________________________________________________________________________________
+# REGISTER MANY ASHESI STUDENTS AS VOTERS
+@routes.route("/voters/bulk_register/", methods=["POST"])
+def bulk_register_voters():
+    """handles a POST request to register many voters at once. The request body is
+    streamed as CSV (content type text/csv, with a header row) or NDJSON (one voter per line),
+    and every row is validated with the same rules as register_voter and checked for
+    unique student ids and emails against existing voters and earlier rows.
+    The response is streamed as NDJSON: one line per rejected row with the row number
+    and the validation or constraint failure, followed by a line with the number
+    of registered voters and of writes made (the X-Write-Count header is not sent,
+    as the writes are made after the headers)
+
+    Returns:
+        Response: a streamed NDJSON response of rejected rows and the number of registered voters
+    """
+    
+    def register_rows():
+        # read the student ids and emails of existing voters (only those two fields)
+        student_ids = set()             # student ids of existing voters and valid rows
+        emails = set()                  # emails of existing voters and valid rows
+        for voter in voters_collection().select(["student_id", "email"]).stream():
+            voter = voter.to_dict()
+            student_ids.add(voter["student_id"])
+            emails.add(voter["email"])
+        
+        voters_data = list()            # valid rows waiting to be written
+        num_registered = 0
+        
+        for row_number, voter_info in read_voter_rows(request):
+            if voter_info is None:
+                error = {"message": "Row is not a valid voter record."}
+            else:
+                error = voter_info_error(voter_info)
+            
+            # ensure keys are unique among existing voters and earlier rows
+            if error is None:
+                error = dict()
+                if voter_info["student_id"] in student_ids:
+                    error["student_id"] = "student_id already exists!"
+                if voter_info["email"] in emails:
+                    error["email"] = "email already exists!"
+                error = error or None
+            
+            if error is not None:
+                yield json.dumps({"row": row_number, "error": error}) + "\n"
+                continue
+            
+            # set can vote attribute
+            voter_info["is_registered"] = True
+            student_ids.add(voter_info["student_id"])
+            emails.add(voter_info["email"])
+            voters_data.append(voter_document(voter_info))
+            
+            # write the new voters in full batches as the body is read
+            # (a batch leaves room for the increment of the voters version, see write_voters)
+            if len(voters_data) == MAX_BATCH_SIZE - 1:
+                num_registered += write_voters(("set", voters_collection().document(voter["student_id"]), voter) for voter in voters_data)
+                voters_data.clear()
+        
+        num_registered += write_voters(("set", voters_collection().document(voter["student_id"]), voter) for voter in voters_data)
+        
+        yield json.dumps({"message": f"{num_registered} voters have been registered!", "registered": num_registered, "writes": write_count()}) + "\n"
+    
+    return Response(stream_with_context(register_rows()), mimetype="application/x-ndjson")
+
+
 # __________________________________________________________________________________________________________________________
 # DEREGISTER A STUDENT AS A VOTER
-@voting_app.route("/voters/de_register/<value>/", methods=["PATCH"])
+@routes.route("/voters/de_register/<value>/", methods=["PATCH"])
 def deregister_voter(value):
     """deregisters a specified voter (voter with given student id) or 
     specified voters (students in a particular year group) by setting their
@@ -77,28 +165,24 @@ def deregister_voter(value):
         if not valid_student_id(value):
             return jsonify({"message": "Invalid student id!"}), 400
     
-    voters_data = VOTERS_COLLECTION.get()              # get all voters    
-    updated_voters_data = list()                    # list of all voters
     updated_voters = []                             # list of only updated voters
 
     # update specified user's is_registered attribute to deregister them
     if key == "student_id":
-        for voter in voters_data:
-            voter = voter.to_dict()
-            if voter[key] == value:
-                voter["is_registered"] = False
-                updated_voters.append(voter)
-            updated_voters_data.append(voter)
-    
-    # updated all students in specified year group's is_registered attribute
+        voter = get_document(voters_collection(), value)
+        if voter is not None:
+            voter = voter_from_document(voter)
+            voter["is_registered"] = False
+            updated_voters.append(voter)
+    
+    # updated all registered students in specified year group's is_registered attribute
+    # (only voters in the year group are read, using the stored year_group field)
     else:
-        for voter in voters_data:
-            voter = voter.to_dict()
-            id_details = valid_student_id(voter["student_id"])
-            if id_details[key] == value:
-                voter["is_registered"] = False
-                updated_voters.append(voter)
-            updated_voters_data.append(voter)
+        query = voters_collection().where("year_group", "==", value).where("is_registered", "==", True)
+        for voter in query.stream():
+            voter = voter_from_document(voter.to_dict())
+            voter["is_registered"] = False
+            updated_voters.append(voter)
         
     # if user with id not found, return appropriate message
     if not updated_voters and key == "student_id":
@@ -106,9 +190,8 @@ def deregister_voter(value):
     elif not updated_voters and key == "year_group":
         return jsonify({"message": f"No registered voter in the {value} year group!"}), 404    
         
-    # write updated data into the voters collection
-    for voter in updated_voters:
-        VOTERS_COLLECTION.document(voter["student_id"]).set(voter)
+    # write only the is_registered attribute of the updated voters, in batches
+    deregister_voters([voter["student_id"] for voter in updated_voters])
 
     # attach appropriate message title
     if key == "student_id":
@@ -121,7 +204,7 @@ def deregister_voter(value):
 
 # ____________________________________________________________________________________________________________________________________
 # UPDATE REGISTERED VOTER'S INFORMATION
-@voting_app.route("/voters/update_voter/<student_id>/", methods=["PUT"])
+@routes.route("/voters/update_voter/<student_id>/", methods=["PUT"])
 def update_voter(student_id):
     """updates the details of the voter with the specified student id if it exists
     else it creates a new record in the database if the request data meet all specified constraints
@@ -150,37 +233,23 @@ def update_voter(student_id):
     if not voter_info["is_registered"]:
         return jsonify({"message": "You cannot use update to deregister, use dregister function instead!"})
     
-    # reading existing data into a list
-    voters_data = VOTERS_COLLECTION.get()
-    updated_voters_data = list()
- 
-    if not voters_data:
-        VOTERS_COLLECTION.document(voter_info["student_id"]).set(voter_info)
-    else:
-        # get the voter with specified id
-        for voter in voters_data:
-            voter = voter.to_dict()
-            if voter["student_id"] == voter_info["student_id"]:
-
-                # ensure that the voter specified is registered
-                if not voter["is_registered"]:
-                    return jsonify({"message": f"Voter with id {student_id} is not registered."}), 404
-                
-                # replace data in file
-                voter = voter_info
-                voter["is_registered"] = True
-            updated_voters_data.append(voter)
-        
-    # write the updated data into the file
-    for voter in updated_voters_data:
-        VOTERS_COLLECTION.document(voter["student_id"]).set(voter)
+    # get the voter with specified id
+    voter = get_document(voters_collection(), voter_info["student_id"])
+    
+    # ensure that the voter specified is registered
+    if voter is not None and not voter["is_registered"]:
+        return jsonify({"message": f"Voter with id {voter_info['student_id']} is not registered."}), 404
+    
+    # write only the updated voter into the voters collection (with the voters version)
+    voter_info["is_registered"] = True
+    write_voters([("set", voters_collection().document(voter_info["student_id"]), voter_document(voter_info))])
     
     return jsonify(voter_info)
 
 
 # ________________________________________________________________________________________________________________________________________________
 # RETRIEVE A REGISTERED VOTER 
-@voting_app.route("/voters/get/", methods=["GET"])
+@routes.route("/voters/get/", methods=["GET"])
 def retrieve_voters():
     """uses all specified arguments (attributes of voter) parsed for filtering
     matching voters and returns the result. If no attribute is parsed, it retrieves
@@ -188,6 +257,9 @@ def retrieve_voters():
     * Attributes being used for filtering are: 
     - student_id           - firstname
     - lastname              - email         - year_group
+    With a limit or cursor argument, voters are returned in pages ordered by student id,
+    and the cursor of the next page is returned in the X-Next-Cursor header. The fields
+    argument selects the attributes returned for each voter (e.g. fields=student_id,firstname)
 
     Returns:
         dict: JSON representation of the list of voters (dict) that match filter attributes
@@ -196,10 +268,6 @@ def retrieve_voters():
     # dict to store all keys and values for filter
     filter_dict = dict()
     
-    # stores resulting list from filtering
-    result_list = list()
-    final_result_list = list()
-    
     # get all attributes specified in the request args
     if request.args.get("student_id"):
         filter_dict["student_id"] = request.args.get("student_id")
@@ -219,18 +287,43 @@ def retrieve_voters():
     if request.args.get("is_registered"):
         filter_dict["is_registered"] = request.args.get("is_registered")
 
-    # read the voters file
-    data = VOTERS_COLLECTION.get()
-    voters_data = list()
-    for voter in data:
-        voters_data.append(voter.to_dict())
-        
-    if not voters_data:
-        return jsonify({"message": "No voter has been registered!"}), 404
-    
+    # read the pagination and projection arguments
+    page = page_arguments(request)
+    if type(page) == tuple:
+        return page
+    is_paged = page["limit"] is not None or page["cursor"] is not None
+
+    # the voters matching the arguments only change when voters are written, so a client
+    # that already has the latest list is answered without reading or serializing it
+    etag = make_etag(voters_version(), sorted(request.args.items(multi=True)))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
     # if no argument is parsed, retrieve all users
+    # (a page is read from Firestore, starting after the cursor's student id,
+    # with only the requested fields)
     if not filter_dict:
-        return jsonify(voters_data)
+        query = voters_collection()
+        if is_paged:
+            query = query.order_by("student_id")
+            if page["cursor"] is not None:
+                query = query.start_after({"student_id": page["cursor"]})
+            if page["limit"] is not None:
+                query = query.limit(page["limit"] + 1)
+        if page["fields"] is not None:
+            query = query.select(list(set(page["fields"]) | {"student_id"}))
+        
+        # voters are streamed from Firestore into the response (only the first one is
+        # read here, to find out whether there are any)
+        voters_data = peek(voter_from_document(voter.to_dict()) for voter in query.stream())
+        if voters_data is None:
+            if page["cursor"] is None:
+                return jsonify({"message": "No voter has been registered!"}), 404
+            voters_data = list()
+        
+        voters_data, next_cursor = split_page(voters_data, page["limit"])
+        return with_etag(voters_response(voters_data, next_cursor, page["fields"]), etag)
         
     for key in filter_dict.keys():
 
@@ -263,43 +356,30 @@ def retrieve_voters():
         else:
             if int(filter_dict["year_group"]) < FIRST_YEAR_GROUP:
                 return jsonify({"message": "Student year group is invalid."})
-            
-        # empty the result list before new filter is applied
-        result_list.clear()
-            
-        # get all user with specified key
-        for voter in voters_data:
-            # since year group isn't being stored, handle it differently
-            if key == "year_group":
-                # get year group of voter from voter's student_id
-                student_id_details = valid_student_id(voter.get("student_id"))
-                year_group = student_id_details["year_group"]
-                if year_group == filter_dict[key]:
-                    result_list.append(voter)
-            else:
-                if type(filter_dict[key]) == str:
-                    if voter.get(key).lower() == filter_dict[key].lower() or voter.get(key).lower().startswith(filter_dict[key].lower()):
-                        result_list.append(voter)
-                else:
-                    if voter.get(key) == filter_dict[key]:
-                        result_list.append(voter)
-        
-        # update the data being returned
-        final_result_list = result_list[:]
-        
-        # update the data being used for filtering
-        voters_data = final_result_list
+    
+    # fetch only the voters matched by the filters Firestore can apply and
+    # apply all filters (including any remaining name prefix) in a single pass over them
+    query = voters_query(filter_dict)
+    final_result_list = list()
+    for document in query.stream():
+        voter = voter_from_document(document.to_dict())
+        if all(VoterRegistry.matches(voter, key, value) for key, value in filter_dict.items()):
+            final_result_list.append(voter)
                 
     # ensure that the result list is not empty
     if not final_result_list:
         return jsonify({"message": "No voter found with the provided details"}), 404
     print("I'm here")
-    return jsonify(final_result_list)
+    next_cursor = None
+    if is_paged:
+        final_result_list, next_cursor = paginate(final_result_list, page["cursor"], page["limit"])
+    
+    return with_etag(voters_response(final_result_list, next_cursor, page["fields"]), etag)
 
 
 # ______________________________________________________________________________________________________________________________________________________________
 # CREATE AN ELECTION
-@voting_app.route("/elections/create_election/", methods=["POST"])
+@routes.route("/elections/create_election/", methods=["POST"])
 def create_election():
     
     
@@ -308,36 +388,38 @@ def create_election():
         return jsonify({"message": "Election information not provided!"}), 404
     
     # get election information from request 
-    election_info = json.loads(request.data)
-    
-    # ensure that the data contains all expected fields
-    # if validation fails, return appropriate message
-    # expected keys
-    ELECTION_KEYS = [
-            "election_code", "election_name", "election_startdate",
-            "election_period", "positions"
-        ]
-    
-    validate_data = valid_keys(election_info, ELECTION_KEYS)
-    if validate_data["is_valid"] == False:
-        return jsonify(validate_data["message"]), 400
-    
-    # read existing elections data
-    data = ELECTIONS_COLLECTION.get()
+    election_info = request_json(request)
+    
+    # ensure that the election, its positions and their candidates are valid
+    # if validation fails, return all the validation errors
+    error = schema_error(ELECTION_SCHEMA.errors(election_info))
+    if error is not None:
+        return jsonify(error), 400
+    
+    # the election code is used in paths after /elections/, so it cannot be one of the
+    # fixed segments of those paths (e.g. vote, as in /elections/vote/<election_code>/)
+    if election_info["election_code"] in routes.segments("/elections/"):
+        return jsonify({"election_code": f"{election_info['election_code']} cannot be used as an election code!"}), 400
+    
+    # read only the existing elections that could conflict with the unique keys
+    elections_data = list()
+    election = get_document(elections_collection(), election_info["election_code"])
+    if election is not None:
+        elections_data.append(election)
+    for election in elections_collection().where("election_name", "==", election_info["election_name"]).limit(1).stream():
+        elections_data.append(election.to_dict())
     
     # validate election unique constraints if there are existing election information
     unique_keys = ["election_code", "election_name"]
-    if data:    
-        elections_data = json.loads(data)
+    if elections_data:    
         ununique_result = key_is_unique(unique_keys, elections_data, election_info)
         if len(ununique_result) > 0:
             return jsonify(ununique_result), 400
         
-    # NOTE: PROGRAM ASSUMES DATA FOR VARIOUS FIELDS HAVE BEEN VALIDATED AND DATA FORMATS (STRUCTURES, etc) ARE VALID
-        
     # EXTRA FIELDS NEEDED IN PROGRAM:
-    # 1. add num_votes to all candidates provided for a position 
-    # 2. add voters (a list of voters who have voted for a candidate) to all positions
+    # 1. wrap all candidates provided for a position in a dictionary
+    # NOTE: ballots and vote counts are stored separately from the election (see vote), 
+    # num_votes is added to each candidate when the election is read
     
     election_positions = election_info["positions"]
     updated_positions = list()
@@ -348,7 +430,6 @@ def create_election():
         for candidate in candidates:
             candidates_dictionary = dict()
             candidates_dictionary["candidate_id"] = candidate
-            candidates_dictionary["candidate_voters"] = list()
             
             updated_candidates.append(candidates_dictionary)
 
@@ -358,44 +439,145 @@ def create_election():
     election_info["positions"] = updated_positions     
     
     # write the data to elections collection
-    ELECTIONS_COLLECTION.document(election_info["election_code"]).set(election_info)
+    set_document(elections_collection(), election_info["election_code"], election_info)
+    election_cache.invalidate(election_info["election_code"])
     
-    return jsonify(election_info)
+    return jsonify(attach_tallies(election_info, dict()))
 
 
 # ____________________________________________________________________________________________________________________________________________________
 # RETRIEVE AN ELECTION
-@voting_app.route("/elections/get/<election_code>/", methods=["GET"])
+@routes.route("/elections/get/<election_code>/", methods=["GET"])
 def retrieve_election(election_code):
-    # read election file
-    elections_data = ELECTIONS_COLLECTION.get()
+    # read the election document with the requested code
+    # read the election (with its vote counts and ETag) through the election cache,
+    # a client that already has the latest election is answered without serializing it
+    election = election_cache.get(election_code)
+    if election is not None:
+        response = not_modified(request, election["etag"])
+        if response is not None:
+            return response
+        return with_etag(jsonify(election["election"]), election["etag"])
+    
+    return jsonify({"message": "Election with requested code does not exist!"}), 404
+
+
+# ____________________________________________________________________________________________________________________________________________________
+# RETRIEVE THE ELECTION CACHE'S STATISTICS
+@routes.route("/elections/cache_stats/", methods=["GET"])
+def retrieve_cache_stats():
+    """returns the number of elections in the election cache, its limits and the
+    number of retrieve_election reads served from it (hits) or from Firestore (misses)
+
+    Returns:
+        JSON: JSON representation of the cache statistics
+    """
+    
+    return jsonify(election_cache.stats())
+
+
+# ____________________________________________________________________________________________________________________________________________________
+# RETRIEVE AN ELECTION'S RESULTS
+@routes.route("/elections/<election_code>/results/", methods=["GET"])
+def retrieve_results(election_code):
+    """returns the number of votes of every candidate, the turnout and the leader(s)
+    of every position of an election, computed from the vote counts kept up to date
+    by vote, so the cost does not depend on the number of ballots cast
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        JSON: JSON representation of the election's results or appropriate message
+        if the election does not exist
+    """
+    
+    election = get_document(elections_collection(), election_code)
+    if election is None:
+        return jsonify({"message": "Election with requested code does not exist!"}), 404
+    
+    return jsonify(election_results(election, get_tallies(election_code)))
+
+
+# ____________________________________________________________________________________________________________________________________________________
+# STREAM AN ELECTION'S LIVE RESULTS
+@routes.route("/elections/<election_code>/results/stream/", methods=["GET"])
+def stream_results(election_code):
+    """streams an election's vote counts as Server-Sent Events: the first event holds
+    all the counts and each following event only the counts that changed. Events are
+    published at most LIVE_MAX_RATE times per second however many votes are cast, and
+    every viewer is served from the same in-memory feed.
+    A reconnecting client resumes from the version in its Last-Event-ID header
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        Response: a text/event-stream of results updates (version, tallies and reset)
+        or appropriate message if the election does not exist
+    """
     
-    # ensure that there are existing data
-    if not elections_data:
-        return jsonify({"message": "No elections have been created!"}), 404
+    if get_document(elections_collection(), election_code) is None:
+        return jsonify({"message": "Election with requested code does not exist!"}), 404
     
-    # loop through data and check if requested key exists
-    for election in elections_data:
-        election = election.to_dict()
-        if election["election_code"] == election_code:
-            return jsonify(election)
+    version = request.headers.get("Last-Event-ID", type=int)
     
-    return jsonify({"message": "Election with requested code does not exist!"}), 404
+    def events(version):
+        while True:
+            update = tally_feed.changes_since(election_code, version, timeout=LIVE_KEEPALIVE_INTERVAL)
+            
+            # the election has been deleted
+            if update is None:
+                return
+            
+            if update["version"] == version and not update["reset"]:
+                yield ": keep-alive\n\n"
+                continue
+            
+            version = update["version"]
+            yield f"id: {version}\ndata: {json.dumps(update)}\n\n"
+    
+    return Response(
+        stream_with_context(events(version)), mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ____________________________________________________________________________________________________________________________________________________
+# LONG-POLL AN ELECTION'S LIVE RESULTS
+@routes.route("/elections/<election_code>/results/poll/", methods=["GET"])
+def poll_results(election_code):
+    """returns the vote counts that changed since the version in the version argument,
+    waiting up to LIVE_POLL_TIMEOUT seconds for a new version. Without a version (or
+    with one too old to catch up from) all the counts are returned at once
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        JSON: the latest version, the changed counts (tallies) and whether or not they are
+        all the counts (reset), or appropriate message if the election does not exist
+    """
+    
+    if get_document(elections_collection(), election_code) is None:
+        return jsonify({"message": "Election with requested code does not exist!"}), 404
+    
+    update = tally_feed.changes_since(election_code, request.args.get("version", type=int), timeout=LIVE_POLL_TIMEOUT)
+    if update is None:
+        return jsonify({"message": "Election with requested code does not exist!"}), 404
+    
+    return jsonify(update)
 
 
 # _______________________________________________________________________________________________________________________________________________________
 # DELETE AN ELECTION
-@voting_app.route("/elections/delete_election/<election_code>/", methods=["DELETE"])
+@routes.route("/elections/delete_election/<election_code>/", methods=["DELETE"])
 def delete_election(election_code):
-    # read election file
-    elections_data = ELECTIONS_COLLECTION.get()
-    
-    # ensure that there are existing data
-    if not elections_data:
-        return jsonify({"message": "No elections have been created!"}), 404
-        
-    # delete document from elections collection
-    if ELECTIONS_COLLECTION.document(election_code).delete():
+    # delete document from elections collection if it exists
+    if get_document(elections_collection(), election_code) is not None:
+        delete_document(elections_collection(), election_code)
+        delete_election_data(election_code)
+        election_cache.invalidate(election_code)
         return jsonify({"message": f"Election with code {election_code} has been deleted successfully!"}) #, 204
     
     return jsonify({"message": "Election with requested code does not exist!"}), 404
@@ -403,7 +585,7 @@ def delete_election(election_code):
 
 # ________________________________________________________________________________________________________________________________________________________
 # VOTE IN AN ELECTION
-@voting_app.route("/elections/vote/<election_code>/", methods=["POST"])
+@routes.route("/elections/vote/<election_code>/", methods=["POST"])
 def vote(election_code):
     
     # get position from URL argument
@@ -417,26 +599,12 @@ def vote(election_code):
         return jsonify({"message": "Election information not provided!"}), 404
     
     # get request data
-    vote_info = json.loads(request.data)
-    
-    # ensure that the data contains student_id and candidate_id
-    VOTING_KEYS = [
-            "student_id", "candidate_id"
-        ]
+    vote_info = request_json(request)
     
-    validate_data = valid_keys(vote_info, VOTING_KEYS)
-    if validate_data["is_valid"] == False:
-        return jsonify(validate_data["message"]), 400
-    
-    # ensure that the student id is valid
-    student_id_is_valid = valid_student_id(vote_info["student_id"])
-    if not student_id_is_valid:
-        return jsonify({"message": "Student ID is not valid."}), 400
-    
-    # ensure that the candidata id is valid
-    student_id_is_valid = valid_student_id(vote_info["candidate_id"])
-    if not student_id_is_valid:
-        return jsonify({"message": "Candidate ID is not valid."}), 400
+    # ensure that the data contains a valid student_id and candidate_id
+    error = schema_error(VOTE_SCHEMA.errors(vote_info))
+    if error is not None:
+        return jsonify(error), 400
     
     # ensure that the student and the candidate are both registered
     student_list = [vote_info["student_id"], vote_info["candidate_id"]]
@@ -445,72 +613,49 @@ def vote(election_code):
     if students_registered == False:
         return jsonify({"message": "Voter or candidate not registered!"}), 404
     
-    # read data
-    voters_data = VOTERS_COLLECTION.get()
-    elections_data = ELECTIONS_COLLECTION.get()
-    
-    if not voters_data:
-        return jsonify({"message": "No voter has been registered!"}), 404
-    
-    if not elections_data:
-        return jsonify({"message": "No election has been created!"}), 404
-    
-    election_info = None
-    updated_elections_data = list()
+    # read the election being voted in
+    election = get_document(elections_collection(), election_code)
+    if election is None:
+        return jsonify({"message": f"Election with code {election_code} does not exist!"}), 404
     
-    for election in elections_data:
-        election = election.to_dict()
-        if election["election_code"] == election_code:
-            
-            # ensure that the position exist
-            positions = election["positions"]
-            updated_position = list()
-            for position in positions:
-                if position["position_id"] == position_id:
-                    
-                    all_voters = list()
-                    # ensure that the candidate is valid
-                    candidate_exists = False
-                    candidates = position["candidates"]
-                    updated_candidate = list()
-                    for candidate in candidates:
-                        # get all those who have voted in that election position
-                        all_voters.extend(candidate["candidate_voters"])
-                        
-                        if candidate["candidate_id"] == vote_info["candidate_id"]:
-                            candidate_exists = True
-                            
-                    if not candidate_exists:
-                        return jsonify({"message": f"Candidate with id {vote_info['candidate_id']} has not been registered for the {position['position_name']} position!"})
-                    
-                    # ensure that the candidate hasn't voted before
-                    if vote_info["student_id"] in all_voters:
-                        return jsonify({"message": "You cannot vote twice for one position!"}), 403
-                    
-                    # cast vote by adding student id to candidate_voters
-                    for candidate in candidates:
-                        if candidate["candidate_id"] == vote_info["candidate_id"]:
-                            candidate["candidate_voters"].append(vote_info["student_id"])
-                            
-                        updated_candidate.append(candidate)
-                    position["candidates"] = updated_candidate
-                    
-                    break
-                updated_position.append(position)
-            election_info = election
-            updated_elections_data.append(election)
-
+    # ensure that the position exist
+    position = None
+    for election_position in election["positions"]:
+        if election_position["position_id"] == position_id:
+            position = election_position
             break
-        updated_elections_data.append(election)
     
-    if election_info == None:
-        return jsonify({"message": f"Election with code {election_code} does not exist!"}), 404
+    if position is None:
+        return jsonify({"message": f"Position with id {position_id} does not exist in election {election_code}!"}), 404
     
-    # write result to the elections collection
-    for election in updated_elections_data:
-        ELECTIONS_COLLECTION.document(election["election_code"]).set(election)
+    # ensure that the candidate is valid
+    # (elections created before ballots were stored separately keep their voters on each candidate)
+    candidate_exists = False
+    legacy_voters = list()
+    for candidate in position["candidates"]:
+        legacy_voters.extend(candidate.get("candidate_voters", []))
+        
+        if candidate["candidate_id"] == vote_info["candidate_id"]:
+            candidate_exists = True
+            
+    if not candidate_exists:
+        return jsonify({"message": f"Candidate with id {vote_info['candidate_id']} has not been registered for the {position['position_name']} position!"})
+    
+    # ensure that the student hasn't voted before
+    if vote_info["student_id"] in legacy_voters:
+        return jsonify({"message": "You cannot vote twice for one position!"}), 403
+    
+    # cast vote by storing the student's ballot and incrementing the candidate's vote count
+    # in one transaction, which fails if the student has already voted for the position
+    ballot = {
+            "position_id": position_id, "student_id": vote_info["student_id"], 
+            "candidate_id": vote_info["candidate_id"]
+        }
+    if not cast_ballot(election_code, ballot):
+        return jsonify({"message": "You cannot vote twice for one position!"}), 403
+    election_cache.invalidate(election_code)
         
-    return jsonify(election_info)
+    return jsonify(attach_tallies(election, get_tallies(election_code)))
 
 if __name__=='__main__':
     voting_app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,520 @@
+"""benchmarks of v3's request handling against an in-memory stand-in for Firestore (see
+fake_firestore.py) whose requests each wait for a simulated round trip, so that no
+Firestore project or emulator is needed. Requests are sent to the functions_framework
+entry points (voting_system and voting_system_async) like the Cloud Function receives
+them. Run from the v3 folder, e.g.
+
+    python benchmark.py async --latency 0.02 --requests 50
+    python benchmark.py reads --sizes 100,1000,10000
+    python benchmark.py deregister --students 2000
+    python benchmark.py startup --runs 5
+    python benchmark.py router
+    python benchmark.py schema
+
+The benchmarks are:
+    async       latency of votes and results requests with the synchronous and the asyncio entry point
+    reads       latency of requests reading single voters and elections as the collections grow
+    deregister  de-registration of a year group with batched partial updates vs one write per student
+    startup     time from import to the first response of a new process, with and without the Firestore setup
+    router      time to find the handler of a request in the route tables of v3 and v2
+    schema      validation of voters, elections and votes with the schemas vs the helpers they replaced
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import timeit
+import argparse
+import importlib
+import statistics
+import subprocess
+
+V3_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+ELECTION_CODE = "BENCH"
+POSITION_ID = "001"
+CANDIDATE_IDS = ["99992002", "99982002"]
+
+
+def student_id(number):
+    # eight digit student ids, 10000 per year group from 2024 on
+    return f"{number % 10000:04d}{2024 + number // 10000}"
+
+
+def voter(student_id):
+    return {
+        "student_id": student_id, "firstname": "Bench", "lastname": "Mark",
+        "email": f"bench.{student_id}@ashesi.edu.gh"
+    }
+
+
+def open_app(latency):
+    """imports the API with its Firestore clients replaced by a fake database
+
+    Args:
+        latency (float): the number of seconds each request to the database waits
+
+    Returns:
+        tuple: the voting_system module and the database (FakeFirestore)
+    """
+
+    sys.path.insert(0, V3_FOLDER)
+    import fake_firestore
+    database = fake_firestore.install(latency)
+
+    import voting_system
+    return voting_system, database
+
+
+def send(app, entry_point, method, path, body=None):
+    """sends a request to one of the API's entry points
+
+    Args:
+        app (module): the voting_system module
+        entry_point (function): voting_system or voting_system_async
+        method (str): the HTTP method
+        path (str): the path, with its query string
+        body (object): the request's JSON body
+
+    Returns:
+        Response: the response
+    """
+
+    from flask import request
+
+    content_type = "application/json"
+    if isinstance(body, str):
+        data, content_type = body, "application/x-ndjson"
+    else:
+        data = None if body is None else json.dumps(body)
+    with app.voting_app.test_request_context(path, method=method, data=data, content_type=content_type):
+        return entry_point(request)
+
+
+def register_voters(app, student_ids):
+    # registers the voters in bulk (with the database's latency, set it to 0 first),
+    # the streamed response is read to run the registration
+    body = "".join(json.dumps(voter(voter_id)) + "\n" for voter_id in student_ids)
+    send(app, app.voting_system, "POST", "/voters/bulk_register/", body).get_data()
+
+
+def create_election(app, election_code):
+    send(app, app.voting_system, "POST", "/elections/", {
+        "election_code": election_code, "election_name": f"Benchmark {election_code}", "election_startdate": "2023-03-27",
+        "election_period": 72, "positions": [{"position_id": POSITION_ID, "position_name": "President", "candidates": CANDIDATE_IDS}]
+    })
+
+
+def time_requests(app, database, requests):
+    """sends requests one at a time and times each of them
+
+    Args:
+        app (module): the voting_system module
+        database (FakeFirestore): the database
+        requests (list): (entry point, method, path, body) of each request
+
+    Returns:
+        tuple: the seconds each request took, the database's stats (see FakeFirestore)
+        per request and the status codes
+    """
+
+    times, statuses = list(), set()
+    database.reset_stats()
+    for request in requests:
+        start = time.perf_counter()
+        response = send(app, *request)
+        response.get_data()
+        statuses.add(response.status_code)
+        times.append(time.perf_counter() - start)
+    return times, {kind: number / len(requests) for kind, number in database.stats.items()}, statuses
+
+
+def report(name, latency, times, stats, statuses):
+    mean = statistics.mean(times)
+    num_requests = stats["reads"] + stats["queries"] + stats["commits"]
+    round_trips = f"{mean / latency:.1f} round trips, " if latency else ""
+    status = f"  status {sorted(statuses)}" if statuses else ""
+    print(
+        f"{name:<24} mean {mean * 1000:7.2f} ms  p50 {statistics.median(times) * 1000:7.2f} ms  "
+        f"({round_trips}{num_requests:.1f} database requests, {stats['documents']:.1f} documents read){status}"
+    )
+
+
+def benchmark_async(args):
+    app, database = open_app(0)
+    voter_ids = [student_id(number) for number in range(2 * args.requests)]
+    register_voters(app, voter_ids + CANDIDATE_IDS)
+    for entry_point in ["sync", "async"]:
+        create_election(app, f"{ELECTION_CODE}_{entry_point}")
+    database.latency = args.latency
+    print(f"{args.requests} requests per test, {args.latency * 1000:.0f} ms per database request")
+
+    # each vote is cast by a different voter, so every vote is stored
+    entry_points = {"sync": app.voting_system, "async": app.voting_system_async}
+    for number, (name, entry_point) in enumerate(entry_points.items()):
+        election_code = f"{ELECTION_CODE}_{name}"
+        votes = [
+            (entry_point, "POST", f"/elections/vote/?position_id={POSITION_ID}",
+             {"election_code": election_code, "student_id": voter_id, "candidate_id": CANDIDATE_IDS[0]})
+            for voter_id in voter_ids[number::2]
+        ]
+        report(f"vote ({name})", args.latency, *time_requests(app, database, votes))
+
+    for name, entry_point in entry_points.items():
+        results = [(entry_point, "GET", f"/elections/results/?election_code={ELECTION_CODE}_{name}", None)] * args.requests
+        report(f"results ({name})", args.latency, *time_requests(app, database, results))
+
+
+def benchmark_reads(args):
+    app, database = open_app(args.latency)
+    import helper
+    print(f"{args.requests} requests per test, {args.latency * 1000:.0f} ms per database request")
+
+    # the voters and elections are added to the database directly, each size adds to the previous one
+    num_voters = 0
+    for size in sorted(int(size) for size in args.sizes.split(",")):
+        added = range(num_voters, size)
+        for number in added:
+            voter_id = student_id(number)
+            database.load(f"voters/{voter_id}", helper.voter_document(dict(voter(voter_id), is_registered=True)))
+            database.load(f"elections/{ELECTION_CODE}{number}", {
+                "election_code": f"{ELECTION_CODE}{number}", "election_name": f"Benchmark {number}",
+                "election_startdate": "2023-03-27", "election_period": 72, "positions": [{
+                    "position_id": POSITION_ID, "position_name": "President",
+                    "candidates": [{"candidate_id": candidate_id} for candidate_id in CANDIDATE_IDS]
+                }]
+            })
+        for candidate_id in CANDIDATE_IDS:
+            database.load(f"voters/{candidate_id}", helper.voter_document(dict(voter(candidate_id), is_registered=True)))
+        num_voters = size
+        print(f"{size} voters and elections:")
+
+        # every request reads a different voter or election (so none is served by the election cache),
+        # one added for this size, so that no earlier request voted or de-registered it
+        numbers = random.sample(added, min(args.requests, len(added)))
+        report("  retrieve election", args.latency, *time_requests(app, database, [
+            (app.voting_system, "GET", f"/elections/?election_code={ELECTION_CODE}{number}", None) for number in numbers
+        ]))
+        report("  vote", args.latency, *time_requests(app, database, [
+            (app.voting_system, "POST", f"/elections/vote/?position_id={POSITION_ID}", {
+                "election_code": f"{ELECTION_CODE}{number}", "student_id": student_id(number), "candidate_id": CANDIDATE_IDS[0]
+            }) for number in numbers
+        ]))
+        report("  de-register voter", args.latency, *time_requests(app, database, [
+            (app.voting_system, "PATCH", "/voters/", {"student_id": student_id(number)}) for number in numbers
+        ]))
+
+        # what each of these requests read before: every voter and every election
+        database.reset_stats()
+        start = time.perf_counter()
+        for collection in [helper.voters_collection(), helper.elections_collection()]:
+            list(collection.stream())
+        scan_time = time.perf_counter() - start
+        report("  scan (before)", args.latency, [scan_time], dict(database.stats), set())
+
+
+def load_voters(database, student_ids):
+    # adds registered voters to the database directly
+    import helper
+    for voter_id in student_ids:
+        database.load(f"voters/{voter_id}", helper.voter_document(dict(voter(voter_id), is_registered=True)))
+
+
+def benchmark_deregister(args):
+    app, database = open_app(args.latency)
+    import helper
+    print(f"{args.students} students in the 2024 year group, {args.other} other voters, "
+          f"{args.latency * 1000:.0f} ms per database request")
+
+    year_group = [student_id(number) for number in range(args.students)]
+    others = [student_id(20000 + number) for number in range(args.other)]
+    load_voters(database, year_group + others)
+
+    # the year group is queried and updated in batches (progress is logged after each batch)
+    report("batched updates", args.latency, *time_requests(app, database, [
+        (app.voting_system, "PATCH", "/voters/", {"year_group": "2024"})
+    ]))
+
+    # before: every voter was read, and each one in the year group was written back on its own
+    load_voters(database, year_group)
+    database.reset_stats()
+    start = time.perf_counter()
+    for snapshot in helper.voters_collection().stream():
+        voter_info = snapshot.to_dict()
+        if voter_info["year_group"] == "2024":
+            voter_info["is_registered"] = False
+            helper.voters_collection().document(snapshot.id).set(voter_info)
+    report("one write per student", args.latency, [time.perf_counter() - start], dict(database.stats), set())
+
+
+def cold_start(mode):
+    """imports the API in this (new) process and sends it a request rejected by validation,
+    printing the seconds until the import finished and until the response, as JSON
+
+    Args:
+        mode (str): "lazy" to import the API as it is, or "eager" to first import the
+        Firestore modules, as helper.py did at import before the client was created on first use
+    """
+
+    start = time.perf_counter()
+    sys.path.insert(0, V3_FOLDER)
+    if mode == "eager":
+        # (loading key.json and creating the client, which needs credentials, came on top of this)
+        for module in ["firebase_admin.credentials", "firebase_admin.firestore", "pytz"]:
+            importlib.import_module(module)
+    import voting_system
+    imported = time.perf_counter()
+
+    response = send(voting_system, voting_system.voting_system, "POST", f"/elections/vote/?position_id={POSITION_ID}", {
+        "election_code": ELECTION_CODE, "student_id": "invalid", "candidate_id": "invalid"
+    })
+    response.get_data()
+    print(json.dumps({
+        "import": imported - start, "response": time.perf_counter() - start, "status": response.status_code,
+        "firestore_loaded": "firebase_admin.firestore" in sys.modules
+    }))
+
+
+def benchmark_startup(args):
+    if args.mode is not None:
+        return cold_start(args.mode)
+
+    print(f"median of {args.runs} new processes per mode (the first response is a 400 from validation)")
+    for mode in ["lazy", "eager"]:
+        runs = list()
+        for _ in range(args.runs):
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "startup", "--mode", mode], capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                print(f"{mode:<6} failed (eager needs firebase-admin installed): {result.stderr.strip().splitlines()[-1]}")
+                break
+            runs.append(json.loads(result.stdout))
+        else:
+            print(
+                f"{mode:<6} import {statistics.median(run['import'] for run in runs) * 1000:7.1f} ms  "
+                f"first response {statistics.median(run['response'] for run in runs) * 1000:7.1f} ms  "
+                f"(status {runs[0]['status']}, Firestore modules loaded: {runs[0]['firestore_loaded']})"
+            )
+
+
+# the routes of v2 (whose handlers take the patterns' parameters), to match paths with parameters
+V2_ROUTES = [
+    ("/voters/register_voter/", ["POST"]), ("/voters/bulk_register/", ["POST"]),
+    ("/voters/de_register/<value>/", ["PATCH"]), ("/voters/update_voter/<student_id>/", ["PUT"]),
+    ("/voters/get/", ["GET"]), ("/elections/create_election/", ["POST"]),
+    ("/elections/get/<election_code>/", ["GET"]), ("/elections/cache_stats/", ["GET"]),
+    ("/elections/<election_code>/results/", ["GET"]), ("/elections/<election_code>/results/stream/", ["GET"]),
+    ("/elections/<election_code>/results/poll/", ["GET"]), ("/elections/delete_election/<election_code>/", ["DELETE"]),
+    ("/elections/vote/<election_code>/", ["POST"]),
+]
+
+
+def substring_route(method, path):
+    # how v3's voting_system chose a handler before the route table (returning its name)
+    if "voters" in path:
+        if method == "POST":
+            return "register_voter"
+        elif method == "PATCH":
+            return "deregister_voter"
+        elif method == "GET":
+            return "retrieve_voters"
+        elif method == "PUT":
+            return "update_voter"
+        else:
+            return None
+    elif "elections" in path:
+        if method == "POST" and "vote" in path:
+            return "vote"
+        elif method == "GET":
+            return "retrieve_election"
+        elif method == "DELETE":
+            return "delete_election"
+        elif method == "POST":
+            return "create_election"
+        else:
+            return None
+    else:
+        return None
+
+
+def benchmark_router(args):
+    app, database = open_app(0)
+    from router import Router
+
+    v2_routes = Router()
+    for pattern, methods in V2_ROUTES:
+        v2_routes.add(pattern, methods, lambda **arguments: None)
+
+    def time_call(function, *arguments):
+        return timeit.timeit(lambda: function(*arguments), number=args.number) / args.number * 1e9
+
+    print(f"mean of {args.number} calls per request")
+    for method, path in [
+        ("POST", "/voters/"), ("GET", "/elections/"), ("POST", "/elections/vote/"),
+        ("GET", "/elections/results/"), ("GET", "/elections/cache_stats/"), ("GET", "/unknown/path/")
+    ]:
+        handler, _ = app.routes.match(method, path)
+        print(
+            f"v3 {method:<6} {path:<40} route table {time_call(app.routes.match, method, path):6.0f} ns  "
+            f"substring tests (before) {time_call(substring_route, method, path):6.0f} ns  "
+            f"-> {getattr(handler, '__name__', None)}"
+        )
+
+    # (GET /elections/vote/results/ backtracks from the fixed segment vote to the election_code parameter)
+    for method, path in [
+        ("POST", "/voters/register_voter/"), ("PATCH", "/voters/de_register/2024/"), ("GET", "/elections/get/ELECTION/"),
+        ("GET", "/elections/ELECTION/results/"), ("GET", "/elections/vote/results/"), ("GET", "/unknown/path/")
+    ]:
+        _, arguments = v2_routes.match(method, path)
+        print(f"v2 {method:<6} {path:<40} route table {time_call(v2_routes.match, method, path):6.0f} ns  -> {arguments}")
+
+    # a whole request through the entry point, rejected by the handler before reading any data
+    send_time = timeit.timeit(lambda: send(app, app.voting_system, "POST", "/voters/"), number=1000) / 1000
+    print(f"a request to voting_system, for scale: {send_time * 1e6:.0f} us")
+
+
+# the validation helpers the schemas replaced (without their uniqueness checks, which read
+# the database), returning their first error message or None
+FIRST_YEAR_GROUP = 2002
+
+
+def old_valid_keys(voter_info, expected_keys):
+    result = {"is_valid": False}            # result from validation
+    result_message = []                     # message from validation
+    num_correct_keys = 0                    # variable to keep track of the number of matching keys
+    data_keys = voter_info.keys()
+
+    for key in expected_keys:
+        if key in data_keys:
+            num_correct_keys += 1
+        else:
+            result_message.append(f"{key.capitalize()} is required")
+
+    if num_correct_keys == len(expected_keys):
+        result["is_valid"] = True
+    else:
+        result["message"] = result_message
+
+    return result
+
+
+def old_valid_student_id(student_id):
+    if(len(student_id)) != 8:
+        return False
+    if not student_id.isnumeric():
+        return False
+    return {"user_id": student_id[:4], "year_group": student_id[4:]}
+
+
+def old_voter_error(voter_info):
+    validate_data = old_valid_keys(voter_info, ["student_id", "firstname", "lastname", "email"])
+    if validate_data["is_valid"] == False:
+        return validate_data["message"]
+
+    student_id_is_valid = old_valid_student_id(voter_info["student_id"])
+    if not student_id_is_valid:
+        return {"message": "Student ID is not valid."}
+    elif int(student_id_is_valid["year_group"]) < FIRST_YEAR_GROUP:
+        return {"message": "Student year group is invalid."}
+
+    if not voter_info["email"].endswith("@ashesi.edu.gh"):
+        return {"message": "Email must be a valid Ashesi email address."}
+
+    if not str(voter_info["firstname"]).isalpha() or not str(voter_info["lastname"]).isalpha():
+        return {"message": "Firstname or Lastname must be a string."}
+    return None
+
+
+def old_election_error(election_info):
+    # (positions and candidates were not validated)
+    validate_data = old_valid_keys(election_info, [
+        "election_code", "election_name", "election_startdate", "election_period", "positions"
+    ])
+    if validate_data["is_valid"] == False:
+        return validate_data["message"]
+    return None
+
+
+def old_vote_error(vote_info):
+    validate_data = old_valid_keys(vote_info, ["election_code", "student_id", "candidate_id"])
+    if validate_data["is_valid"] == False:
+        return validate_data["message"]
+    if not old_valid_student_id(vote_info["student_id"]):
+        return {"message": "Student ID is not valid."}
+    if not old_valid_student_id(vote_info["candidate_id"]):
+        return {"message": "Candidate ID is not valid."}
+    return None
+
+
+def benchmark_schema(args):
+    open_app(0)
+    import helper
+
+    election = {
+        "election_code": ELECTION_CODE, "election_name": "Benchmark", "election_startdate": "2023-03-27", "election_period": 72,
+        "positions": [
+            {"position_id": f"{number:03d}", "position_name": f"Position {number}", "candidates": CANDIDATE_IDS + [student_id(number)]}
+            for number in range(args.positions)
+        ]
+    }
+    payloads = [
+        ("valid voter", helper.VOTER_SCHEMA, old_voter_error, voter("12342024")),
+        ("invalid voter", helper.VOTER_SCHEMA, old_voter_error, {"student_id": "12342024", "firstname": "Bench", "email": "bench@gmail.com"}),
+        (f"election ({args.positions} positions)", helper.ELECTION_SCHEMA, old_election_error, election),
+        ("vote", helper.VOTE_SCHEMA, old_vote_error, {"election_code": ELECTION_CODE, "student_id": "12342024", "candidate_id": CANDIDATE_IDS[0]}),
+    ]
+
+    print(f"mean of {args.number} validations per payload")
+    for name, schema, old_error, payload in payloads:
+        schema_time = timeit.timeit(lambda: schema.errors(payload), number=args.number) / args.number
+        old_time = timeit.timeit(lambda: old_error(payload), number=args.number) / args.number
+        print(
+            f"{name:<26} schema {schema_time * 1e6:6.2f} us ({len(schema.errors(payload))} errors)  "
+            f"helpers (before) {old_time * 1e6:6.2f} us ({'valid' if old_error(payload) is None else 'first error only'})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks of v3 against an in-memory Firestore")
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_async = benchmarks.add_parser("async", help="synchronous vs asyncio entry point")
+    parser_async.add_argument("--latency", type=float, default=0.02, help="seconds per database request")
+    parser_async.add_argument("--requests", type=int, default=50, help="number of requests per test")
+    parser_async.set_defaults(run=benchmark_async)
+
+    parser_reads = benchmarks.add_parser("reads", help="point reads as the collections grow")
+    parser_reads.add_argument("--sizes", default="100,1000,10000", help="comma separated numbers of voters and elections")
+    parser_reads.add_argument("--latency", type=float, default=0.0, help="seconds per database request")
+    parser_reads.add_argument("--requests", type=int, default=50, help="number of requests per test")
+    parser_reads.set_defaults(run=benchmark_reads)
+
+    parser_deregister = benchmarks.add_parser("deregister", help="de-registration of a year group")
+    parser_deregister.add_argument("--students", type=int, default=2000, help="number of students in the year group")
+    parser_deregister.add_argument("--other", type=int, default=2000, help="number of voters in other year groups")
+    parser_deregister.add_argument("--latency", type=float, default=0.005, help="seconds per database request")
+    parser_deregister.set_defaults(run=benchmark_deregister)
+
+    parser_startup = benchmarks.add_parser("startup", help="import to first response")
+    parser_startup.add_argument("--runs", type=int, default=5, help="number of processes started per mode")
+    parser_startup.add_argument("--mode", choices=["lazy", "eager"], help=argparse.SUPPRESS)
+    parser_startup.set_defaults(run=benchmark_startup)
+
+    parser_router = benchmarks.add_parser("router", help="request dispatch")
+    parser_router.add_argument("--number", type=int, default=100000, help="number of calls timed per request")
+    parser_router.set_defaults(run=benchmark_router)
+
+    parser_schema = benchmarks.add_parser("schema", help="payload validation")
+    parser_schema.add_argument("--number", type=int, default=20000, help="number of validations timed per payload")
+    parser_schema.add_argument("--positions", type=int, default=5, help="number of positions of the validated election")
+    parser_schema.set_defaults(run=benchmark_schema)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+"""an in-memory stand-in for the parts of the Firestore clients (synchronous and asyncio)
+that the API uses, for benchmarks run without a Firestore project or emulator (see
+benchmark.py). install() replaces the firebase_admin modules, so helper.py's clients
+are created by the fake the first time they are needed. Every request to the database
+(a read, a query, a batched read or a commit) waits for the given latency, like a round
+trip to Firestore, and is counted in the client's stats along with the number of documents
+it returned (which Firestore bills as reads).
+
+    import fake_firestore
+    database = fake_firestore.install(latency=0.02)
+    import voting_system
+"""
+
+import sys
+import time
+import types
+import asyncio
+import threading
+import itertools
+from datetime import datetime, timedelta, timezone
+
+
+# the maximum number of writes in a batch or transaction
+MAX_WRITES = 500
+
+
+class Increment:
+    """a numeric field transform adding value to the field's current value (see firestore.Increment)"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Conflict(Exception):
+    """raised when a document that already exists is created"""
+
+
+class NotFound(Exception):
+    """raised when a document that does not exist is updated"""
+
+
+def _apply(data, changes):
+    # applies field values and transforms to a copy of a document's data
+    data = dict(data or dict())
+    for field, value in changes.items():
+        if isinstance(value, Increment):
+            data[field] = data.get(field, 0) + value.value
+        else:
+            data[field] = value
+    return data
+
+
+class FakeFirestore:
+    """an in-memory database with a synchronous client interface (collection, batch,
+    transaction and get_all), shared with its asyncio client (see async_client)
+
+    Args:
+        latency (float): the number of seconds each request to the database waits
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.stats = {"reads": 0, "queries": 0, "commits": 0, "documents": 0}
+        self._documents = dict()        # document path -> (data, create_time, update_time)
+        self._collections = dict()      # collection path -> ids of its documents
+        self._time = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        self._transaction_lock = threading.Lock()
+
+    def _request(self, kind, num_documents=0):
+        with self.lock:
+            self.stats[kind] += 1
+            self.stats["documents"] += num_documents
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _now(self):
+        # (with the lock held) every commit gets a later time
+        self._time += timedelta(microseconds=1)
+        return self._time
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def collection(self, path):
+        return CollectionReference(self, path)
+
+    def document(self, path):
+        collection, document_id = path.rsplit("/", 1)
+        return DocumentReference(self, collection, document_id)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def get_all(self, references, field_paths=None):
+        references = list(references)
+        self._request("reads", len(references))
+        return [self._snapshot(reference) for reference in references]
+
+    def async_client(self):
+        """returns an asyncio client (see firestore_async.client) reading this database"""
+
+        return AsyncFakeFirestore(self)
+
+    def load(self, path, data):
+        """writes a document without waiting or counting a commit, to set up a benchmark
+
+        Args:
+            path (str): the document's path, e.g. voters/12342024
+            data (dict): the document's data
+        """
+
+        with self.lock:
+            now = self._now()
+            self._store(path, (dict(data), now, now))
+
+    def _snapshot(self, reference):
+        with self.lock:
+            data, create_time, update_time = self._documents.get(reference.path, (None, None, None))
+        return DocumentSnapshot(reference, data, create_time, update_time)
+
+    def _store(self, path, document):
+        # (with the lock held) stores or deletes (document is None) a document
+        collection, document_id = path.rsplit("/", 1)
+        if document is None:
+            self._documents.pop(path, None)
+            self._collections.get(collection, set()).discard(document_id)
+        else:
+            self._documents[path] = document
+            self._collections.setdefault(collection, set()).add(document_id)
+
+    def _children(self, collection_path):
+        # the snapshots of the documents directly in a collection, ordered by id
+        with self.lock:
+            document_ids = sorted(self._collections.get(collection_path, ()))
+            return [self._snapshot(self.document(f"{collection_path}/{document_id}")) for document_id in document_ids]
+
+    def _commit(self, writes):
+        # applies the writes of a batch or transaction together
+        if len(writes) > MAX_WRITES:
+            raise ValueError(f"a commit holds at most {MAX_WRITES} writes")
+        self._request("commits")
+        with self.lock:
+            for operation, reference, data, merge in writes:
+                if operation == "create" and reference.path in self._documents:
+                    raise Conflict(reference.path)
+                if operation == "update" and reference.path not in self._documents:
+                    raise NotFound(reference.path)
+
+            now = self._now()
+            for operation, reference, data, merge in writes:
+                current, create_time, _ = self._documents.get(reference.path, (None, now, None))
+                if operation == "delete":
+                    self._store(reference.path, None)
+                elif operation == "update" or merge:
+                    self._store(reference.path, (_apply(current, data), create_time, now))
+                else:
+                    self._store(reference.path, (_apply(None, data), create_time, now))
+
+
+class DocumentSnapshot:
+    """a document's data as it was read"""
+
+    def __init__(self, reference, data, create_time=None, update_time=None, field_paths=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+        if data is not None and field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        self._data = data
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        return dict(self._data)
+
+    def get(self, field):
+        return self._data[field]
+
+
+class DocumentReference:
+    """a document, whose get, set, create, update and delete are each one request"""
+
+    def __init__(self, database, collection_path, document_id):
+        self._database = database
+        self.id = document_id
+        self.path = f"{collection_path}/{document_id}"
+
+    @property
+    def parent(self):
+        return CollectionReference(self._database, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name):
+        return CollectionReference(self._database, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        self._database._request("reads", 1)
+        snapshot = self._database._snapshot(self)
+        if field_paths is None:
+            return snapshot
+        return DocumentSnapshot(self, snapshot._data, snapshot.create_time, snapshot.update_time, field_paths)
+
+    def set(self, data, merge=False):
+        self._database._commit([("set", self, data, merge)])
+
+    def create(self, data):
+        self._database._commit([("create", self, data, False)])
+
+    def update(self, data):
+        self._database._commit([("update", self, data, True)])
+
+    def delete(self):
+        self._database._commit([("delete", self, None, False)])
+
+
+class Query:
+    """a query of a collection, which is copied by each method that refines it"""
+
+    OPERATORS = {
+        "==": lambda field, value: field == value,
+        "!=": lambda field, value: field != value,
+        "<": lambda field, value: field < value,
+        "<=": lambda field, value: field <= value,
+        ">": lambda field, value: field > value,
+        ">=": lambda field, value: field >= value,
+        "in": lambda field, value: field in value,
+        "array_contains": lambda field, value: value in field,
+    }
+
+    def __init__(self, database, path, filters=(), order=None, start_after=None, count=None, fields=None):
+        self._database = database
+        self._path = path
+        self._filters = filters
+        self._order = order
+        self._start_after = start_after
+        self._count = count
+        self._fields = fields
+
+    def _copy(self, **changes):
+        arguments = dict(
+            filters=self._filters, order=self._order, start_after=self._start_after,
+            count=self._count, fields=self._fields
+        )
+        arguments.update(changes)
+        return Query(self._database, self._path, **arguments)
+
+    def where(self, field, operator, value):
+        return self._copy(filters=self._filters + ((field, self.OPERATORS[operator], value),))
+
+    def order_by(self, field):
+        return self._copy(order=field)
+
+    def start_after(self, values):
+        if isinstance(values, DocumentSnapshot):
+            values = values.to_dict()
+        return self._copy(start_after=values)
+
+    def limit(self, count):
+        return self._copy(count=count)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def _results(self):
+        snapshots = [
+            snapshot for snapshot in self._database._children(self._path)
+            if all(field in snapshot._data and test(snapshot._data[field], value) for field, test, value in self._filters)
+        ]
+        if self._order is not None:
+            snapshots = [snapshot for snapshot in snapshots if self._order in snapshot._data]
+            snapshots.sort(key=lambda snapshot: snapshot._data[self._order])
+            if self._start_after is not None:
+                start = self._start_after[self._order]
+                snapshots = [snapshot for snapshot in snapshots if snapshot._data[self._order] > start]
+        if self._count is not None:
+            snapshots = snapshots[:self._count]
+        if self._fields is not None:
+            snapshots = [
+                DocumentSnapshot(snapshot.reference, snapshot._data, snapshot.create_time, snapshot.update_time, self._fields)
+                for snapshot in snapshots
+            ]
+        return snapshots
+
+    def stream(self, transaction=None):
+        results = self._results()
+        self._database._request("queries", len(results))
+        return iter(results)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction))
+
+
+class CollectionReference(Query):
+    """a collection, which is also the query of all its documents"""
+
+    def __init__(self, database, path):
+        super().__init__(database, path)
+        self.id = path.rsplit("/", 1)[-1]
+        self.path = path
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = f"{next(_auto_ids):020d}"
+        return DocumentReference(self._database, self.path, document_id)
+
+    def list_documents(self):
+        references = [snapshot.reference for snapshot in self._database._children(self.path)]
+        self._database._request("queries", len(references))
+        return references
+
+
+_auto_ids = itertools.count(1)
+
+
+class WriteBatch:
+    """writes queued by set, create, update and delete, applied together by commit"""
+
+    def __init__(self, database):
+        self._database = database
+        self._writes = list()
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference, data, merge))
+
+    def create(self, reference, data):
+        self._writes.append(("create", reference, data, False))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference, data, True))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, list()
+        self._database._commit(writes)
+
+
+class Transaction(WriteBatch):
+    """a WriteBatch whose function (see transactional) runs while no other transaction
+    of the database runs, so that the documents it reads cannot change before it commits"""
+
+
+def transactional(function):
+    """runs a function with a transaction and commits the transaction's writes,
+    like firestore.transactional (which retries the function on contention instead)
+
+    Args:
+        function (function): called with the transaction and the wrapper's arguments
+
+    Returns:
+        function: the wrapper
+    """
+
+    def run(transaction, *args, **kwargs):
+        with transaction._database._transaction_lock:
+            result = function(transaction, *args, **kwargs)
+            transaction.commit()
+        return result
+    return run
+
+
+class AsyncFakeFirestore:
+    """the asyncio client of a FakeFirestore, whose requests wait without blocking the event loop
+
+    Args:
+        database (FakeFirestore): the database read by the client
+    """
+
+    def __init__(self, database):
+        self._database = database
+
+    def collection(self, path):
+        return AsyncCollectionReference(self._database, path)
+
+    async def get_all(self, references, field_paths=None):
+        references = list(references)
+        await _wait(self._database, "reads", len(references))
+        for reference in references:
+            yield self._database._snapshot(reference)
+
+
+async def _wait(database, kind, num_documents=0):
+    with database.lock:
+        database.stats[kind] += 1
+        database.stats["documents"] += num_documents
+    if database.latency:
+        await asyncio.sleep(database.latency)
+
+
+class AsyncDocumentReference(DocumentReference):
+    """a document of the asyncio client, which only reads asynchronously"""
+
+    def collection(self, name):
+        return AsyncCollectionReference(self._database, f"{self.path}/{name}")
+
+    async def get(self, field_paths=None, transaction=None):
+        await _wait(self._database, "reads", 1)
+        snapshot = self._database._snapshot(self)
+        if field_paths is None:
+            return snapshot
+        return DocumentSnapshot(self, snapshot._data, snapshot.create_time, snapshot.update_time, field_paths)
+
+
+class AsyncCollectionReference(CollectionReference):
+    """a collection of the asyncio client, which only streams asynchronously"""
+
+    def document(self, document_id=None):
+        reference = super().document(document_id)
+        return AsyncDocumentReference(self._database, self.path, reference.id)
+
+    async def stream(self, transaction=None):
+        results = self._results()
+        await _wait(self._database, "queries", len(results))
+        for snapshot in results:
+            yield snapshot
+
+
+def install(latency=0.0):
+    """replaces the firebase_admin modules with modules whose clients read a new FakeFirestore
+
+    Args:
+        latency (float): the number of seconds each request to the database waits
+
+    Returns:
+        FakeFirestore: the database
+    """
+
+    database = FakeFirestore(latency)
+
+    firebase_admin = types.ModuleType("firebase_admin")
+    firebase_admin.initialize_app = lambda credential=None, options=None: None
+    credentials = types.ModuleType("firebase_admin.credentials")
+    credentials.Certificate = lambda path: path
+    firestore = types.ModuleType("firebase_admin.firestore")
+    firestore.client = lambda: database
+    firestore.Increment = Increment
+    firestore.transactional = transactional
+    firestore_async = types.ModuleType("firebase_admin.firestore_async")
+    firestore_async.client = database.async_client
+    firebase_admin.credentials = credentials
+    firebase_admin.firestore = firestore
+    firebase_admin.firestore_async = firestore_async
+
+    sys.modules.update({
+        "firebase_admin": firebase_admin, "firebase_admin.credentials": credentials,
+        "firebase_admin.firestore": firestore, "firebase_admin.firestore_async": firestore_async,
+    })
+    return database
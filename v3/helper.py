@@ -1,21 +1,418 @@
+import io
+import os
+import asyncio
+import csv
 import json
+import hashlib
+import itertools
+import time
+import logging
+import random
+import threading
 from decimal import Decimal
-from datetime import timedelta
-from pytz import timezone
-from flask import jsonify
-from firebase_admin import credentials, firestore, initialize_app
+from datetime import datetime, timedelta
+from flask import Response, current_app, jsonify, g, has_request_context, stream_with_context
 
+from cache import ReadThroughCache
+from registry import VoterRegistry
+from schema import Field, Schema
 
-# Initialising Firestore db
-cred = credentials.Certificate("key.json")
-default_app = initialize_app(cred)
-database = firestore.client()
+# request bodies are decoded with orjson if it is installed
+try:
+    from orjson import loads as decode_json
+except ImportError:
+    from json import loads as decode_json
+
+
+# the firebase app and the Firestore clients are created on first use (see get_database), so
+# that a cold start only pays for importing firebase_admin and loading key.json when a
+# request reads or writes data (and not, e.g., when its validation fails)
+_app = None
+_database = None
+_async_database = None
+_database_lock = threading.Lock()
+
+
+def _initialize_app():
+    # (with _database_lock held)
+    global _app
+    if _app is None:
+        from firebase_admin import credentials, initialize_app
+        _app = initialize_app(credentials.Certificate("key.json"))
+
+
+def get_database():
+    """returns the Firestore client, initialising the firebase app with the credentials
+    in key.json the first time a client is needed
+
+    Returns:
+        Client: the Firestore client
+    """
+    
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                from firebase_admin import firestore
+                _initialize_app()
+                _database = firestore.client()
+    return _database
+
+
+def get_async_database():
+    """returns the asynchronous Firestore client used by the asyncio router
+    (see voting_system_async in voting_system), created like get_database's client
+
+    Returns:
+        AsyncClient: the asynchronous Firestore client
+    """
+    
+    global _async_database
+    if _async_database is None:
+        with _database_lock:
+            if _async_database is None:
+                from firebase_admin import firestore_async
+                _initialize_app()
+                _async_database = firestore_async.client()
+    return _async_database
+
+
+# progress of long writes (e.g. de-registering a year group) is logged to stderr, which the
+# server or Cloud Functions keeps, at VOTING_LOG_LEVEL (INFO by default) unless the app
+# configured the logger itself
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(os.environ.get("VOTING_LOG_LEVEL", "INFO"))
+    logger.propagate = False
 
 # the first year group for Ashesi University
 FIRST_YEAR_GROUP = 2002
 
-VOTERS_COLLECTION = database.collection("voters")
-ELECTIONS_COLLECTION = database.collection("elections")
+# keys expected in a voter's information
+VOTERS_KEYS = [
+        "student_id", "firstname", "lastname", "email"
+    ]
+
+# the attributes of a voter that can be selected with the fields argument of retrieve_voters
+VOTER_FIELDS = VOTERS_KEYS + ["is_registered"]
+
+# the largest number of voters returned in one page of retrieve_voters
+MAX_PAGE_SIZE = 1000
+
+# lowercased copies of the fields retrieve_voters filters by prefix, stored with
+# every voter document so that the filters can run as Firestore range queries
+SEARCH_FIELDS = {
+        "firstname": "firstname_lower", "lastname": "lastname_lower", 
+        "email": "email_lower"
+    }
+
+# number of times a vote transaction is retried (with backoff) after Firestore gives
+# up on it because of contention, each try already includes Firestore's own attempts
+VOTE_RETRIES = 5
+
+# Firestore allows at most 500 writes in a batch
+MAX_BATCH_SIZE = 500
+
+# Firestore sustains about one write per second to a document, so each position's vote
+# counts are split over TALLY_SHARDS documents and every vote increments a random one
+TALLY_SHARDS = int(os.environ.get("VOTING_TALLY_SHARDS", "10"))
+
+# the voters version is split over VERSION_SHARDS documents and every batch of voter writes increments a random one
+VERSION_SHARDS = int(os.environ.get("VOTING_VERSION_SHARDS", "10"))
+
+# elections read by retrieve_election are cached for VOTING_ELECTION_CACHE_TTL seconds
+# (at most VOTING_ELECTION_CACHE_SIZE elections), and dropped when they are changed
+ELECTION_CACHE_SIZE = int(os.environ.get("VOTING_ELECTION_CACHE_SIZE", "128"))
+ELECTION_CACHE_TTL = float(os.environ.get("VOTING_ELECTION_CACHE_TTL", "5"))
+
+# fields derived from a voter's information when it is stored
+DERIVED_VOTER_FIELDS = ["year_group"] + list(SEARCH_FIELDS.values())
+
+
+def voters_collection():
+    """returns the collection holding the voters, one document per student id"""
+    
+    return get_database().collection("voters")
+
+
+def elections_collection():
+    """returns the collection holding the elections, one document per election code"""
+    
+    return get_database().collection("elections")
+
+
+def async_voters_collection():
+    """returns the voters collection of the asynchronous client"""
+    
+    return get_async_database().collection("voters")
+
+
+def async_elections_collection():
+    """returns the elections collection of the asynchronous client"""
+    
+    return get_async_database().collection("elections")
+
+
+def voters_version_collection():
+    """returns the subcollection holding the voters version, VERSION_SHARDS counters (one
+    document each) incremented in the same batches as the writes to the voters collection
+    and summed by voters_version, from which the ETags of voter lists are derived"""
+    
+    return get_database().collection("metadata").document("voters").collection("shards")
+
+
+def get_document(collection, document_id):
+    """reads a single document by its id
+
+    Args:
+        collection (CollectionReference): the collection containing the document
+        document_id (str): the document's id (student_id or election_code)
+
+    Returns:
+        dict: the document's data or None if it does not exist
+    """
+    
+    snapshot = collection.document(document_id).get()
+    if not snapshot.exists:
+        return None
+    return snapshot.to_dict()
+
+
+def get_documents(collection, document_ids):
+    """reads several documents by their ids in one batched request
+
+    Args:
+        collection (CollectionReference): the collection containing the documents
+        document_ids (list): the documents' ids
+
+    Returns:
+        dict: the data of the documents that exist, keyed by document id
+    """
+    
+    references = [collection.document(document_id) for document_id in set(document_ids)]
+    return {
+        snapshot.id: snapshot.to_dict() 
+        for snapshot in get_database().get_all(references) if snapshot.exists
+    }
+
+
+async def get_document_async(collection, document_id):
+    """reads a single document by its id with the asynchronous client (see get_document)
+
+    Args:
+        collection (AsyncCollectionReference): the collection containing the document
+        document_id (str): the document's id (student_id or election_code)
+
+    Returns:
+        dict: the document's data or None if it does not exist
+    """
+    
+    snapshot = await collection.document(document_id).get()
+    if not snapshot.exists:
+        return None
+    return snapshot.to_dict()
+
+
+# the event loop running the asyncio router's coroutines, started on first use
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def event_loop():
+    """returns the event loop shared by all the requests of the instance, running in a
+    background thread (the asynchronous client's channel is bound to the loop it is first used on)
+
+    Returns:
+        AbstractEventLoop: the running event loop
+    """
+    
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, daemon=True).start()
+        return _event_loop
+
+
+def run_async(coroutine):
+    """runs a coroutine on the shared event loop (see event_loop) and waits for its result.
+    The coroutine runs in a copy of the caller's context, so it can use the current
+    request (e.g. jsonify and count_writes)
+
+    Args:
+        coroutine (coroutine): the coroutine to run
+
+    Returns:
+        object: the coroutine's result
+    """
+    
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop()).result()
+
+
+def count_writes(num_writes=1):
+    """records write requests sent to Firestore while handling the current request,
+    which are reported in the X-Write-Count response header (see add_write_count)
+
+    Args:
+        num_writes (int): the number of write requests (a batch or transaction commit counts as one)
+    """
+    
+    if has_request_context():
+        g.write_count = g.get("write_count", 0) + num_writes
+
+
+def write_count():
+    """returns the number of write requests sent to Firestore so far while handling the
+    current request, e.g. for the last line of a streamed response (see add_write_count)
+
+    Returns:
+        int: the number of writes
+    """
+    
+    return g.get("write_count", 0)
+
+
+def add_write_count(response):
+    """sets the X-Write-Count header of a response to the number of write
+    requests sent to Firestore while handling the request. Streamed responses (e.g. of
+    bulk_register) write while they are sent, after their headers, so they report
+    their writes in their body instead (see write_count)
+
+    Args:
+        response (Response): the response being returned
+
+    Returns:
+        Response: the response
+    """
+    
+    if response.is_streamed:
+        return response
+    
+    response.headers["X-Write-Count"] = str(write_count())
+    return response
+
+
+def make_etag(*parts):
+    """derives an ETag from the given parts (e.g. version counters and request arguments)
+
+    Returns:
+        str: the ETag (unquoted)
+    """
+    
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def not_modified(request, etag):
+    """returns a 304 response if the client already has the representation with the
+    given ETag (sent in the If-None-Match header), so the response body is not built
+
+    Args:
+        request (Request): the request being handled
+        etag (str): the ETag of the current representation
+
+    Returns:
+        Response: a 304 response or None if the client's representation is outdated
+    """
+    
+    if not request.if_none_match.contains(etag):
+        return None
+    
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def with_etag(response, etag):
+    """sets the ETag header of a response
+
+    Args:
+        response (Response): the response being returned
+        etag (str): the ETag of the response's representation
+
+    Returns:
+        Response: the response
+    """
+    
+    response.set_etag(etag)
+    return response
+
+
+def set_document(collection, document_id, data):
+    """writes a single document
+
+    Args:
+        collection (CollectionReference): the collection containing the document
+        document_id (str): the document's id
+        data (dict): the document's data
+    """
+    
+    collection.document(document_id).set(data)
+    count_writes()
+
+
+def delete_document(collection, document_id):
+    """deletes a single document
+
+    Args:
+        collection (CollectionReference): the collection containing the document
+        document_id (str): the document's id
+    """
+    
+    collection.document(document_id).delete()
+    count_writes()
+
+
+def batch_write(operations, on_commit=None, each_batch=None):
+    """applies write operations in WriteBatches of at most MAX_BATCH_SIZE writes
+
+    Args:
+        operations (iterable): tuples of a WriteBatch method name ("set", "update" or "delete"),
+        the DocumentReference it applies to and the method's other arguments
+        on_commit (function): called with the number of operations applied so far
+        after each batch is committed
+        each_batch (function): returns an operation added to every batch, which is
+        committed with the batch's operations but not counted (see write_voters)
+
+    Returns:
+        int: the number of applied operations
+    """
+    
+    batch = get_database().batch()
+    batch_size = MAX_BATCH_SIZE if each_batch is None else MAX_BATCH_SIZE - 1
+    num_pending = 0
+    num_written = 0
+    
+    def add(method, reference, *args):
+        getattr(batch, method)(reference, *args)
+    
+    for operation in operations:
+        add(*operation)
+        num_pending += 1
+        
+        if num_pending == batch_size:
+            if each_batch is not None:
+                add(*each_batch())
+            batch.commit()
+            count_writes()
+            num_written += num_pending
+            batch = get_database().batch()
+            num_pending = 0
+            if on_commit is not None:
+                on_commit(num_written)
+    
+    if num_pending:
+        if each_batch is not None:
+            add(*each_batch())
+        batch.commit()
+        count_writes()
+        num_written += num_pending
+        if on_commit is not None:
+            on_commit(num_written)
+    
+    return num_written
 
 
 def valid_request_body(request):
@@ -33,33 +430,23 @@ def valid_request_body(request):
     return True
 
 
-def valid_keys(voter_info, expected_keys):
-    """validates a voter's information and returns result
+def request_json(request):
+    """returns the request's JSON body, decoded once per request (with orjson if it is
+    installed) and reused by every handler and helper that reads it
 
     Args:
-        voter_info (dict): JSON representation of a voter's information
+        request (Request): the request being sent to the API
 
     Returns:
-        dict: a dictionary of boolean and or list of messages from validation
+        the decoded JSON body (e.g. dict)
     """
-    
-    result = {"is_valid": False}            # result from validation
-    result_message = []                     # message from validation
-    num_correct_keys = 0                    # variable to keep track of the number of matching keys
-    data_keys = voter_info.keys()
-    
-    for key in expected_keys:
-        if key in data_keys:
-            num_correct_keys += 1
-        else:
-            result_message.append(f"{key.capitalize()} is required")
-    
-    if num_correct_keys == len(expected_keys):
-        result["is_valid"] = True
-    else:
-        result["message"] = result_message
-    
-    return result
+
+    if not has_request_context():
+        return decode_json(request.data)
+
+    if "request_json" not in g:
+        g.request_json = decode_json(request.data)
+    return g.request_json
 
 
 def key_is_unique(key_list, dictionary_list, voter_info):
@@ -77,16 +464,41 @@ def key_is_unique(key_list, dictionary_list, voter_info):
     
     result = dict()
     for key in key_list:
-        for voter in dictionary_list:        
-            if voter_info[key] == voter[key] and voter["student_id"] != voter_info["student_id"]:
-                result[key] = key + " already exists!"
+        key_values = [record[key] for record in dictionary_list]
+        
+        if voter_info[key] in key_values:
+            result[key] = key + " already exists!"
+    
+    return result
+
+
+def voter_key_is_unique(key_list, registry, voter_info):
+    """ensures that all values corresponding to unique keys in the provided 
+    voter information are not used by any other voter in the registry.
+    When student_id is not one of the unique keys (i.e. an update), the voter's
+    own record is not treated as a conflict
+
+    Args:
+        key_list (list): list of unique keys (student_id and or email)
+        registry (VoterRegistry): the registry of existing voters
+        voter_info (dict): a dictionary containing voter information
+
+    Returns:
+        result: a dictionary containing the result from unique test
+    """
+    
+    result = dict()
+    student_id = None if "student_id" in key_list else voter_info["student_id"]
+    for key in key_list:
+        if not registry.is_unique(key, voter_info[key], student_id):
+            result[key] = key + " already exists!"
     
     return result
 
 
 def valid_student_id(student_id):
     """ensures that a given student_id is valid
-    - a student ID is valid if it's eight characters long and numeric
+    - a student ID is valid if it's eight characters long and made of the digits 0-9
 
     Args:
         student_id (str): a student's ID
@@ -100,8 +512,9 @@ def valid_student_id(student_id):
     if(len(student_id)) != 8:
         return False
     
-    # ensure that the student id is numeric
-    if not student_id.isnumeric():
+    # ensure that the student id is made of decimal digits (isnumeric also accepts
+    # characters like ½ that int cannot parse)
+    if not (student_id.isascii() and student_id.isdigit()):
         return False
     
     user_id = student_id[:4]
@@ -110,6 +523,117 @@ def valid_student_id(student_id):
     return {"user_id": user_id, "year_group": year_group} 
 
 
+def is_iso_date(value):
+    # election start dates are ISO dates, with or without a time (e.g. 2023-03-27 13:57:30)
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+# schemas of the request data, compiled once when the API starts (see schema.py)
+VOTER_SCHEMA = Schema({
+        "student_id": Field(str, checks=[
+            (valid_student_id, "Student ID is not valid."),
+            # only reached for valid student ids, whose year group int can parse
+            (lambda student_id: int(student_id[4:]) >= FIRST_YEAR_GROUP, "Student year group is invalid.")
+        ]),
+        "firstname": Field(str, checks=[(str.isalpha, "{label} must only contain letters.")]),
+        "lastname": Field(str, checks=[(str.isalpha, "{label} must only contain letters.")]),
+        "email": Field(str, checks=[
+            (lambda email: email.endswith("@ashesi.edu.gh"), "Email must be a valid Ashesi email address.")
+        ])
+    })
+
+POSITION_SCHEMA = Schema({
+        "position_id": Field(str, checks=[(bool, "{label} must not be empty.")]),
+        "position_name": Field(str, checks=[(bool, "{label} must not be empty.")]),
+        "candidates": Field(
+            list, items=Field(str, checks=[(valid_student_id, "{label} is not a valid student ID.")]),
+            item_label="Candidate", min_items=1, unique=True
+        )
+    })
+
+ELECTION_SCHEMA = Schema({
+        "election_code": Field(str, checks=[(bool, "{label} must not be empty.")]),
+        "election_name": Field(str, checks=[(bool, "{label} must not be empty.")]),
+        "election_startdate": Field(str, checks=[(is_iso_date, "{label} must be a date (e.g. 2023-03-27).")]),
+        "election_period": Field((int, float), checks=[(lambda hours: hours > 0, "{label} must be a positive number of hours.")]),
+        "positions": Field(list, items=POSITION_SCHEMA, item_label="Position", min_items=1, unique="position_id")
+    })
+
+VOTE_SCHEMA = Schema({
+        "election_code": Field(str, checks=[(bool, "{label} must not be empty.")]),
+        "student_id": Field(str, checks=[(valid_student_id, "Student ID is not valid.")]),
+        "candidate_id": Field(str, checks=[(valid_student_id, "Candidate ID is not valid.")])
+    })
+
+
+def schema_error(errors):
+    """returns the response describing the validation errors of request data
+
+    Args:
+        errors (list): the messages returned by a schema (see Schema.errors)
+
+    Returns:
+        dict: the first message (message) and all the messages (errors), or None if there are none
+    """
+    
+    if not errors:
+        return None
+    return {"message": errors[0], "errors": errors}
+
+
+def voter_info_error(voter_info):
+    """ensures that a voter's information contains all necessary keys and that
+    student_id, firstname, lastname and email are syntactically valid (see VOTER_SCHEMA)
+
+    Args:
+        voter_info (dict): a dictionary containing voter information
+
+    Returns:
+        dict: the messages describing why the information is not valid (see schema_error),
+        or None if it is valid
+    """
+    
+    return schema_error(VOTER_SCHEMA.errors(voter_info))
+
+
+
+def read_voter_rows(request):
+    """parses a streamed request body of voters one row at a time, without
+    reading the whole body into memory. The body is read as CSV (with a header row)
+    if its content type is text/csv and as NDJSON (one JSON object per line) otherwise
+
+    Args:
+        request (tuple): request from client
+
+    Returns:
+        generator: tuples of the row number and the voter's information (dict),
+        which is None if the row could not be parsed
+    """
+    
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8")
+    
+    if request.mimetype == "text/csv":
+        for row_number, row in enumerate(csv.DictReader(lines), start=1):
+            # drop missing values (short rows) and values without a header (long rows)
+            yield row_number, {key: value for key, value in row.items() if key is not None and value is not None}
+        return
+    
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        
+        try:
+            voter_info = decode_json(line)
+        except ValueError:
+            voter_info = None
+        
+        yield row_number, voter_info if isinstance(voter_info, dict) else None
+
+
 def valid_voter_info(request, unique_keys):
     """ensures that a voter request data is valid
     i.e. contains all necessary keys, contains unique values for
@@ -130,49 +654,28 @@ def valid_voter_info(request, unique_keys):
         return jsonify({"message": "Voter information missing!"}), 400
     
     # get request data
-    voter_info = json.loads(request.data)
+    voter_info = request_json(request)
     
-    # ensure that the data contains all expected fields
+    # ensure that the voter's information is syntactically valid
     # if validation fails, return appropriate message
-    # expected keys
-    VOTERS_KEYS = [
-            "student_id", "firstname", "lastname", "email"
-        ]
-    
-    validate_data = valid_keys(voter_info, VOTERS_KEYS)
-    if validate_data["is_valid"] == False:
-        return jsonify(validate_data["message"]), 400
-    
-    # ensure that the student_id is synctactically correct since
-    # the system assumes a certain format for later computation
-    student_id_is_valid = valid_student_id(voter_info["student_id"])
-    if not student_id_is_valid:
-        return jsonify({"message": "Student ID is not valid."}), 400
-    elif int(student_id_is_valid["year_group"]) < FIRST_YEAR_GROUP:
-        return jsonify({"message": "Student year group is invalid."})
-    
-    # ensure that the email is a valid ashesi email
-    if not voter_info["email"].endswith("@ashesi.edu.gh"):
-        return jsonify({"message": "Email must be a valid Ashesi email address."}), 400
-    
-    # ensure that firstname and lastname is valid (is a string)
-    if not str(voter_info["firstname"]).isalpha() or not str(voter_info["lastname"]).isalpha():
-        return jsonify({"message": "Firstname or Lastname must be a string."}), 400
-    
-    # reading existing data into a list
-    voters_data = VOTERS_COLLECTION.get()
+    error = voter_info_error(voter_info)
+    if error is not None:
+        return jsonify(error), 400
     
-    # if no voter has been registered, skip unique test
-    if len(voters_data) == 0:
-        return {"data": voter_info}
+    # read only the voters that could conflict with the unique keys
+    # (the voter with the same student id and voters with the same email)
+    # into an indexed registry
+    registry = VoterRegistry()
+    voter = get_document(voters_collection(), voter_info["student_id"])
+    if voter is not None:
+        registry[voter["student_id"]] = voter
+    for voter in voters_collection().where("email", "==", voter_info["email"]).stream():
+        voter = voter.to_dict()
+        registry[voter["student_id"]] = voter
     
     # ensure keys are unique
     # if unique contraints fails, return appropriate response
-    data_list = list()
-    for document in voters_data:
-        data_list.append(document.to_dict())
-    
-    ununique_result = key_is_unique(unique_keys, data_list, voter_info)
+    ununique_result = voter_key_is_unique(unique_keys, registry, voter_info)
     if len(ununique_result) > 0:
         return jsonify(ununique_result), 400
     
@@ -180,23 +683,182 @@ def valid_voter_info(request, unique_keys):
 
 
 def get_voters(id_list):
+    """ensures that all voters with the given student ids are registered
+
+    Args:
+        id_list (list): a list of student ids
+
+    Returns:
+        dict: the matching voters keyed by student id, or False if any of them
+        is missing or has been de-registered
+    """
+    
+    # read all the voters in a single batched request
+    return _registered_voters(id_list, get_documents(voters_collection(), id_list))
+
+
+async def get_voters_async(id_list):
+    """ensures that all voters with the given student ids are registered, reading them
+    with the asynchronous client (see get_voters)
+
+    Args:
+        id_list (list): a list of student ids
+
+    Returns:
+        dict: the matching voters keyed by student id, or False if any of them
+        is missing or has been de-registered
+    """
     
-    result_list = list()
+    references = [async_voters_collection().document(student_id) for student_id in set(id_list)]
+    voters_data = {
+        snapshot.id: snapshot.to_dict() 
+        async for snapshot in get_async_database().get_all(references) if snapshot.exists
+    }
+    return _registered_voters(id_list, voters_data)
+
+
+def _registered_voters(id_list, voters_data):
     return_data = dict()
-    # read voters database
-    voters_data = VOTERS_COLLECTION.get()
+    for student_id in id_list:
+        voter = voters_data.get(student_id)
+        if voter is None or bool(voter["is_registered"]) == False:
+            return False
+        return_data[student_id] = voter
+
+    return return_data
+
+
+def page_arguments(request):
+    """reads the pagination and projection arguments of a request retrieving voters:
+    limit (the maximum number of voters to return), cursor (the student id of the last
+    voter of the previous page) and fields (comma separated attributes to return)
+
+    Args:
+        request (Request): the request being sent to the API
+
+    Returns:
+        dict: limit, cursor and fields (None if not provided) or a JSON response
+        of the invalid argument
+    """
     
-    if not voters_data:
-        return {"message": "No voter has been registered!"}
+    limit = request.args.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= MAX_PAGE_SIZE:
+            return jsonify({"message": f"limit must be a number from 1 to {MAX_PAGE_SIZE}."}), 400
+        limit = int(limit)
     
-    for voter in voters_data:
-        voter = voter.to_dict()
-        if voter["student_id"] in id_list and bool(voter["is_registered"]) == True:
-            result_list.append(voter)
-            if len(result_list) == len(id_list):
-                return return_data
+    cursor = request.args.get("cursor")
+    if cursor is not None and not valid_student_id(cursor):
+        return jsonify({"message": "cursor must be a valid student id."}), 400
+    
+    fields = request.args.get("fields")
+    if fields is not None:
+        fields = fields.split(",")
+        invalid_fields = [field for field in fields if field not in VOTER_FIELDS]
+        if invalid_fields:
+            return jsonify({"message": f"Invalid fields: {', '.join(invalid_fields)}."}), 400
+    
+    return {"limit": limit, "cursor": cursor, "fields": fields}
+
+
+def split_page(voters, limit):
+    """splits a page of voters from voters read past the page (at least limit + 1 of them
+    if there is a next page)
+
+    Args:
+        voters (iterable): voters (dict) ordered by student id
+        limit (int): the page size, or None for a single page of all voters
+
+    Returns:
+        tuple: the page (an iterable of all voters if limit is None, otherwise a list)
+        and the cursor of the next page (None if it is the last page)
+    """
+    
+    if limit is None:
+        return voters, None
+    
+    voters = list(voters)
+    if len(voters) <= limit:
+        return voters, None
+    return voters[:limit], voters[limit - 1]["student_id"]
+
+
+def paginate(voters, cursor=None, limit=None):
+    """returns a page of voters ordered by student id
+
+    Args:
+        voters (list): a list of voters (dict)
+        cursor (str): the student id of the last voter of the previous page
+        limit (int): the page size
+
+    Returns:
+        tuple: the page (list) and the cursor of the next page (None if it is the last page)
+    """
+    
+    voters = sorted(voters, key=lambda voter: voter["student_id"])
+    if cursor is not None:
+        voters = [voter for voter in voters if voter["student_id"] > cursor]
+    return split_page(voters, limit)
+
+
+def voters_response(voters, next_cursor=None, fields=None):
+    """returns the JSON response of a page of voters, with only the requested
+    fields and the cursor of the next page in the X-Next-Cursor header
+
+    Args:
+        voters (iterable): voters (dict)
+        next_cursor (str): the cursor of the next page (None if it is the last page)
+        fields (list): the voter attributes to return (None for all of them)
+
+    Returns:
+        Response: the streamed JSON response
+    """
+    
+    if fields is not None:
+        voters = ({field: voter[field] for field in fields if field in voter} for voter in voters)
+    
+    response = stream_json_array(voters)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
 
-    return False
+def peek(items):
+    """reads the first of the given items, to find out whether there are any
+    without reading the others
+
+    Args:
+        items (iterable): the items
+
+    Returns:
+        iterator: an iterator over all the items, or None if there are none
+    """
+    
+    items = iter(items)
+    for first in items:
+        return itertools.chain([first], items)
+    return None
+
+
+def stream_json_array(items):
+    """returns a response that streams the given items as a JSON array, serializing
+    (and reading, if items is a generator) one item at a time, so that neither the
+    list nor its serialized form is held in memory
+
+    Args:
+        items (iterable): JSON serializable items
+
+    Returns:
+        Response: the streamed JSON response
+    """
+    
+    def serialize():
+        yield "["
+        for index, item in enumerate(items):
+            yield ("," if index else "") + current_app.json.dumps(item, separators=(",", ":"))
+        yield "]\n"
+    
+    return Response(stream_with_context(serialize()), mimetype="application/json")
 
 
 def compute_time(time_period):
@@ -227,6 +889,358 @@ def get_end_date(election):
 
 
 def get_remaining_time(election):
+    # pytz is only imported by the requests that need it
+    from pytz import timezone
+    
     zone_name = "Africa/Accra"
     current_time = timezone(zone_name)
-    return str(election["election_end_date"] - current_time)
\ No newline at end of file
+    return str(election["election_end_date"] - current_time)
+
+
+def voter_document(voter_info):
+    """returns the document stored for a voter: the voter's information plus
+    the year group and the lowercased search fields used by Firestore queries
+
+    Args:
+        voter_info (dict): a dictionary containing voter information
+
+    Returns:
+        dict: the voter document
+    """
+    
+    document = voter_from_document(voter_info)
+    document["year_group"] = valid_student_id(voter_info["student_id"])["year_group"]
+    for field, search_field in SEARCH_FIELDS.items():
+        document[search_field] = str(voter_info[field]).lower()
+    
+    return document
+
+
+def voter_from_document(document):
+    """removes the derived fields from a stored voter document
+
+    Args:
+        document (dict): a voter document
+
+    Returns:
+        dict: the voter's information
+    """
+    
+    return {key: value for key, value in document.items() if key not in DERIVED_VOTER_FIELDS}
+
+
+def voters_query(filter_dict):
+    """translates validated retrieve_voters filters into a Firestore query so
+    that only matching documents are transferred.
+    student_id, email, year_group and is_registered become equality filters and
+    the first name prefix becomes a range filter on its lowercased search field.
+    Firestore only allows range filters on one field per query, so any other name
+    prefix has to be applied to the query's results
+
+    Args:
+        filter_dict (dict): maps a voter attribute to the value to filter by
+
+    Returns:
+        Query: the Firestore query
+    """
+    
+    query = voters_collection()
+    range_field = None
+    
+    for key, value in filter_dict.items():
+        if key in ["student_id", "year_group", "is_registered"]:
+            query = query.where(key, "==", value)
+        
+        # emails are validated as complete Ashesi addresses, so a prefix match is an equality
+        elif key == "email":
+            query = query.where(SEARCH_FIELDS[key], "==", value.lower())
+        
+        elif range_field is None:
+            range_field = SEARCH_FIELDS[key]
+            prefix = value.lower()
+            query = query.where(range_field, ">=", prefix).where(range_field, "<", prefix + "\uf8ff")
+    
+    return query
+
+
+def deregister_voters(student_ids):
+    """sets is_registered to False on the given voters with partial updates
+    (only that field is sent) applied in batches, logging progress after each batch
+
+    Args:
+        student_ids (list): the student ids of the voters
+    """
+    
+    def log_progress(num_written):
+        logger.info("De-registered %d of %d voters", num_written, len(student_ids))
+    
+    write_voters(
+        (("update", voters_collection().document(student_id), {"is_registered": False}) for student_id in student_ids),
+        on_commit=log_progress
+    )
+
+
+def write_voters(operations, on_commit=None):
+    """applies write operations to voter documents with batch_write, incrementing the
+    voters version in every batch so that the voter lists cached by clients are no longer
+    valid once the voters are written, and never before (see voters_version)
+
+    Args:
+        operations (iterable): the write operations, as taken by batch_write
+        on_commit (function): called with the number of operations applied so far
+        after each batch is committed
+
+    Returns:
+        int: the number of applied operations
+    """
+    
+    return batch_write(operations, on_commit, each_batch=voters_changed)
+
+
+def voters_changed():
+    # increments a random shard of the voters version, so that no document takes every voter write
+    from firebase_admin import firestore
+    
+    shard = voters_version_collection().document(str(random.randrange(VERSION_SHARDS)))
+    return ("set", shard, {"version": firestore.Increment(1)}, True)
+
+
+def voters_version():
+    """reads the voters version, which changes whenever voters are written
+
+    Returns:
+        int: the voters version, the sum of its shards
+    """
+    
+    return sum(shard.to_dict().get("version", 0) for shard in voters_version_collection().stream())
+
+
+def backfill_voter_documents():
+    """adds the derived fields to voter documents written before they were introduced,
+    so that they can be found by voters_query. Run once after deploying, e.g.
+    python -c "import helper; helper.backfill_voter_documents()"
+
+    Returns:
+        int: the number of updated documents
+    """
+    
+    return batch_write(
+        ("set", snapshot.reference, voter_document(snapshot.to_dict()))
+        for snapshot in voters_collection().stream()
+        if not all(field in snapshot.to_dict() for field in DERIVED_VOTER_FIELDS)
+    )
+
+
+def ballots_collection(election_code):
+    """returns the subcollection holding an election's ballots, one document per
+    position and voter (see ballot_id)"""
+    
+    return elections_collection().document(election_code).collection("ballots")
+
+
+def tallies_collection(election_code):
+    """returns the subcollection holding an election's vote counts, TALLY_SHARDS documents
+    (<position_id>_<shard>) per position mapping each candidate id to the votes counted
+    by the shard (and position_id to the position's id), summed by sum_tallies"""
+    
+    return elections_collection().document(election_code).collection("tallies")
+
+
+def tally_shard(election_code, position_id):
+    # votes are spread over the position's shards so that no document takes every vote
+    return tallies_collection(election_code).document(f"{position_id}_{random.randrange(TALLY_SHARDS)}")
+
+
+def sum_tallies(tallies):
+    """adds up the vote counts of the shards of each position
+
+    Args:
+        tallies (iterable): the documents of an election's tallies subcollection
+        (documents written before the counts were sharded are named after their position)
+
+    Returns:
+        dict: maps a position id to a dict of candidate id -> number of votes
+    """
+    
+    positions = dict()
+    for tally in tallies:
+        counts = tally.to_dict()
+        candidates = positions.setdefault(counts.pop("position_id", tally.id), dict())
+        for candidate_id, num_votes in counts.items():
+            candidates[candidate_id] = candidates.get(candidate_id, 0) + num_votes
+    return positions
+
+
+def ballot_id(position_id, student_id):
+    # a student can only cast one ballot per position of an election
+    return f"{position_id}_{student_id}"
+
+
+def get_tallies(election_code):
+    """reads the vote counts of an election
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        dict: maps a position id to a dict of candidate id -> number of votes
+    """
+    
+    return sum_tallies(tallies_collection(election_code).stream())
+
+
+async def get_tallies_async(election_code):
+    """reads the vote counts of an election with the asynchronous client (see get_tallies)
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        dict: maps a position id to a dict of candidate id -> number of votes
+    """
+    
+    tallies = async_elections_collection().document(election_code).collection("tallies")
+    return sum_tallies([tally async for tally in tallies.stream()])
+
+
+def attach_tallies(election, tallies):
+    """sets each candidate's number of votes on an election, replacing the list of
+    voters kept on each candidate of elections created before ballots were stored separately
+
+    Args:
+        election (dict): an election (modified in place)
+        tallies (dict): maps a position id to a dict of candidate id -> number of votes
+
+    Returns:
+        dict: the election
+    """
+    
+    for position in election["positions"]:
+        counts = tallies.get(position["position_id"], dict())
+        for candidate in position["candidates"]:
+            legacy_votes = len(candidate.pop("candidate_voters", []))
+            candidate["num_votes"] = counts.get(candidate["candidate_id"], 0) + legacy_votes
+    
+    return election
+
+
+def election_results(election, tallies):
+    """summarises an election's vote counts: each position's candidates with their
+    number of votes, the position's turnout (number of ballots cast) and its leader(s)
+
+    Args:
+        election (dict): an election
+        tallies (dict): maps a position id to a dict of candidate id -> number of votes
+
+    Returns:
+        dict: the election's results
+    """
+    
+    positions = list()
+    for position in attach_tallies(election, tallies)["positions"]:
+        candidates = [
+            {"candidate_id": candidate["candidate_id"], "num_votes": candidate["num_votes"]}
+            for candidate in position["candidates"]
+        ]
+        turnout = sum(candidate["num_votes"] for candidate in candidates)
+        
+        # all candidates with the most votes lead (ties have several leaders)
+        leader = list()
+        if turnout > 0:
+            most_votes = max(candidate["num_votes"] for candidate in candidates)
+            leader = [candidate["candidate_id"] for candidate in candidates if candidate["num_votes"] == most_votes]
+        
+        positions.append({
+            "position_id": position["position_id"], "position_name": position["position_name"],
+            "candidates": candidates, "turnout": turnout, "leader": leader
+        })
+    
+    return {
+        "election_code": election["election_code"], "election_name": election["election_name"],
+        "positions": positions
+    }
+
+
+def read_election(election_code):
+    """reads an election with the number of votes of each of its candidates, and its
+    ETag, derived from the update times of the election and vote count documents
+
+    Args:
+        election_code (str): the election's code
+
+    Returns:
+        dict: the election (election) and its ETag (etag) or None if the election does not exist
+    """
+    
+    election = elections_collection().document(election_code).get()
+    if not election.exists:
+        return None
+    
+    tallies = list(tallies_collection(election_code).stream())
+    return {
+        "election": attach_tallies(election.to_dict(), sum_tallies(tallies)),
+        "etag": make_etag(election_code, election.update_time, *sorted((tally.id, tally.update_time) for tally in tallies))
+    }
+
+
+# elections with their vote counts and ETags, read through the cache by retrieve_election
+election_cache = ReadThroughCache(read_election, max_size=ELECTION_CACHE_SIZE, ttl=ELECTION_CACHE_TTL)
+
+
+def _cast_ballot(transaction, ballot_reference, tally_reference, ballot):
+    from firebase_admin import firestore
+    
+    # reads inside a transaction make Firestore abort and retry the transaction
+    # if the ballot is written by a concurrent vote before this one commits
+    if ballot_reference.get(transaction=transaction).exists:
+        return False
+    
+    transaction.create(ballot_reference, ballot)
+    transaction.set(tally_reference, {"position_id": ballot["position_id"], ballot["candidate_id"]: firestore.Increment(1)}, merge=True)
+    return True
+
+
+def cast_ballot(election_code, ballot):
+    """stores a ballot and increments its candidate's vote count in a single
+    transaction, unless the student has already voted for the ballot's position.
+    Concurrent votes only contend when they increment the same shard of the position's
+    vote counts (see tally_shard), and the transaction is retried with exponential
+    backoff if it keeps failing due to contention
+
+    Args:
+        election_code (str): the election's code
+        ballot (dict): the ballot (position_id, student_id and candidate_id)
+
+    Returns:
+        bool: whether or not the ballot was cast (False if the student already voted)
+    """
+    
+    from firebase_admin import firestore
+    
+    ballot_reference = ballots_collection(election_code).document(ballot_id(ballot["position_id"], ballot["student_id"]))
+    tally_reference = tally_shard(election_code, ballot["position_id"])
+    
+    for retry in range(VOTE_RETRIES):
+        try:
+            is_cast = firestore.transactional(_cast_ballot)(get_database().transaction(), ballot_reference, tally_reference, ballot)
+            if is_cast:
+                count_writes()
+            return is_cast
+        
+        # raised when the transaction could not be committed in its allowed attempts
+        except ValueError:
+            if retry == VOTE_RETRIES - 1:
+                raise
+            time.sleep(random.uniform(0, 0.05 * 2 ** retry))
+
+
+def delete_election_data(election_code):
+    """deletes an election's ballots and vote counts, which Firestore does not
+    delete with the election document
+
+    Args:
+        election_code (str): the election's code
+    """
+    
+    for collection in [ballots_collection(election_code), tallies_collection(election_code)]:
+        batch_write(("delete", document) for document in collection.list_documents())